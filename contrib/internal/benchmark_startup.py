@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+# Measures how long post-review takes to start, for --help and for
+# --output-diff against a stub server and SCM client. Each is run once
+# cold (with no .pyc files or caches) and then several times warm.
+#
+# This isn't part of the test suite, since wall-clock timings aren't
+# reliable on a loaded machine. Run it before and after changes that
+# affect startup, on an otherwise idle machine.
+#
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# Runs post-review with a client that always finds a repository.
+SCRIPT = """
+import sys
+from rbtools import clients
+from rbtools.clients import RepositoryInfo, SCMClient
+class StubClient(SCMClient):
+    def get_repository_info(self):
+        return RepositoryInfo(path="/stub", base_path="/")
+    def diff(self, args):
+        return "Index: stub\\n", None
+clients.SCMCLIENTS = [StubClient()]
+from rbtools.postreview import main
+sys.argv = ["post-review"] + sys.argv[1:]
+main()
+"""
+
+
+class StubServerRequestHandler(BaseHTTPRequestHandler):
+    """Serves just enough of the API for post-review --output-diff."""
+    RESOURCES = {
+        '/api/': {
+            'stat': 'ok',
+            'links': {
+                'info': {
+                    'href': '/api/info/',
+                    'method': 'GET',
+                },
+            },
+        },
+        '/api/info/': {
+            'stat': 'ok',
+            'info': {
+                'product': {
+                    'package_version': '1.6',
+                },
+            },
+        },
+    }
+
+    def do_GET(self):
+        body = json.dumps(self.RESOURCES[self.path])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def remove_compiled_files():
+    for dirpath, dirnames, filenames in os.walk(os.path.join(ROOT_DIR,
+                                                             'rbtools')):
+        for filename in filenames:
+            if filename.endswith('.pyc') or filename.endswith('.pyo'):
+                os.unlink(os.path.join(dirpath, filename))
+
+
+def run_post_review(args, env):
+    start_time = time.time()
+    p = subprocess.Popen([sys.executable, '-c', SCRIPT] + args,
+                         stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE,
+                         env=env)
+    output, errors = p.communicate()
+    elapsed = time.time() - start_time
+
+    if p.returncode != 0:
+        sys.stderr.write('post-review %s failed:\n%s' %
+                         (' '.join(args), errors))
+        sys.exit(1)
+
+    return elapsed
+
+
+def benchmark(name, args, runs):
+    home = tempfile.mkdtemp()
+
+    try:
+        env = os.environ.copy()
+        env['HOME'] = home
+        env['PYTHONPATH'] = ROOT_DIR
+
+        remove_compiled_files()
+        cold = run_post_review(args, env)
+        warm = [run_post_review(args, env) for i in range(runs)]
+    finally:
+        shutil.rmtree(home)
+
+    print '%-16s %9.3fs %9.3fs %9.3fs' % (name, cold, min(warm),
+                                           sum(warm) / len(warm))
+
+    return min(warm)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--runs', type='int', default=5,
+                      help='the number of warm runs of each command')
+    parser.add_option('--threshold', type='float', default=None,
+                      help='fail if the fastest warm run of a command takes '
+                           'longer than this, in seconds')
+    options, args = parser.parse_args()
+
+    httpd = HTTPServer(('127.0.0.1', 0), StubServerRequestHandler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    url = 'http://127.0.0.1:%d/' % httpd.server_address[1]
+
+    print '%-16s %10s %10s %10s' % ('Command', 'Cold', 'Warm min',
+                                    'Warm avg')
+
+    try:
+        timings = [
+            benchmark('--help', ['--help'], options.runs),
+            benchmark('--output-diff', ['--output-diff', '--server', url],
+                      options.runs),
+        ]
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+    if options.threshold is not None and max(timings) > options.threshold:
+        sys.stderr.write('Startup took %.3fs, over %.3fs\n' %
+                         (max(timings), options.threshold))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
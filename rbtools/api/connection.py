@@ -0,0 +1,348 @@
+import httplib
+import logging
+import select
+import socket
+import threading
+import urllib2
+import zlib
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+
+def decode_content(data, encoding):
+    """Decodes a response body sent with the given Content-Encoding."""
+    encoding = (encoding or '').strip().lower()
+
+    if encoding in ('gzip', 'x-gzip'):
+        # Adding 16 to wbits tells zlib to expect a gzip header.
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            # Some servers send a raw deflate stream without the zlib
+            # header.
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+
+    return data
+
+
+class ConnectionPool(object):
+    """A pool of persistent HTTP/1.1 connections, keyed by host.
+
+    A connection is handed out to one request at a time and is put back
+    into the pool once its response has been fully read. Later requests to
+    the same host then reuse the open socket (and, for HTTPS, the already
+    negotiated TLS session) instead of paying for a new handshake.
+    """
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+    def acquire(self, key):
+        """Returns an idle connection for the key, or None if there isn't one.
+        """
+        self._lock.acquire()
+
+        try:
+            self.requests += 1
+            connections = self._idle.get(key)
+
+            if connections:
+                self.connections_reused += 1
+                return connections.pop()
+
+            return None
+        finally:
+            self._lock.release()
+
+    def opened(self, key):
+        """Records that a new connection had to be opened for the key."""
+        self._lock.acquire()
+
+        try:
+            self.connections_opened += 1
+        finally:
+            self._lock.release()
+
+    def release(self, key, connection):
+        """Returns a connection to the pool so that it can be reused."""
+        self._lock.acquire()
+
+        try:
+            self._idle.setdefault(key, []).append(connection)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """Closes all idle connections in the pool."""
+        self._lock.acquire()
+
+        try:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+
+            self._idle = {}
+        finally:
+            self._lock.release()
+
+    def __str__(self):
+        return "%d requests over %d connections (%d reused)" % \
+            (self.requests, self.connections_opened, self.connections_reused)
+
+
+class RequestFailed(Exception):
+    """A request failed on a connection.
+
+    sent says whether the whole request had been written before it failed,
+    in which case the server may have acted on it.
+    """
+    def __init__(self, error, sent):
+        Exception.__init__(self, error)
+        self.error = error
+        self.sent = sent
+
+
+class KeepAliveHandlerMixin(object):
+    """Common support for the keep-alive HTTP and HTTPS handlers.
+
+    urllib2's own handlers force "Connection: close" on every request, since
+    the file object they return can't cope with a persistent socket. We
+    instead read the whole response up front, hand the connection back to
+    the pool, and return the body in a StringIO. Everything else (cookies,
+    authentication, proxies, error processing) is left to the other
+    handlers in the opener, as before.
+
+    Since the body is read here anyway, these handlers also ask for gzip or
+    deflate compressed responses and decode them, so callers always see
+    the plain body.
+
+    A request that fails on a reused connection is sent again on a new one,
+    as the server most likely closed the idle connection. Requests that
+    can't safely be repeated (see IDEMPOTENT_METHODS, which a request's
+    "idempotent" attribute overrides) are only sent again if they failed
+    before they were fully written, and aren't sent over a pooled
+    connection the server has already closed.
+    """
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+    def do_keepalive_open(self, connection_class, req, **connection_args):
+        host = req.get_host()
+
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        tunnel_host = getattr(req, '_tunnel_host', None)
+        key = (req.get_type(), host, tunnel_host)
+
+        headers = dict(req.unredirected_hdrs)
+
+        for name, value in req.headers.items():
+            if name not in headers:
+                headers[name] = value
+
+        headers['Connection'] = 'keep-alive'
+        headers = dict([(name.title(), value)
+                        for name, value in headers.items()])
+        headers.setdefault('Accept-Encoding', 'gzip, deflate')
+
+        tunnel_headers = {}
+
+        if tunnel_host and 'Proxy-Authorization' in headers:
+            # Proxy-Authorization should not be sent to the origin server.
+            tunnel_headers['Proxy-Authorization'] = \
+                headers.pop('Proxy-Authorization')
+
+        if hasattr(req, 'timeout'):
+            # Python 2.6+
+            connection_args['timeout'] = req.timeout
+
+        idempotent = getattr(req, 'idempotent', None)
+
+        if idempotent is None:
+            idempotent = req.get_method() in self.IDEMPOTENT_METHODS
+
+        connection = self.pool.acquire(key)
+        reused = connection is not None
+
+        if reused and not idempotent and self._is_dropped(connection):
+            logging.debug('Pooled HTTP connection to %s was closed' % host)
+            connection.close()
+            reused = False
+
+        if reused:
+            logging.debug('Reusing HTTP connection to %s' % host)
+        else:
+            connection = self._open_connection(connection_class, key,
+                                               tunnel_headers,
+                                               connection_args)
+
+        try:
+            response = self._send_request(connection, req, headers)
+        except RequestFailed, e:
+            connection.close()
+
+            if not reused or (e.sent and not idempotent):
+                raise urllib2.URLError(e.error)
+
+            # The server most likely dropped the idle connection between
+            # requests. Try once more on a fresh one.
+            logging.debug('Reused HTTP connection to %s failed (%s), '
+                          'reconnecting' % (host, e.error))
+            connection = self._open_connection(connection_class, key,
+                                               tunnel_headers,
+                                               connection_args)
+
+            try:
+                response = self._send_request(connection, req, headers)
+            except RequestFailed, e:
+                connection.close()
+                raise urllib2.URLError(e.error)
+
+        try:
+            body = response.read()
+        except (socket.error, httplib.HTTPException), e:
+            connection.close()
+            raise urllib2.URLError(e)
+
+        encoding = response.getheader('Content-Encoding')
+
+        if encoding:
+            try:
+                body = decode_content(body, encoding)
+            except zlib.error, e:
+                raise urllib2.URLError('Unable to decode %s response: %s' %
+                                       (encoding, e))
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.release(key, connection)
+
+        result = urllib2.addinfourl(StringIO(body), response.msg,
+                                    req.get_full_url())
+        result.code = response.status
+        result.msg = response.reason
+
+        return result
+
+    def _open_connection(self, connection_class, key, tunnel_headers,
+                         connection_args):
+        connection_type, host, tunnel_host = key
+        logging.debug('Opening HTTP connection to %s' % host)
+
+        connection = connection_class(host, **connection_args)
+        connection.set_debuglevel(self._debuglevel)
+
+        if tunnel_host:
+            connection.set_tunnel(tunnel_host, headers=tunnel_headers)
+
+        self.pool.opened(key)
+
+        return connection
+
+    def _is_dropped(self, connection):
+        """Returns whether the server has closed a pooled connection.
+
+        An idle connection has nothing to read unless the server has closed
+        it (or sent something unexpected, which makes it unusable anyway).
+        """
+        sock = connection.sock
+
+        if sock is None:
+            # It will be reconnected when it's used.
+            return False
+
+        try:
+            return bool(select.select([sock], [], [], 0)[0])
+        except (select.error, socket.error, ValueError):
+            return True
+
+    def _send_request(self, connection, req, headers):
+        """Sends a request and returns the response.
+
+        Raises RequestFailed if the request can't be sent or the response
+        can't be read.
+        """
+        try:
+            self._write_request(connection, req, headers)
+        except (socket.error, httplib.HTTPException), e:
+            raise RequestFailed(e, sent=False)
+
+        try:
+            try:
+                return connection.getresponse(buffering=True)
+            except TypeError:
+                # The buffering keyword isn't supported before Python 2.7.
+                return connection.getresponse()
+        except (socket.error, httplib.HTTPException), e:
+            raise RequestFailed(e, sent=True)
+
+    def _write_request(self, connection, req, headers):
+        data = req.get_data()
+
+        if data is None or isinstance(data, basestring):
+            connection.request(req.get_method(), req.get_selector(), data,
+                               headers)
+        else:
+            # The body is an iterable of chunks (such as a MultipartBody),
+            # with its Content-Length already known. Write each chunk out
+            # as we get it, rather than joining them into one string.
+            skips = {}
+
+            if 'Host' in headers:
+                skips['skip_host'] = True
+
+            if 'Accept-Encoding' in headers:
+                skips['skip_accept_encoding'] = True
+
+            connection.putrequest(req.get_method(), req.get_selector(),
+                                  **skips)
+
+            for name, value in headers.items():
+                connection.putheader(name, value)
+
+            connection.endheaders()
+
+            for chunk in data:
+                connection.send(chunk)
+
+
+class KeepAliveHTTPHandler(KeepAliveHandlerMixin, urllib2.HTTPHandler):
+    """urllib2 handler for http:// URLs that reuses pooled connections."""
+    def __init__(self, pool, debuglevel=0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+    def http_open(self, req):
+        return self.do_keepalive_open(httplib.HTTPConnection, req)
+
+
+if hasattr(urllib2, 'HTTPSHandler'):
+    class KeepAliveHTTPSHandler(KeepAliveHandlerMixin, urllib2.HTTPSHandler):
+        """urllib2 handler for https:// URLs that reuses pooled connections.
+        """
+        def __init__(self, pool, debuglevel=0):
+            urllib2.HTTPSHandler.__init__(self, debuglevel)
+            self.pool = pool
+
+        def https_open(self, req):
+            connection_args = {}
+
+            # Python 2.7.9+ supports passing an SSL context.
+            context = getattr(self, '_context', None)
+
+            if context is not None:
+                connection_args['context'] = context
+
+            return self.do_keepalive_open(httplib.HTTPSConnection, req,
+                                          **connection_args)
+else:
+    KeepAliveHTTPSHandler = None
@@ -0,0 +1,82 @@
+import cookielib
+import os
+import tempfile
+
+from rbtools.utils.filesystem import replace_file
+
+
+class PersistentCookieJar(cookielib.MozillaCookieJar):
+    """A Mozilla cookie jar that only writes to disk when it has changed.
+
+    Cookies set by the server are kept in memory, and the jar is marked as
+    changed only if a cookie is new or differs from the one already stored.
+    Calling flush() writes the file at most once, no matter how many
+    responses were processed. The file is written to a temporary file in
+    the same directory and renamed into place, so a concurrent post-review
+    process will never see (or clobber) a half-written cookie file.
+    """
+    def __init__(self, filename=None, *args, **kwargs):
+        cookielib.MozillaCookieJar.__init__(self, filename, *args, **kwargs)
+        self.changed = False
+
+    def load(self, *args, **kwargs):
+        cookielib.MozillaCookieJar.load(self, *args, **kwargs)
+
+        # Loading goes through set_cookie, but what's in memory now matches
+        # what's on disk.
+        self.changed = False
+
+    def set_cookie(self, cookie):
+        try:
+            old = self._cookies[cookie.domain][cookie.path][cookie.name]
+        except KeyError:
+            old = None
+
+        if (old is None or
+            old.value != cookie.value or
+            old.expires != cookie.expires or
+            old.secure != cookie.secure or
+            old.discard != cookie.discard):
+            self.changed = True
+
+        cookielib.MozillaCookieJar.set_cookie(self, cookie)
+
+    def clear(self, *args, **kwargs):
+        cookielib.MozillaCookieJar.clear(self, *args, **kwargs)
+        self.changed = True
+
+    def save(self, filename=None, *args, **kwargs):
+        if filename is None:
+            filename = self.filename
+
+        if filename is None:
+            raise ValueError(cookielib.MISSING_FILENAME_TEXT)
+
+        fd, tmpfile = tempfile.mkstemp(prefix='.post-review-cookies',
+                                       dir=os.path.dirname(filename) or '.')
+        os.close(fd)
+
+        try:
+            cookielib.MozillaCookieJar.save(self, tmpfile, *args, **kwargs)
+            replace_file(tmpfile, filename)
+        except:
+            try:
+                os.unlink(tmpfile)
+            except OSError:
+                pass
+
+            raise
+
+        self.changed = False
+
+    def flush(self):
+        """Saves the cookie file if any cookies have changed.
+
+        Returns True if the file was written.
+        """
+        if not self.changed or not self.filename:
+            return False
+
+        self.save()
+
+        return True
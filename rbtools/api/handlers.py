@@ -0,0 +1,149 @@
+import base64
+import getpass
+import urllib2
+from urlparse import urlparse
+
+from rbtools.utils.process import die
+
+
+class HTTPRequest(urllib2.Request):
+    def __init__(self, url, body='', headers={}, method="PUT"):
+        urllib2.Request.__init__(self, url, body, headers)
+        self.method = method
+
+    def get_method(self):
+        return self.method
+
+
+class PresetHTTPAuthHandler(urllib2.BaseHandler):
+    """urllib2 handler that conditionally presets the use of HTTP Basic Auth.
+
+    This is used when specifying --username= on the command line. It will
+    force an HTTP_AUTHORIZATION header with the user info, asking the user
+    for any missing info beforehand. It will then try this header for that
+    first request.
+
+    It will only do this once.
+    """
+    handler_order = 480 # After Basic auth
+
+    def __init__(self, url, password_mgr, options):
+        self.url = url
+        self.password_mgr = password_mgr
+        self.options = options
+        self.used = False
+
+    def reset(self):
+        self.password_mgr.rb_user = self.options.http_username
+        self.password_mgr.rb_pass = self.options.http_password
+        self.used = False
+
+    def http_request(self, request):
+        if self.options.username and not self.used:
+            # Note that we call password_mgr.find_user_password to get the
+            # username and password we're working with. This allows us to
+            # prompt if, say, --username was specified but --password was not.
+            username, password = \
+                self.password_mgr.find_user_password('Web API', self.url)
+            raw = '%s:%s' % (username, password)
+            request.add_header(
+                urllib2.HTTPBasicAuthHandler.auth_header,
+                'Basic %s' % base64.b64encode(raw).strip())
+            self.used = True
+
+        return request
+
+    https_request = http_request
+
+
+class ReviewBoardHTTPErrorProcessor(urllib2.HTTPErrorProcessor):
+    """Processes HTTP error codes.
+
+    Python 2.6 gets HTTP error code processing right, but 2.4 and 2.5 only
+    accepts HTTP 200 and 206 as success codes. This handler ensures that
+    anything in the 200 range is a success.
+    """
+    def http_response(self, request, response):
+        if not (200 <= response.code < 300):
+            response = self.parent.error('http', request, response,
+                                         response.code, response.msg,
+                                         response.info())
+
+        return response
+
+    https_response = http_response
+
+
+class ReviewBoardHTTPBasicAuthHandler(urllib2.HTTPBasicAuthHandler):
+    """Custom Basic Auth handler that doesn't retry excessively.
+
+    urllib2's HTTPBasicAuthHandler retries over and over, which is useless.
+    This subclass only retries once to make sure we've attempted with a
+    valid username and password. It will then fail so we can use
+    tempt_fate's retry handler.
+    """
+    def __init__(self, *args, **kwargs):
+        urllib2.HTTPBasicAuthHandler.__init__(self, *args, **kwargs)
+        self._retried = False
+        self._lasturl = ""
+
+    def retry_http_basic_auth(self, *args, **kwargs):
+        if self._lasturl != args[0]:
+            self._retried = False
+
+        self._lasturl = args[0]
+
+        if not self._retried:
+            self._retried = True
+            self.retried = 0
+            response = urllib2.HTTPBasicAuthHandler.retry_http_basic_auth(
+                self, *args, **kwargs)
+
+            if response.code != 401:
+                self._retried = False
+
+            return response
+        else:
+            return None
+
+
+class ReviewBoardHTTPPasswordMgr(urllib2.HTTPPasswordMgr):
+    """
+    Adds HTTP authentication support for URLs.
+
+    Python 2.4's password manager has a bug in http authentication when the
+    target server uses a non-standard port.  This works around that bug on
+    Python 2.4 installs. This also allows post-review to prompt for passwords
+    in a consistent way.
+
+    See: http://bugs.python.org/issue974757
+    """
+    def __init__(self, reviewboard_url, options, rb_user=None, rb_pass=None):
+        self.passwd  = {}
+        self.rb_url  = reviewboard_url
+        self.options = options
+        self.rb_user = rb_user
+        self.rb_pass = rb_pass
+
+    def find_user_password(self, realm, uri):
+        if realm == 'Web API':
+            if self.rb_user is None or self.rb_pass is None:
+                if self.options.diff_filename == '-':
+                    die('HTTP authentication is required, but cannot be '
+                        'used with --diff-filename=-')
+
+                print "==> HTTP Authentication Required"
+                print 'Enter authorization information for "%s" at %s' % \
+                    (realm, urlparse(uri)[1])
+
+                if not self.rb_user:
+                    self.rb_user = raw_input('Username: ')
+
+                if not self.rb_pass:
+                    self.rb_pass = getpass.getpass('Password: ')
+
+            return self.rb_user, self.rb_pass
+        else:
+            # If this is an auth request for some other domain (since HTTP
+            # handlers are global), fall back to standard password management.
+            return urllib2.HTTPPasswordMgr.find_user_password(self, realm, uri)
@@ -0,0 +1,85 @@
+import threading
+
+from rbtools.utils.cache import FileCache
+
+
+class HTTPCache(object):
+    """A store of HTTP GET responses, used to make conditional requests.
+
+    Response bodies are kept along with their ETag and Last-Modified
+    headers, keyed by the URL and a key identifying the credentials they
+    were fetched with, so that one user's view of a resource is never shown
+    to another. Callers send If-None-Match/If-Modified-Since based on the
+    stored entry, and use the stored body if the server replies with
+    304 Not Modified.
+
+    Each response is stored in its own file (see FileCache), so a 304 only
+    reads the one response, and marking it as recently used doesn't write
+    anything. The total size of the stored responses is limited to
+    max_size bytes. When it's exceeded, the least recently used ones are
+    evicted first. Bodies larger than max_entry_size are never stored.
+    """
+    MAX_SIZE = 10 * 1024 * 1024
+    MAX_ENTRY_SIZE = 1024 * 1024
+
+    def __init__(self, max_size=MAX_SIZE, max_entry_size=MAX_ENTRY_SIZE):
+        self.cache = FileCache('http', max_size)
+        self.max_entry_size = max_entry_size
+        self.requests = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    def get(self, url, credentials):
+        """Returns the stored entry for the URL, or None."""
+        return self.cache.get(self._make_key(url, credentials))
+
+    def add_conditional_headers(self, request, entry):
+        """Adds the headers for a conditional GET of the entry to a request.
+        """
+        self.requests += 1
+
+        if entry.get('etag'):
+            request.add_header('If-None-Match', entry['etag'])
+
+        if entry.get('last_modified'):
+            request.add_header('If-Modified-Since', entry['last_modified'])
+
+    def hit(self, url, credentials, entry):
+        """Records that the server said the entry is still valid.
+
+        Returns the stored body.
+        """
+        self._lock.acquire()
+
+        try:
+            self.hits += 1
+        finally:
+            self._lock.release()
+
+        self.cache.touch(self._make_key(url, credentials))
+
+        return entry['body']
+
+    def store(self, url, credentials, headers, body):
+        """Stores a response, if it has a validator and isn't too large."""
+        etag = headers.getheader('ETag')
+        last_modified = headers.getheader('Last-Modified')
+
+        if not etag and not last_modified:
+            return
+
+        if len(body) > self.max_entry_size:
+            return
+
+        self.cache.set(self._make_key(url, credentials), {
+            'etag': etag,
+            'last_modified': last_modified,
+            'body': body,
+        })
+
+    def _make_key(self, url, credentials):
+        return '%s %s' % (credentials, url)
+
+    def __str__(self):
+        return "%d of %d conditional requests not modified" % \
+            (self.hits, self.requests)
@@ -0,0 +1,116 @@
+import gzip
+import mimetools
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+
+def gzip_content(content):
+    """Returns the content (a string or file object) compressed with gzip."""
+    buf = StringIO()
+    gzip_file = gzip.GzipFile(mode='wb', fileobj=buf)
+
+    if isinstance(content, basestring):
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+
+        gzip_file.write(content)
+    else:
+        while True:
+            chunk = content.read(MultipartBody.CHUNK_SIZE)
+
+            if not chunk:
+                break
+
+            gzip_file.write(chunk)
+
+    gzip_file.close()
+
+    return buf.getvalue()
+
+
+class MultipartBody(object):
+    """A multipart/form-data request body that is streamed in chunks.
+
+    Rather than building the whole body up as one string, this keeps a list
+    of the parts that make it up: the boundaries and headers as small
+    strings, and the file contents as whatever was passed in, either a
+    string or a file object. Iterating over the body yields it in chunks of
+    at most CHUNK_SIZE bytes, and len() gives the total size up front for
+    the Content-Length header, so a large diff is never copied in memory.
+
+    A body can be iterated over more than once (for instance, when a
+    request has to be resent for HTTP authentication).
+
+    Each entry in files is a dictionary with 'filename' and 'content' keys,
+    and optionally a 'content_type' key for the part's Content-Type header.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fields=None, files=None, boundary=None):
+        self.boundary = boundary or mimetools.choose_boundary()
+        self.content_type = 'multipart/form-data; boundary=%s' % self.boundary
+        self._parts = []
+
+        fields = fields or {}
+        files = files or {}
+
+        for key in fields:
+            self._add("--%s\r\n"
+                      "Content-Disposition: form-data; name=\"%s\"\r\n"
+                      "\r\n"
+                      "%s\r\n" % (self.boundary, key, fields[key]))
+
+        for key in files:
+            self._add("--%s\r\n"
+                      "Content-Disposition: form-data; name=\"%s\"; "
+                      "filename=\"%s\"\r\n" %
+                      (self.boundary, key, files[key]['filename']))
+
+            if files[key].get('content_type'):
+                self._add("Content-Type: %s\r\n" % files[key]['content_type'])
+
+            self._add("\r\n")
+            self._add(files[key]['content'])
+            self._add("\r\n")
+
+        self._add("--%s--\r\n\r\n" % self.boundary)
+
+    def _add(self, content):
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+
+        if isinstance(content, str):
+            self._parts.append((content, None, len(content)))
+        else:
+            # A file object. Stream it from its current position.
+            start = content.tell()
+            content.seek(0, 2)
+            self._parts.append((content, start, content.tell() - start))
+            content.seek(start)
+
+    def __len__(self):
+        return sum([length for content, start, length in self._parts])
+
+    def __iter__(self):
+        for content, start, length in self._parts:
+            if start is None:
+                for i in xrange(0, length, self.CHUNK_SIZE):
+                    yield content[i:i + self.CHUNK_SIZE]
+            else:
+                content.seek(start)
+                remaining = length
+
+                while remaining > 0:
+                    chunk = content.read(min(remaining, self.CHUNK_SIZE))
+
+                    if not chunk:
+                        break
+
+                    remaining -= len(chunk)
+                    yield chunk
+
+    def __str__(self):
+        return ''.join(self)
@@ -0,0 +1,42 @@
+class RepositoryIndex(object):
+    """An index of the repositories on a server.
+
+    This allows looking up repositories by their path or mirror path, and
+    listing them by tool, without walking the whole list each time.
+    """
+    def __init__(self, repositories, from_cache=False):
+        self.repositories = repositories
+        self.from_cache = from_cache
+        self._by_path = {}
+        self._by_tool = {}
+
+        for repository in repositories:
+            for key in ('path', 'mirror_path'):
+                path = repository.get(key)
+
+                if path and path not in self._by_path:
+                    self._by_path[path] = repository
+
+            self._by_tool.setdefault(repository.get('tool'), []).append(
+                repository)
+
+    def find_by_path(self, paths):
+        """
+        Returns the first repository whose path or mirror path is one of the
+        given paths (a single path or a list), or None.
+        """
+        if not isinstance(paths, list):
+            paths = [paths]
+
+        for path in paths:
+            if path in self._by_path:
+                return self._by_path[path]
+
+        return None
+
+    def get_by_tool(self, tool):
+        """Returns the list of repositories using the given tool."""
+        return self._by_tool.get(tool, [])
+
+    def __len__(self):
+        return len(self.repositories)
@@ -0,0 +1,131 @@
+import errno
+import random
+import socket
+import threading
+import urllib2
+
+
+class RetryPolicy(object):
+    """Decides whether, and when, to retry a failed HTTP request.
+
+    Requests are retried when the server reports that it's temporarily
+    unavailable (502 Bad Gateway, 503 Service Unavailable or 504 Gateway
+    Timeout), or when the connection is refused, reset or times out. Other
+    connection errors, such as failing to look up the host name or an SSL
+    error, won't go away by trying again, and aren't retried. Each retry waits
+    longer than the last (exponential backoff, capped at max_backoff
+    seconds), with full jitter, so that many clients failing at once don't
+    all come back at the same moment. A Retry-After header from the server
+    is honored, up to max_backoff.
+
+    Only idempotent requests (GET, PUT, DELETE, or a POST that's known to
+    be safe to repeat) are retried when the request may have reached the
+    server. Other POSTs, such as creating a review request or uploading a
+    diff, are only retried on 503, or if the connection was refused, since
+    the server can't have acted on them.
+
+    Each request is retried at most max_retries times, and no more than
+    budget retries are made in total, so a server that's down doesn't
+    stall post-review for too long.
+    """
+    RETRY_STATUSES = (502, 503, 504)
+    UNSENT_RETRY_STATUSES = (503,)
+    RETRY_ERRNOS = (errno.ECONNREFUSED, errno.ECONNRESET, errno.ETIMEDOUT)
+    UNSENT_RETRY_ERRNOS = (errno.ECONNREFUSED,)
+
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=30.0,
+                 budget=10):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.retries = 0
+        self.recovered = 0
+        self.failures = 0
+        self.delay = 0.0
+        self._lock = threading.Lock()
+
+    def get_retry_delay(self, error, attempt, idempotent):
+        """
+        Returns how many seconds to wait before retrying a request that
+        failed with the given URLError on the given attempt (counting from
+        0), or None if it shouldn't be retried.
+
+        A returned delay counts against the retry budget.
+        """
+        if not self._is_retryable(error, idempotent):
+            return None
+
+        self._lock.acquire()
+
+        try:
+            if attempt >= self.max_retries or self.retries >= self.budget:
+                self.failures += 1
+                return None
+
+            delay = self._get_retry_after(error)
+
+            if delay is None:
+                delay = random.uniform(0, min(self.max_backoff,
+                                              self.backoff * 2 ** attempt))
+
+            self.retries += 1
+            self.delay += delay
+
+            return delay
+        finally:
+            self._lock.release()
+
+    def succeeded(self, attempt):
+        """Records that a request succeeded on the given attempt."""
+        if attempt > 0:
+            self._lock.acquire()
+
+            try:
+                self.recovered += 1
+            finally:
+                self._lock.release()
+
+    def _is_retryable(self, error, idempotent):
+        if isinstance(error, urllib2.HTTPError):
+            if idempotent:
+                return error.code in self.RETRY_STATUSES
+            else:
+                return error.code in self.UNSENT_RETRY_STATUSES
+
+        reason = getattr(error, 'reason', None)
+
+        if isinstance(reason, socket.timeout):
+            return idempotent
+
+        # Subclasses of socket.error, such as socket.gaierror and SSL
+        # errors, have their own error codes, which aren't errnos.
+        if (reason.__class__ is not socket.error or not reason.args or
+            not isinstance(reason.args[0], int)):
+            return False
+
+        if idempotent:
+            return reason.args[0] in self.RETRY_ERRNOS
+        else:
+            return reason.args[0] in self.UNSENT_RETRY_ERRNOS
+
+    def _get_retry_after(self, error):
+        headers = getattr(error, 'hdrs', None)
+
+        if not headers:
+            return None
+
+        try:
+            retry_after = headers.get('Retry-After')
+        except AttributeError:
+            return None
+
+        try:
+            return min(self.max_backoff, max(0, int(retry_after)))
+        except (TypeError, ValueError):
+            # An HTTP date, which we don't bother to parse.
+            return None
+
+    def __str__(self):
+        return "%d retries (%d recovered, %d gave up, %.1fs waiting)" % \
+            (self.retries, self.recovered, self.failures, self.delay)
@@ -1,18 +1,48 @@
+import copy
 import logging
+import os
 import sys
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from rbtools.utils.cache import Cache
+from rbtools.utils.diffcache import get_diff_cache, make_diff_key
+from rbtools.utils.filesystem import walk_parents
+from rbtools.utils.parallel import parallel_first
 from rbtools.utils.process import die
 
 
 # The clients are lazy loaded via load_scmclients()
 SCMCLIENTS = None
 
+# How long the client detected for a directory is remembered, as long as
+# none of the clients' marker files change.
+DETECTION_CACHE_TTL = 24 * 60 * 60
+
+_detection_cache = None
+
 
 class SCMClient(object):
     """
     A base representation of an SCM tool for fetching repository information
     and generating diffs.
     """
+    # Files in a working copy (relative to the directory containing them,
+    # such as '.git/HEAD') that change whenever the result of
+    # get_repository_info() may. If these are set, and the client doesn't
+    # depend on anything else (such as the environment or a server), the
+    # result is cached until one of them changes.
+    DETECTION_MARKERS = []
+
+    # Whether get_repository_info() can run alongside the other clients'.
+    # It must not change any process-wide state (such as the current
+    # directory or the environment), and must not print or die(), since it
+    # may keep running after another client has been chosen. Anything like
+    # that belongs in finish_detection() instead.
+    PARALLEL_PROBE = False
 
     def __init__(self, user_config=None, configs=[], options=None):
         self.user_config = user_config
@@ -25,6 +55,54 @@ class SCMClient(object):
     def check_options(self):
         pass
 
+    def get_detection_options(self):
+        """
+        Returns the values of any options that affect what
+        get_repository_info() finds, for the detection cache.
+        """
+        return ()
+
+    def finish_detection(self):
+        """
+        Called once this client has been chosen, either by probing with
+        get_repository_info() or from the detection cache (once its state
+        has been restored). This is where any side effects of choosing the
+        client go, such as changing directory, setting up the environment
+        or checking for tools that are needed later.
+        """
+        pass
+
+    def get_diff_options(self):
+        """
+        Returns the values of any settings that affect the output of a diff,
+        for the diff cache.
+        """
+        return ()
+
+    def get_cached_diff(self, revisions, generate):
+        """
+        Returns the (diff, parent diff) generated from the given immutable
+        revisions (such as commit hashes), using the diff cache if possible.
+
+        On a miss, generate() is called to produce them, and the result is
+        cached.
+        """
+        key = make_diff_key(self.__class__.__name__, tuple(revisions),
+                            self.get_diff_options())
+        diff_cache = get_diff_cache()
+        result = diff_cache.get(key)
+
+        if result is not None:
+            logging.debug('Using the cached diff of %s' % (revisions,))
+            return result
+
+        diff, parent_diff = generate()
+
+        if diff:
+            diff_cache.store(key, diff, parent_diff)
+
+        return diff, parent_diff
+
     def scan_for_server(self, repository_info):
         """
         Scans the current directory on up to find a .reviewboard file
@@ -118,6 +196,14 @@ class RepositoryInfo(object):
         """
         return self
 
+    def forget_server_repository_info(self, server):
+        """
+        Forgets a repository that find_server_repository_info found in a
+        cache, after the server rejected it. Returns True if there was one,
+        in which case looking it up again may find a different repository.
+        """
+        return False
+
 
 def load_scmclients(options):
     global SCMCLIENTS
@@ -165,20 +251,39 @@ def load_scmclients(options):
 
 
 def scan_usable_client(options):
-    from rbtools.clients.perforce import PerforceClient
-
     repository_info = None
     tool = None
 
     if SCMCLIENTS is None:
         load_scmclients(options)
 
-    # Try to find the SCM Client we're going to be working with.
-    for tool in SCMCLIENTS:
-        repository_info = tool.get_repository_info()
-
-        if repository_info:
-            break
+    # Try to find the SCM Client we're going to be working with. If it was
+    # found for this directory before, and none of the files the clients
+    # look at have changed since, we don't need to probe for it again.
+    if options.repository_url:
+        detection_key = None
+        cached = None
+    else:
+        detection_key = '%s\0%r' % (
+            os.getcwd(),
+            [tool.get_detection_options() for tool in SCMCLIENTS])
+        cached = _load_cached_detection(detection_key)
+
+    if cached:
+        i, repository_info, changed_options = cached
+
+        for key, value in changed_options.iteritems():
+            setattr(options, key, value)
+    else:
+        i, repository_info, changed_options = _probe_clients(options)
+
+        if i is not None and detection_key:
+            _save_cached_detection(detection_key, i, repository_info,
+                                   changed_options)
+
+    if i is not None:
+        tool = SCMCLIENTS[i]
+        tool.finish_detection()
 
     if not repository_info:
         if options.repository_url:
@@ -200,10 +305,187 @@ def scan_usable_client(options):
                          "current SCM client.\n")
         sys.exit(1)
 
-    if ((options.p4_client or options.p4_port) and
-        not isinstance(tool, PerforceClient)):
-        sys.stderr.write("The --p4-client and --p4-port options are not valid "
-                         "for the current SCM client.\n")
-        sys.exit(1)
+    if options.p4_client or options.p4_port:
+        from rbtools.clients.perforce import PerforceClient
+
+        if not isinstance(tool, PerforceClient):
+            sys.stderr.write("The --p4-client and --p4-port options are not "
+                             "valid for the current SCM client.\n")
+            sys.exit(1)
 
     return (repository_info, tool)
+
+
+def _probe_clients(options):
+    """
+    Probes the clients for a repository, returning the index of the client
+    found, the repository info and any options that were changed, or
+    (None, None, changed options).
+
+    Consecutive clients that allow it (see SCMClient.PARALLEL_PROBE) are
+    probed concurrently, since some can be slow to give up, but the order
+    of SCMCLIENTS is still the order of priority. The other clients are
+    probed one at a time, and only if no client before them was found.
+
+    Some clients fill in options while probing, so each probe gets its own
+    copy of them. The changes made by the probes that would have run had we
+    gone one at a time are then copied back. Any probes that were cancelled
+    while running keep their copies, so they can't affect us.
+    """
+    orig_options = options.__dict__.copy()
+
+    for tool in SCMCLIENTS:
+        tool.options = copy.copy(options)
+
+    i = None
+    repository_info = None
+    start = 0
+
+    while start < len(SCMCLIENTS):
+        end = start + 1
+
+        if SCMCLIENTS[start].PARALLEL_PROBE:
+            while (end < len(SCMCLIENTS) and
+                   SCMCLIENTS[end].PARALLEL_PROBE):
+                end += 1
+
+            j, repository_info = parallel_first(
+                lambda tool: tool.get_repository_info(),
+                SCMCLIENTS[start:end])
+        else:
+            j = 0
+            repository_info = SCMCLIENTS[start].get_repository_info()
+
+        if repository_info:
+            i = start + j
+            break
+
+        start = end
+
+    if i is None:
+        probed = SCMCLIENTS
+    else:
+        probed = SCMCLIENTS[:i + 1]
+
+    changed_options = {}
+
+    for tool in probed:
+        for key, value in tool.options.__dict__.iteritems():
+            if key not in orig_options or orig_options[key] is not value:
+                changed_options[key] = value
+
+        tool.options = options
+
+    for key, value in changed_options.iteritems():
+        setattr(options, key, value)
+
+    return i, repository_info, changed_options
+
+
+def get_detection_signature(clients, path):
+    """
+    Returns the state of the marker files the clients use to detect a
+    working copy at path, or None if one of them can't be detected from
+    marker files.
+
+    For each client, this is the nearest directory at or above path that
+    contains any of its markers, and the size and modification time of
+    each of the markers there.
+    """
+    signature = []
+
+    for tool in clients:
+        if not tool.DETECTION_MARKERS:
+            return None
+
+        found = None
+
+        for dir in walk_parents(path):
+            markers = []
+
+            for marker in tool.DETECTION_MARKERS:
+                try:
+                    st = os.stat(os.path.join(dir, marker))
+                    markers.append((marker, st.st_size, st.st_mtime))
+                except OSError:
+                    pass
+
+            if markers:
+                found = (dir, markers)
+                break
+
+        signature.append(found)
+
+    return signature
+
+
+def _get_detection_cache():
+    global _detection_cache
+
+    if _detection_cache is None:
+        _detection_cache = Cache('detection', ttl=DETECTION_CACHE_TTL)
+
+    return _detection_cache
+
+
+def _load_cached_detection(key):
+    """
+    Returns the cached (client index, repository info, changed options) for
+    the current directory, if none of the clients that would be probed have
+    changed.
+    """
+    entry = _get_detection_cache().get(key)
+
+    if not entry:
+        return None
+
+    i = entry['index']
+    clients = SCMCLIENTS[:i + 1]
+
+    if ([tool.__class__.__name__ for tool in clients] != entry['clients'] or
+        get_detection_signature(clients, os.getcwd()) != entry['signature']):
+        return None
+
+    tool = SCMCLIENTS[i]
+    tool.__dict__.update(entry['state'])
+    logging.debug('Using cached detection of %s: %s' %
+                  (entry['clients'][i], entry['repository_info']))
+
+    return i, entry['repository_info'], entry['options']
+
+
+def _save_cached_detection(key, i, repository_info, changed_options):
+    """
+    Caches the client found for the current directory, along with the
+    state it set up while probing, if it can be detected from marker
+    files.
+    """
+    clients = SCMCLIENTS[:i + 1]
+    signature = get_detection_signature(clients, os.getcwd())
+
+    if signature is None:
+        return
+
+    tool = SCMCLIENTS[i]
+    state = {}
+
+    for name, value in tool.__dict__.iteritems():
+        if name not in ('options', 'configs', 'user_config'):
+            state[name] = value
+
+    entry = {
+        'index': i,
+        'clients': [client.__class__.__name__ for client in clients],
+        'signature': signature,
+        'repository_info': repository_info,
+        'state': state,
+        'options': changed_options,
+    }
+
+    try:
+        pickle.dumps(entry)
+    except (pickle.PicklingError, TypeError), e:
+        logging.debug('Unable to cache the detected client: %s' % e)
+        return
+
+    _get_detection_cache().set(key, entry)
@@ -372,11 +372,8 @@ class ClearCaseRepositoryInfo(RepositoryInfo):
         uuid = self._get_vobs_uuid(self.vobstag)
         logging.debug("Repository's %s uuid is %r" % (self.vobstag, uuid))
 
-        repositories = server.get_repositories()
+        repositories = server.get_repositories(tool='ClearCase')
         for repository in repositories:
-            if repository['tool'] != 'ClearCase':
-                continue
-
             info = self._get_repository_info(server, repository)
 
             if not info or uuid != info['uuid']:
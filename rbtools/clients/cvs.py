@@ -12,6 +12,9 @@ class CVSClient(SCMClient):
     A wrapper around the cvs tool that fetches repository
     information and generates compatible diffs.
     """
+    DETECTION_MARKERS = ['CVS/Root', 'CVS/Repository']
+    PARALLEL_PROBE = True
+
     def __init__(self, **kwargs):
         super(CVSClient, self).__init__(**kwargs)
 
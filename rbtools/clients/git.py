@@ -14,11 +14,34 @@ class GitClient(SCMClient):
     compatible diffs. This will attempt to generate a diff suitable for the
     remote repository, whether git, SVN or Perforce.
     """
+    # .git itself changes whenever HEAD is updated, and may be a file
+    # pointing to the real repository.
+    DETECTION_MARKERS = ['.git', '.git/HEAD', '.git/config']
+    PARALLEL_PROBE = True
+
     def __init__(self, **kwargs):
         super(GitClient, self).__init__(**kwargs)
         # Store the 'correct' way to invoke git, just plain old 'git' by
         # default.
         self.git = 'git'
+        self.git_top = None
+
+        # What get_repository_info() found to complain about. It can't
+        # print or die itself, so finish_detection() does it.
+        self.detection_warnings = []
+        self.detection_error = None
+
+    def finish_detection(self):
+        for warning in self.detection_warnings:
+            sys.stderr.write(warning)
+
+        if self.detection_error:
+            die(self.detection_error)
+
+        # post-review in directories other than the top level of
+        # of a work-tree would result in broken diffs on the server
+        if self.git_top:
+            os.chdir(self.git_top)
 
     def _strip_heads_prefix(self, ref):
         """ Strips prefix from ref name, if possible """
@@ -40,11 +63,14 @@ class GitClient(SCMClient):
 
         if git_dir.startswith("fatal:") or not os.path.isdir(git_dir):
             return None
-        self.bare = execute([self.git, "config",
-                             "core.bare"]).strip() == 'true'
-
-        # post-review in directories other than the top level of
-        # of a work-tree would result in broken diffs on the server
+        self.bare = execute([self.git, "config", "core.bare"],
+                            ignore_errors=True).strip() == 'true'
+        self.detection_warnings = []
+        self.detection_error = None
+
+        # Find the top level of the work-tree, which finish_detection()
+        # changes to. Until then, the commands that depend on the current
+        # directory are run there.
         if not self.bare:
             git_top = execute([self.git, "rev-parse", "--show-toplevel"],
                               ignore_errors=True).rstrip("\n")
@@ -54,7 +80,7 @@ class GitClient(SCMClient):
             if git_top.startswith("fatal:") or not os.path.isdir(git_dir):
                 git_top = git_dir
 
-            os.chdir(os.path.abspath(git_top))
+            self.git_top = os.path.abspath(git_top)
 
         self.head_ref = execute([self.git, 'symbolic-ref', '-q',
                                  'HEAD'], ignore_errors=True).strip()
@@ -68,7 +94,8 @@ class GitClient(SCMClient):
 
         if (not self.options.repository_url and
             os.path.isdir(git_svn_dir) and len(os.listdir(git_svn_dir)) > 0):
-            data = execute([self.git, "svn", "info"], ignore_errors=True)
+            data = execute([self.git, "svn", "info"], ignore_errors=True,
+                           cwd=self.git_top)
 
             m = re.search(r'^Repository Root: (.+)$', data, re.M)
 
@@ -89,16 +116,17 @@ class GitClient(SCMClient):
                             self.upstream_branch = self.options.parent_branch
                         else:
                             data = execute([self.git, "svn", "rebase", "-n"],
-                                           ignore_errors=True)
+                                           ignore_errors=True,
+                                           cwd=self.git_top)
                             m = re.search(r'^Remote Branch:\s*(.+)$', data,
                                           re.M)
 
                             if m:
                                 self.upstream_branch = m.group(1)
                             else:
-                                sys.stderr.write('Failed to determine SVN '
-                                                 'tracking branch. Defaulting'
-                                                 'to "master"\n')
+                                self.detection_warnings.append(
+                                    'Failed to determine SVN tracking '
+                                    'branch. Defaulting to "master"\n')
                                 self.upstream_branch = 'master'
 
                         return SVNRepositoryInfo(path=path,
@@ -124,7 +152,8 @@ class GitClient(SCMClient):
                                                int(version_parts.group(3))),
                                               (1, 5, 4)) and
                     svn_remote):
-                    die("Your installation of git-svn must be upgraded to "
+                    self.detection_error = (
+                        "Your installation of git-svn must be upgraded to "
                         "version 1.5.4 or later")
 
         # Okay, maybe Perforce.
@@ -175,6 +204,9 @@ class GitClient(SCMClient):
 
         return None
 
+    def get_detection_options(self):
+        return (self.options.parent_branch, self.options.tracking)
+
     def get_origin(self, default_upstream_branch=None, ignore_errors=False):
         """Get upstream remote origin from options or parameters.
 
@@ -381,10 +413,14 @@ class GitClient(SCMClient):
             # parent diff if not:
             pdiff_required = execute([self.git, "branch", "-r",
                                       "--contains", r1])
-            parent_diff_lines = None
 
-            if not pdiff_required:
-                parent_diff_lines = self.make_diff(self.merge_base, r1)
+            def make_diffs():
+                parent_diff_lines = None
+
+                if not pdiff_required:
+                    parent_diff_lines = self.make_diff(self.merge_base, r1)
+
+                return self.make_diff(r1, r2), parent_diff_lines
 
             if self.options.guess_summary and not self.options.summary:
                 s = execute([self.git, "log", "--pretty=format:%s",
@@ -398,4 +434,36 @@ class GitClient(SCMClient):
                      "%s..%s" % (r1, r2)],
                     ignore_errors=True).strip()
 
-            return (self.make_diff(r1, r2), parent_diff_lines)
+            # Both ends of the range are commits, so the diffs can be
+            # cached by their hashes.
+            revisions = self._resolve_commits([self.merge_base, r1, r2])
+
+            if revisions is None:
+                return make_diffs()
+
+            return self.get_cached_diff(
+                revisions + [bool(pdiff_required)], make_diffs)
+
+    def _resolve_commits(self, revisions):
+        """
+        Returns the commit hashes of the given revisions, or None if they
+        can't all be resolved.
+        """
+        hashes = execute([self.git, "rev-parse"] +
+                         ["%s^{commit}" % revision for revision in revisions],
+                         with_errors=False, ignore_errors=True).split()
+
+        if len(hashes) != len(revisions):
+            return None
+
+        for commit_hash in hashes:
+            if len(commit_hash) != 40:
+                return None
+
+        return hashes
+
+    def get_diff_options(self):
+        # Settings such as diff.renames change what git diff outputs.
+        return (self.type,
+                execute([self.git, "config", "--get-regexp", "^diff\\."],
+                        ignore_errors=True))
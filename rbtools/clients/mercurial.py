@@ -13,6 +13,8 @@ class MercurialClient(SCMClient):
     A wrapper around the hg Mercurial tool that fetches repository
     information and generates compatible diffs.
     """
+    DETECTION_MARKERS = ['.hg/hgrc', '.hg/branch', '.hg/requires']
+    PARALLEL_PROBE = True
 
     def __init__(self, **kwargs):
         super(MercurialClient, self).__init__(**kwargs)
@@ -37,12 +39,12 @@ class MercurialClient(SCMClient):
         if not check_install('hg --help'):
             return None
 
-        self._load_hgrc()
-
         if not self.hg_root:
             # hg aborted => no mercurial repository here.
             return None
 
+        self._load_hgrc()
+
         svn_info = execute(["hg", "svn", "info"], ignore_errors=True)
 
         if (not svn_info.startswith('abort:') and
@@ -113,9 +115,11 @@ class MercurialClient(SCMClient):
         return self._hg_root
 
     def _load_hgrc(self):
-        for line in execute(['hg', 'showconfig'], split_lines=True):
-            key, value = line.split('=', 1)
-            self.hgrc[key] = value.strip()
+        for line in execute(['hg', 'showconfig'], split_lines=True,
+                            ignore_errors=True):
+            if '=' in line:
+                key, value = line.split('=', 1)
+                self.hgrc[key] = value.strip()
 
     def extract_summary(self, revision):
         """
@@ -311,8 +315,28 @@ class MercurialClient(SCMClient):
         if self.options.guess_description and not self.options.description:
             self.options.description = self.extract_description(r1, r2)
 
-        return (execute(["hg", "diff", "-r", r1, "-r", r2],
-                        env=self._hg_env), None)
+        def make_diffs():
+            return (execute(["hg", "diff", "-r", r1, "-r", r2],
+                            env=self._hg_env), None)
+
+        # Revision numbers are local to a clone and may be reused, so the
+        # diff is cached by the changeset hashes.
+        nodes = execute(["hg", "log", "-r", r1, "-r", r2,
+                         "--template", "{node}\n"],
+                        env=self._hg_env, with_errors=False,
+                        ignore_errors=True).split()
+
+        if len(nodes) != 2:
+            return make_diffs()
+
+        return self.get_cached_diff(nodes, make_diffs)
+
+    def get_diff_options(self):
+        options = [(key, value) for key, value in self.hgrc.iteritems()
+                   if key.startswith('diff.') or key == 'defaults.diff']
+        options.sort()
+
+        return tuple(options)
 
     def scan_for_server(self, repository_info):
         # Scan first for dot files, since it's faster and will cover the
@@ -6,11 +6,14 @@ import socket
 import stat
 import subprocess
 import sys
+import tempfile
+import time
 
 from rbtools.clients import SCMClient, RepositoryInfo
 from rbtools.utils.checks import check_gnu_diff, check_install
 from rbtools.utils.filesystem import make_tempfile
 from rbtools.utils.process import die, execute
+from rbtools.utils.timings import timings
 
 
 class PerforceClient(SCMClient):
@@ -20,10 +23,26 @@ class PerforceClient(SCMClient):
     """
     DATE_RE = re.compile(r'(\w+)\s+(\w+)\s+(\d+)\s+(\d\d:\d\d:\d\d)\s+'
                           '(\d\d\d\d)')
+    PARALLEL_PROBE = True
 
     def __init__(self, **kwargs):
         super(PerforceClient, self).__init__(**kwargs)
 
+    def finish_detection(self):
+        # Now that we know it's Perforce, make sure we have GNU diff
+        # installed, and error out if we don't.
+        check_gnu_diff()
+
+        # set the P4 enviroment:
+        if self.options.p4_client:
+            os.environ['P4CLIENT'] = self.options.p4_client
+
+        if self.options.p4_port:
+            os.environ['P4PORT'] = self.options.p4_port
+
+        if self.options.p4_passwd:
+            os.environ['P4PASSWD'] = self.options.p4_passwd
+
     def get_repository_info(self):
         if not check_install('p4 help'):
             return None
@@ -35,6 +54,7 @@ class PerforceClient(SCMClient):
             return None
 
         repository_path = m.group(1).strip()
+        self.p4_server_address = repository_path
 
         try:
             hostname, port = repository_path.split(":")
@@ -55,10 +75,6 @@ class PerforceClient(SCMClient):
                       data, re.M)
         self.p4d_version = int(m.group(1)), int(m.group(2))
 
-        # Now that we know it's Perforce, make sure we have GNU diff
-        # installed, and error out if we don't.
-        check_gnu_diff()
-
         return RepositoryInfo(path=repository_path, supports_changesets=True)
 
     def scan_for_server(self, repository_info):
@@ -123,16 +139,6 @@ class PerforceClient(SCMClient):
         to take into account adds/deletes and to provide the necessary
         revision information.
         """
-        # set the P4 enviroment:
-        if self.options.p4_client:
-            os.environ['P4CLIENT'] = self.options.p4_client
-
-        if self.options.p4_port:
-            os.environ['P4PORT'] = self.options.p4_port
-
-        if self.options.p4_passwd:
-            os.environ['P4PASSWD'] = self.options.p4_passwd
-
         changenum = self.get_changenum(args)
         if changenum is None:
             return self._path_diff(args)
@@ -275,21 +281,33 @@ class PerforceClient(SCMClient):
         The return type depends on the command being run.
         """
         command = ['p4', '-G'] + command
-        p = subprocess.Popen(command, stdout=subprocess.PIPE)
         result = []
         has_error = False
 
-        while 1:
-            try:
-                data = marshal.load(p.stdout)
-            except EOFError:
-                break
-            else:
-                result.append(data)
-                if data.get('code', None) == 'error':
-                    has_error = True
+        # marshal.load() needs a real file, and can't tell us how much it
+        # read, so the output goes to a temporary file, whose size is how
+        # much p4 wrote.
+        fp = tempfile.TemporaryFile()
 
-        rc = p.wait()
+        try:
+            start_time = time.time()
+            p = subprocess.Popen(command, stdout=fp)
+            rc = p.wait()
+            timings.record(command, time.time() - start_time,
+                           os.fstat(fp.fileno()).st_size, rc)
+            fp.seek(0)
+
+            while 1:
+                try:
+                    data = marshal.load(fp)
+                except EOFError:
+                    break
+                else:
+                    result.append(data)
+                    if data.get('code', None) == 'error':
+                        has_error = True
+        finally:
+            fp.close()
 
         if rc or has_error:
             for record in result:
@@ -369,6 +387,20 @@ class PerforceClient(SCMClient):
             if '*pending*' in description[0] or '*pending*' in description[1]:
                 cl_is_pending = True
 
+        if not cl_is_pending:
+            # A submitted changelist can't change, so its diff is cached.
+            return self.get_cached_diff(
+                [self.p4_server_address, self.options.p4_port, changenum],
+                lambda: self._make_changenum_diff(changenum, description,
+                                                  cl_is_pending))
+
+        return self._make_changenum_diff(changenum, description, cl_is_pending)
+
+    def _make_changenum_diff(self, changenum, description, cl_is_pending):
+        """
+        Generates the diff for a change number, given the output of
+        p4 describe for it (if any).
+        """
         v = self.p4d_version
 
         if cl_is_pending and (v[0] < 2002 or (v[0] == "2002" and v[1] < 2)
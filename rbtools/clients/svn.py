@@ -1,13 +1,19 @@
+import logging
 import os
 import re
 import sys
 import urllib
+from tempfile import TemporaryFile
+from xml.dom.minidom import parseString
+from xml.parsers.expat import ExpatError
 
 from rbtools.api.errors import APIError
 from rbtools.clients import SCMClient, RepositoryInfo
+from rbtools.utils.cache import Cache
 from rbtools.utils.checks import check_gnu_diff, check_install
-from rbtools.utils.filesystem import walk_parents
-from rbtools.utils.process import execute
+from rbtools.utils.filesystem import make_spooled_tempfile, walk_parents
+from rbtools.utils.parallel import parallel_map
+from rbtools.utils.process import execute, execute_stream
 
 
 class SVNClient(SCMClient):
@@ -15,6 +21,39 @@ class SVNClient(SCMClient):
     DIFF_ORIG_FILE_LINE_RE = re.compile(r'^---\s+.*\s+\(.*\)')
     DIFF_NEW_FILE_LINE_RE = re.compile(r'^\+\+\+\s+.*\s+\(.*\)')
 
+    # wc.db is used by Subversion 1.7 and newer, entries by older versions.
+    DETECTION_MARKERS = ['.svn/wc.db', '.svn/entries']
+    PARALLEL_PROBE = True
+
+    # How long the reviewboard:url property of a repository is cached, in
+    # seconds.
+    SERVER_URL_CACHE_TTL = 24 * 60 * 60
+
+    # The statuses, from 'svn status', of paths that svn diff shows.
+    DIFF_STATUSES = ['added', 'conflicted', 'deleted', 'modified',
+                     'replaced']
+
+    # The most paths passed to a single 'svn info'.
+    SVN_INFO_BATCH_SIZE = 200
+
+    # How large a processed diff can get, in bytes, before it's spooled to
+    # disk rather than kept in memory.
+    DIFF_SPOOL_SIZE = 4 * 1024 * 1024
+
+    # The most bytes of paths passed to a single svn command, to keep well
+    # within command line length limits (32K characters on Windows).
+    MAX_PATHS_LENGTH = 16 * 1024
+
+    # The elements of 'svn info --xml' and the corresponding keys in the
+    # plain output.
+    SVN_INFO_XML_KEYS = [
+        ('url', 'URL'),
+        ('root', 'Repository Root'),
+        ('uuid', 'Repository UUID'),
+        ('copy-from-url', 'Copied From URL'),
+        ('copy-from-rev', 'Copied From Rev'),
+    ]
+
     """
     A wrapper around the svn Subversion tool that fetches repository
     information and generates compatible diffs.
@@ -53,12 +92,13 @@ class SVNClient(SCMClient):
         if not m:
             return None
 
+        return SVNRepositoryInfo(path, base_path, m.group(1))
+
+    def finish_detection(self):
         # Now that we know it's SVN, make sure we have GNU diff installed,
         # and error out if we don't.
         check_gnu_diff()
 
-        return SVNRepositoryInfo(path, base_path, m.group(1))
-
     def check_options(self):
         if (self.options.repository_url and
             not self.options.revision_range and
@@ -78,19 +118,108 @@ class SVNClient(SCMClient):
         return self.scan_for_server_property(repository_info)
 
     def scan_for_server_property(self, repository_info):
-        def get_url_prop(path):
-            url = execute(["svn", "propget", "reviewboard:url", path]).strip()
-            return url or None
+        """
+        Returns the reviewboard:url property set on the nearest directory in
+        the working copy, or else on the root of the repository.
+
+        The property is fetched for every directory from the current one up
+        to the top of the working copy in a single 'svn propget'. Looking it
+        up in the repository is a round trip to the Subversion server, so
+        the result of that is cached for the repository's UUID.
+        """
+        paths = self._get_working_copy_parents()
+
+        if paths:
+            output = execute(["svn", "propget", "--xml", "reviewboard:url"] +
+                             paths,
+                             with_errors=False, ignore_errors=True)
+            url = self._find_nearest_url_prop(output, paths)
+
+            if url:
+                return url
+
+        uuid = getattr(repository_info, 'uuid', None)
+
+        if uuid:
+            url_cache = Cache('svn-server-urls', ttl=self.SERVER_URL_CACHE_TTL)
+            url = url_cache.get(uuid)
+
+            if url is not None:
+                logging.debug('Using cached reviewboard:url for UUID %s'
+                              % uuid)
+                return url or None
+
+        url = execute(["svn", "propget", "reviewboard:url",
+                       repository_info.path]).strip()
+
+        if uuid:
+            # An empty string records that the property isn't set.
+            url_cache.set(uuid, url)
+
+        return url or None
+
+    def _get_working_copy_parents(self):
+        """
+        Returns the current directory and each of its parents up to the top
+        of the working copy.
+
+        Before Subversion 1.7, every directory in a working copy has a .svn
+        directory. Since then, only the top one does.
+        """
+        paths = []
+        found_top = False
 
         for path in walk_parents(os.getcwd()):
-            if not os.path.exists(os.path.join(path, ".svn")):
+            if os.path.exists(os.path.join(path, ".svn")):
+                found_top = True
+            elif found_top:
                 break
 
-            prop = get_url_prop(path)
-            if prop:
-                return prop
+            paths.append(path)
+
+        if not found_top:
+            return []
+
+        return paths
+
+    def _find_nearest_url_prop(self, xml, paths):
+        """
+        Returns the reviewboard:url property from the output of
+        'svn propget --xml' for the first of the paths that has it set, or
+        None.
+        """
+        try:
+            dom = parseString(xml)
+        except ExpatError, e:
+            logging.debug('Unable to parse the output of svn propget: %s' % e)
+            return None
+
+        urls = []
+
+        for target in dom.getElementsByTagName('target'):
+            url = ''.join([child.data
+                           for node in target.getElementsByTagName('property')
+                           for child in node.childNodes
+                           if child.nodeType == child.TEXT_NODE]).strip()
 
-        return get_url_prop(repository_info.path)
+            if url:
+                urls.append((os.path.normpath(target.getAttribute('path')),
+                             url.encode('utf-8')))
+
+        found = dict(urls)
+
+        for path in paths:
+            path = os.path.normpath(path)
+
+            if path in found:
+                return found[path]
+
+        # svn reported the paths differently than we gave them. It reports
+        # them in the order they were given, though, so take the first.
+        if urls:
+            return urls[0][1]
+
+        return None
 
     def diff(self, files):
         """
@@ -99,10 +228,137 @@ class SVNClient(SCMClient):
         SVN repositories do not support branches of branches in a way that
         makes parent diffs possible, so we never return a parent diff
         (the second value in the tuple).
+
+        The diff is returned as a file object (see process_diff()).
         """
+        workers = self.options.svn_diff_workers
+
+        if workers > 1:
+            return self.diff_sharded(files, workers), None
+
         return (self.do_diff(["svn", "diff", "--diff-cmd=diff"] + files),
                 None)
 
+    def diff_sharded(self, files, workers):
+        """
+        Performs a diff across all modified files, split between several
+        svn diff processes.
+
+        A single svn diff of a very large working copy is bound by one core.
+        Instead, the modified paths are found with 'svn status', sorted and
+        split into shards that each fit on one command line (see
+        _split_paths()), and each shard is diffed separately, by up to the
+        given number of processes at once. Each shard's output is spooled
+        to a temporary file, and the spools are then fed through
+        process_diff() in path order.
+
+        svn diff doesn't descend into externals, so neither does the
+        'svn status'.
+        """
+        output = execute(["svn", "status", "--xml", "--ignore-externals"] +
+                         files, with_errors=False)
+        paths = self.parse_svn_status_xml(output)
+        paths.sort()
+        shards = self._split_paths(paths)
+
+        if len(shards) <= 1:
+            return self.do_diff(["svn", "diff", "--diff-cmd=diff"] + files)
+
+        logging.debug('Diffing %d paths in %d shards' %
+                      (len(paths), len(shards)))
+
+        # The spools are recorded as they're made, so that if any shard
+        # fails, the ones that were already diffed are still closed.
+        spools = []
+
+        def diff_shard(paths):
+            spool = self._diff_shard(paths)
+            spools.append(spool)
+
+            return spool
+
+        def iter_lines(ordered_spools):
+            for spool in ordered_spools:
+                for line in spool:
+                    yield line
+
+                spool.close()
+
+        try:
+            return self.process_diff(
+                iter_lines(parallel_map(diff_shard, shards, workers)))
+        finally:
+            for spool in spools:
+                spool.close()
+
+    def _diff_shard(self, paths):
+        """
+        Diffs the given paths into a temporary file, and returns the file,
+        ready to be read.
+        """
+        spool = TemporaryFile()
+
+        try:
+            # Each path is diffed on its own (--depth empty), since the
+            # children of a modified directory are in the list themselves.
+            for line in execute_stream(["svn", "diff", "--diff-cmd=diff",
+                                        "--depth", "empty"] + paths):
+                spool.write(line)
+
+            spool.seek(0)
+        except:
+            spool.close()
+            raise
+
+        return spool
+
+    def _split_paths(self, paths, max_count=None):
+        """
+        Splits paths into batches that each take up no more than
+        MAX_PATHS_LENGTH bytes on a command line, and, if given, have no
+        more than max_count paths.
+        """
+        batches = []
+        batch = []
+        length = 0
+
+        for path in paths:
+            # Allow for the quotes and space around each path.
+            size = len(path) + 3
+
+            if batch and (length + size > self.MAX_PATHS_LENGTH or
+                          (max_count and len(batch) >= max_count)):
+                batches.append(batch)
+                batch = []
+                length = 0
+
+            batch.append(path)
+            length += size
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def parse_svn_status_xml(self, xml):
+        """
+        Returns the paths with changes that svn diff shows, from the output
+        of 'svn status --xml'. The roots of externals are skipped, since
+        svn diff doesn't descend into them.
+        """
+        paths = []
+
+        for entry in parseString(xml).getElementsByTagName('entry'):
+            for status in entry.getElementsByTagName('wc-status'):
+                if status.getAttribute('item') == 'external':
+                    continue
+
+                if (status.getAttribute('item') in self.DIFF_STATUSES or
+                    status.getAttribute('props') in self.DIFF_STATUSES):
+                    paths.append(entry.getAttribute('path').encode('utf-8'))
+
+        return paths
+
     def diff_changelist(self, changelist):
         """
         Performs a diff for a local changelist.
@@ -157,14 +413,92 @@ class SVNClient(SCMClient):
         """
         Performs the actual diff operation, handling renames and converting
         paths to absolute.
+
+        The output of svn diff is processed as it's read. See
+        process_diff().
+        """
+        return self.process_diff(execute_stream(cmd), repository_info)
+
+    def process_diff(self, lines, repository_info=None):
+        """
+        Handles renames and converts paths to absolute in the lines of a
+        diff, as do_diff() does, and returns the result.
+
+        The lines are processed in chunks of whole files as they're read.
+        Once the files read so far have SVN_INFO_BATCH_SIZE paths to look up,
+        they're looked up with a single 'svn info', and the chunk is run
+        through handle_renames and convert_to_absolute_paths. This overlaps
+        the lookups with svn diff, and only one chunk of the input is held
+        in memory at a time.
+
+        The processed chunks are written to a temporary file, which is
+        returned ready to be read, so that the diff is never held in memory
+        as a whole. It's kept in memory until it grows past DIFF_SPOOL_SIZE
+        bytes.
+        """
+        infos = {}
+        result = make_spooled_tempfile(self.DIFF_SPOOL_SIZE)
+        chunk = []
+        paths = {}
+
+        try:
+            for line in lines:
+                if (line.startswith('Index: ') and
+                    len(paths) >= self.SVN_INFO_BATCH_SIZE):
+                    self._process_diff_chunk(chunk, paths.keys(), infos,
+                                             repository_info, result)
+                    chunk = []
+                    paths = {}
+
+                chunk.append(line)
+
+                for path in self._get_lookup_paths(line):
+                    if path not in infos:
+                        paths[path] = True
+
+            self._process_diff_chunk(chunk, paths.keys(), infos,
+                                     repository_info, result)
+            result.seek(0)
+        except:
+            result.close()
+            raise
+
+        return result
+
+    def _process_diff_chunk(self, chunk, paths, infos, repository_info,
+                            result):
+        """
+        Looks up the paths for a chunk of a diff, adding them to infos, and
+        writes the processed lines of the chunk to the file result.
         """
-        diff = execute(cmd, split_lines=True)
-        diff = self.handle_renames(diff)
-        diff = self.convert_to_absolute_paths(diff, repository_info)
+        if paths:
+            infos.update(self.svn_info_paths(paths))
 
-        return ''.join(diff)
+        diff = self._iter_renames(chunk, infos)
+        result.writelines(self._iter_absolute_paths(diff, repository_info,
+                                                    infos))
 
-    def find_copyfrom(self, path):
+    def _get_lookup_paths(self, line):
+        """
+        Returns the paths in a diff line that handle_renames and
+        convert_to_absolute_paths will need 'svn info' for.
+        """
+        if self.options.repository_url:
+            return []
+
+        header = self._parse_header(line)
+
+        if header is None or header[2] is None:
+            return []
+
+        front, file, rest = header
+
+        if front == '+++':
+            return self._get_ancestor_paths(file)
+        else:
+            return [file]
+
+    def find_copyfrom(self, path, infos=None):
         """
         A helper function for handle_renames
 
@@ -174,7 +508,14 @@ class SVNClient(SCMClient):
         report the origin. Thus it is needed to ascend from the path until
         either a copied path is found or there are no more path components to
         try.
+
+        infos is a dict of 'svn info' results by path, which can be shared
+        between calls so that each ancestor is only looked up once. Paths
+        missing from it are looked up and added to it.
         """
+        if infos is None:
+            infos = {}
+
         def smart_join(p1, p2):
             if p2:
                 return os.path.join(p1, p2)
@@ -185,7 +526,10 @@ class SVNClient(SCMClient):
         path2 = None
 
         while path1:
-            info = self.svn_info(path1)
+            if infos.get(path1) is None:
+                infos[path1] = self.svn_info(path1)
+
+            info = infos[path1]
             url = info.get('Copied From URL', None)
 
             if url:
@@ -218,7 +562,34 @@ class SVNClient(SCMClient):
         if self.options.repository_url:
             return diff_content
 
-        result = []
+        # Look up every file in the diff and all the directories containing
+        # them at once, rather than walking up from each file in turn. When
+        # a directory was copied, its files all share the same ancestors.
+        paths = []
+
+        for line in diff_content:
+            if self.DIFF_NEW_FILE_LINE_RE.match(line):
+                to_file, _ = self.parse_filename_header(line[4:])
+                paths.extend(self._get_ancestor_paths(to_file))
+
+        if paths:
+            infos = self.svn_info_paths(paths)
+        else:
+            infos = {}
+
+        return list(self._iter_renames(diff_content, infos))
+
+    def _iter_renames(self, diff_content, infos):
+        """
+        Yields the lines of the diff with the renames handled, as
+        handle_renames() does, given the 'svn info' results looked up so
+        far.
+        """
+        if self.options.repository_url:
+            for line in diff_content:
+                yield line
+
+            return
 
         from_line = ""
         for line in diff_content:
@@ -229,17 +600,49 @@ class SVNClient(SCMClient):
             # This is where we decide how mangle the previous '--- '
             if self.DIFF_NEW_FILE_LINE_RE.match(line):
                 to_file, _ = self.parse_filename_header(line[4:])
-                copied_from = self.find_copyfrom(to_file)
+                copied_from = self.find_copyfrom(to_file, infos)
                 if copied_from is not None:
-                    result.append(from_line.replace(to_file, copied_from))
+                    yield from_line.replace(to_file, copied_from)
                 else:
-                    result.append(from_line) #as is, no copy performed
+                    yield from_line #as is, no copy performed
 
             # We only mangle '---' lines. All others get added straight to
             # the output.
-            result.append(line)
+            yield line
 
-        return result
+    def _get_ancestor_paths(self, path):
+        """
+        Returns the path and each of its parents, in the order
+        find_copyfrom() looks them up.
+        """
+        paths = []
+
+        while path and path != "/":
+            paths.append(path)
+            path = os.path.split(path)[0]
+
+        return paths
+
+    def _parse_header(self, line):
+        """
+        Splits a diff header line into the header, the filename and the
+        rest of the line. The rest is None if the filename is already
+        absolute, and None is returned for lines that aren't headers.
+        """
+        if (self.DIFF_NEW_FILE_LINE_RE.match(line)
+            or self.DIFF_ORIG_FILE_LINE_RE.match(line)
+            or line.startswith('Index: ')):
+            front, line = line.split(" ", 1)
+
+            if line.startswith('/'): #already absolute
+                return front, line, None
+            else:
+                # filename and rest of line (usually the revision
+                # component)
+                file, rest = self.parse_filename_header(line)
+                return front, file, rest
+
+        return None
 
     def convert_to_absolute_paths(self, diff_content, repository_info):
         """
@@ -247,45 +650,67 @@ class SVNClient(SCMClient):
         This handles paths that have been svn switched to other parts of the
         repository.
         """
+        # Parse the headers first, so that all the files in the diff can be
+        # looked up with as few 'svn info' runs as possible.
+        files = []
 
-        result = []
+        if not self.options.repository_url:
+            for line in diff_content:
+                header = self._parse_header(line)
 
+                if header is not None and header[2] is not None:
+                    files.append(header[1])
+
+        if files:
+            infos = self.svn_info_paths(files)
+        else:
+            infos = {}
+
+        return list(self._iter_absolute_paths(diff_content, repository_info,
+                                              infos))
+
+    def _iter_absolute_paths(self, diff_content, repository_info, infos):
+        """
+        Yields the lines of the diff with absolute paths, as
+        convert_to_absolute_paths() does, given the 'svn info' results
+        looked up so far.
+        """
         for line in diff_content:
-            front = None
-            orig_line = line
-            if (self.DIFF_NEW_FILE_LINE_RE.match(line)
-                or self.DIFF_ORIG_FILE_LINE_RE.match(line)
-                or line.startswith('Index: ')):
-                front, line = line.split(" ", 1)
-
-            if front:
-                if line.startswith('/'): #already absolute
-                    line = front + " " + line
-                else:
-                    # filename and rest of line (usually the revision
-                    # component)
-                    file, rest = self.parse_filename_header(line)
-
-                    # If working with a diff generated outside of a working
-                    # copy, then file paths are already absolute, so just
-                    # add initial slash.
-                    if self.options.repository_url:
-                        path = urllib.unquote(
-                            "%s/%s" % (repository_info.base_path, file))
-                    else:
-                        info = self.svn_info(file, True)
-                        if info is None:
-                            result.append(orig_line)
-                            continue
-                        url  = info["URL"]
-                        root = info["Repository Root"]
-                        path = urllib.unquote(url[len(root):])
-
-                    line = front + " " + path + rest
-
-            result.append(line)
+            header = self._parse_header(line)
 
-        return result
+            if header is None:
+                yield line
+                continue
+
+            front, file, rest = header
+
+            if rest is None:
+                yield front + " " + file
+                continue
+
+            # If working with a diff generated outside of a working copy,
+            # then file paths are already absolute, so just add initial
+            # slash.
+            if self.options.repository_url:
+                path = urllib.unquote(
+                    "%s/%s" % (repository_info.base_path, file))
+            else:
+                if file not in infos:
+                    # svn may have reported the path differently than we
+                    # asked for it, so look it up on its own.
+                    infos[file] = self.svn_info(file, True)
+
+                info = infos[file]
+
+                if info is None:
+                    yield line
+                    continue
+
+                url  = info["URL"]
+                root = info["Repository Root"]
+                path = urllib.unquote(url[len(root):])
+
+            yield front + " " + path + rest
 
     def svn_info(self, path, ignore_errors=False):
         """Return a dict which is the result of 'svn info' at a given path."""
@@ -305,6 +730,61 @@ class SVNClient(SCMClient):
 
         return svninfo
 
+    def svn_info_paths(self, paths):
+        """
+        Returns a dict mapping paths to the result of 'svn info' for them,
+        in the same form as svn_info(), running 'svn info' once for each
+        batch of paths. Paths that svn doesn't report on are left out.
+        """
+        infos = {}
+        paths = list(set(paths))
+        paths.sort()
+
+        for batch in self._split_paths(paths, self.SVN_INFO_BATCH_SIZE):
+            # svn exits with an error if any of the paths aren't versioned,
+            # but still reports on the rest.
+            output = execute(["svn", "info", "--xml"] + batch,
+                             with_errors=False, ignore_errors=True)
+            infos.update(self.parse_svn_info_xml(output))
+
+        return infos
+
+    def parse_svn_info_xml(self, xml):
+        """
+        Parses the output of 'svn info --xml' into a dict mapping each path
+        to its info, keyed as in the plain output of 'svn info'.
+        """
+        infos = {}
+
+        try:
+            dom = parseString(xml)
+        except ExpatError, e:
+            logging.debug('Unable to parse the output of svn info: %s' % e)
+            return infos
+
+        for entry in dom.getElementsByTagName('entry'):
+            info = {
+                'Path': entry.getAttribute('path'),
+                'Node Kind': entry.getAttribute('kind'),
+                'Revision': entry.getAttribute('revision'),
+            }
+
+            for tag, key in self.SVN_INFO_XML_KEYS:
+                nodes = entry.getElementsByTagName(tag)
+
+                if nodes:
+                    info[key] = ''.join([child.data
+                                         for child in nodes[0].childNodes
+                                         if child.nodeType == child.TEXT_NODE])
+
+            # The rest of the diff is bytes, not unicode.
+            for key, value in info.items():
+                info[key] = value.encode('utf-8')
+
+            infos[info['Path']] = info
+
+        return infos
+
     # Adapted from server code parser.py
     def parse_filename_header(self, s):
         parts = None
@@ -335,10 +815,15 @@ class SVNRepositoryInfo(RepositoryInfo):
     A representation of a SVN source code repository. This version knows how to
     find a matching repository on the server even if the URLs differ.
     """
+    # How long the repositories found for each UUID are cached, in seconds.
+    UUID_CACHE_TTL = 24 * 60 * 60
+
     def __init__(self, path, base_path, uuid, supports_parent_diffs=False):
         RepositoryInfo.__init__(self, path, base_path,
                                 supports_parent_diffs=supports_parent_diffs)
         self.uuid = uuid
+        self.cached_match = False
+        self._uuid_cache = None
 
     def find_server_repository_info(self, server):
         """
@@ -348,27 +833,110 @@ class SVNRepositoryInfo(RepositoryInfo):
         repository.) It does this by comparing repository UUIDs. If the
         repositories use the same path, you'll get back self, otherwise you'll
         get a different SVNRepositoryInfo object (with a different path).
+
+        The repository info is fetched for several repositories at once, and
+        the UUIDs found are cached, so later runs can usually find the
+        repository without asking the server at all.
         """
-        repositories = server.get_repositories()
+        if server.use_cache:
+            uuid_cache = self._get_uuid_cache()
+            uuids = uuid_cache.get(server.url) or {}
+
+            if self.uuid in uuids:
+                result = self._match_repository(uuids[self.uuid])
+
+                if result:
+                    logging.debug('Using cached repository for UUID %s' %
+                                  self.uuid)
+                    self.cached_match = True
+                    return result
+        else:
+            uuid_cache = None
+            uuids = {}
 
-        for repository in repositories:
-            if repository['tool'] != 'Subversion':
-                continue
+        repositories = server.get_repositories(tool='Subversion')
+        batch_size = server.MAX_PARALLEL_REQUESTS * 2
+        result = None
 
-            info = self._get_repository_info(server, repository)
+        # Fetch the info in batches, stopping at the first batch with a
+        # match, so that the first matching repository in the list still
+        # wins.
+        for i in range(0, len(repositories), batch_size):
+            batch = repositories[i:i + batch_size]
+            infos = parallel_map(
+                lambda repository: self._get_repository_info(server,
+                                                             repository),
+                batch, server.MAX_PARALLEL_REQUESTS)
+            matches = []
 
-            if not info or self.uuid != info['uuid']:
-                continue
+            for repository, info in zip(batch, infos):
+                if not info:
+                    continue
 
-            repos_base_path = info['url'][len(info['root_url']):]
-            relpath = self._get_relative_path(self.base_path, repos_base_path)
-            if relpath:
-                return SVNRepositoryInfo(info['url'], relpath, self.uuid)
+                entry = (repository['id'], info['url'], info['root_url'])
+                entries = uuids.setdefault(info['uuid'], [])
+
+                if entry not in entries:
+                    entries.append(entry)
+
+                if info['uuid'] == self.uuid:
+                    matches.append(entry)
+
+            result = self._match_repository(matches)
+
+            if result:
+                break
+
+        if uuid_cache:
+            uuid_cache.set(server.url, uuids)
+
+        if result:
+            return result
 
         # We didn't find a matching repository on the server. We'll just return
         # self and hope for the best.
         return self
 
+    def forget_server_repository_info(self, server):
+        """
+        Drops the cached repositories for our UUID, if the last lookup used
+        them, so the next lookup scans the server's repositories again.
+        """
+        if not self.cached_match:
+            return False
+
+        logging.debug('Forgetting the cached repository for UUID %s' %
+                      self.uuid)
+        self.cached_match = False
+        uuid_cache = self._get_uuid_cache()
+        uuids = uuid_cache.get(server.url)
+
+        if uuids and self.uuid in uuids:
+            del uuids[self.uuid]
+            uuid_cache.set(server.url, uuids)
+
+        return True
+
+    def _get_uuid_cache(self):
+        if self._uuid_cache is None:
+            self._uuid_cache = Cache('svn-uuids', ttl=self.UUID_CACHE_TTL)
+
+        return self._uuid_cache
+
+    def _match_repository(self, entries):
+        """
+        Returns an SVNRepositoryInfo for the first of the (repository id,
+        url, root url) entries that our base path is within, or None.
+        """
+        for repository_id, url, root_url in entries:
+            repos_base_path = url[len(root_url):]
+            relpath = self._get_relative_path(self.base_path, repos_base_path)
+
+            if relpath:
+                return SVNRepositoryInfo(url, relpath, self.uuid)
+
+        return None
+
     def _get_repository_info(self, server, repository):
         try:
             return server.get_repository_info(repository['id'])
@@ -1,20 +1,25 @@
+import marshal
 import os
 import re
 import sys
+import threading
 import time
 from nose import SkipTest
 from nose.tools import raises
 from random import randint
 from textwrap import dedent
 
-from rbtools.clients import RepositoryInfo
+from rbtools import clients
+from rbtools.clients import RepositoryInfo, SCMClient, svn
 from rbtools.clients.git import GitClient
 from rbtools.clients.mercurial import MercurialClient
 from rbtools.clients.perforce import PerforceClient
-from rbtools.clients.svn import SVNRepositoryInfo
+from rbtools.clients.svn import SVNClient, SVNRepositoryInfo
 from rbtools.tests import OptionsStub
+from rbtools.utils import diffcache, timings
+from rbtools.utils.cache import save_caches
 from rbtools.utils.filesystem import load_config_files
-from rbtools.utils.process import execute
+from rbtools.utils.process import die, execute
 from rbtools.utils.testbase import RBTestBase
 
 
@@ -320,6 +325,91 @@ class GitClientTests(SCMClientTests):
         self.client.get_repository_info()
         self.assertEqual(self.client.diff(None), (diff, None))
 
+    def test_scan_usable_client(self):
+        """Test scan_usable_client finding git among the real clients"""
+        from rbtools.clients.clearcase import ClearCaseClient
+        from rbtools.clients.cvs import CVSClient
+        from rbtools.clients.plastic import PlasticClient
+
+        self.set_user_home_tmp()
+        clients._detection_cache = None
+        self.options.change_only = False
+        self.options.p4_client = None
+        self.options.p4_port = None
+        subdir = os.path.join(self.clone_dir, 'sub')
+        os.mkdir(subdir)
+        os.chdir(subdir)
+
+        groups = []
+        orig_parallel_first = clients.parallel_first
+        saved_clients = clients.SCMCLIENTS
+
+        def parallel_first(func, items):
+            groups.append([item.__class__.__name__ for item in items])
+            return orig_parallel_first(func, items)
+
+        clients.parallel_first = parallel_first
+        clients.SCMCLIENTS = [
+            CVSClient(options=self.options),
+            ClearCaseClient(options=self.options),
+            GitClient(options=self.options),
+            MercurialClient(options=self.options),
+            PerforceClient(options=self.options),
+            PlasticClient(options=self.options),
+            SVNClient(options=self.options),
+        ]
+
+        try:
+            repository_info, tool = clients.scan_usable_client(self.options)
+        finally:
+            clients.parallel_first = orig_parallel_first
+            clients.SCMCLIENTS = saved_clients
+
+        self.assertTrue(isinstance(tool, GitClient))
+        self.assertEqual(os.path.realpath(repository_info.path),
+                         os.path.realpath(self.git_dir))
+
+        # Everything after ClearCase is probed at once.
+        self.assertEqual(groups, [
+            ['CVSClient'],
+            ['GitClient', 'MercurialClient', 'PerforceClient',
+             'PlasticClient', 'SVNClient'],
+        ])
+
+        # Only once git was chosen did it change to the top of the
+        # work-tree.
+        self.assertEqual(os.path.realpath(os.getcwd()),
+                         os.path.realpath(self.clone_dir))
+
+    def test_diff_between_revisions_cached(self):
+        """Test GitClient diff_between_revisions using the diff cache"""
+        self.set_user_home_tmp()
+        diffcache._diff_cache = None
+
+        self.client.get_repository_info()
+        self._git_add_file_commit('foo.txt', FOO1, 'commit 1')
+        self._git_add_file_commit('foo.txt', FOO2, 'commit 2')
+        self._git_add_file_commit('foo.txt', FOO3, 'commit 3')
+
+        result = self.client.diff_between_revisions('HEAD~2:HEAD', None,
+                                                    None)
+        self.assertTrue(result[0].startswith('diff --git a/foo.txt'))
+
+        def make_diff(*args):
+            self.fail('The diff should have been cached')
+
+        # The same commits, named differently.
+        head = self._gitcmd(['rev-parse', 'HEAD']).strip()
+        self.client.make_diff = make_diff
+        self.assertEqual(
+            self.client.diff_between_revisions('HEAD~2:%s' % head, None,
+                                               None),
+            result)
+
+        # Another range is generated again.
+        self.assertRaises(AssertionError, self.client.diff_between_revisions,
+                          'HEAD~1:HEAD', None, None)
+
 
 class MercurialTestBase(SCMClientTests):
 
@@ -679,6 +769,7 @@ class MercurialSubversionClientTests(MercurialTestBase):
 class SVNClientTests(SCMClientTests):
     def setUp(self):
         super(SVNClientTests, self).setUp()
+        self.set_user_home_tmp()
 
     def test_relative_paths(self):
         """Testing SVNRepositoryInfo._get_relative_path"""
@@ -699,6 +790,444 @@ class SVNClientTests(SCMClientTests):
             '/')
 
 
+    def test_parse_svn_info_xml(self):
+        """Testing SVNClient.parse_svn_info_xml"""
+        client = SVNClient(options=self.options)
+        infos = client.parse_svn_info_xml(SVN_INFO_XML)
+
+        self.assertEqual(infos.keys(), ['src/foo.c'])
+        info = infos['src/foo.c']
+        self.assertEqual(info['URL'],
+                         'http://svn.example.com/svn/branches/b1/src/foo.c')
+        self.assertEqual(info['Repository Root'],
+                         'http://svn.example.com/svn')
+        self.assertEqual(info['Copied From URL'],
+                         'http://svn.example.com/svn/trunk/src/foo.c')
+        self.assertEqual(info['Revision'], '12')
+        self.assertTrue(isinstance(info['URL'], str))
+
+        self.assertEqual(client.parse_svn_info_xml('svn: E155007'), {})
+
+    def test_convert_to_absolute_paths(self):
+        """Testing SVNClient.convert_to_absolute_paths"""
+        client = SVNClient(options=self.options)
+        lookups = []
+
+        def svn_info_paths(paths):
+            lookups.append(sorted(paths))
+            return client.parse_svn_info_xml(SVN_INFO_XML)
+
+        def svn_info(path, ignore_errors=False):
+            lookups.append(path)
+            return None
+
+        client.svn_info_paths = svn_info_paths
+        client.svn_info = svn_info
+
+        diff = [
+            'Index: src/foo.c\n',
+            '=' * 67 + '\n',
+            '--- src/foo.c\t(revision 12)\n',
+            '+++ src/foo.c\t(working copy)\n',
+            '@@ -1 +1 @@\n',
+            '-a\n',
+            '+b\n',
+            'Index: unknown.c\n',
+        ]
+        result = client.convert_to_absolute_paths(diff, None)
+
+        self.assertEqual(result[0], 'Index: /branches/b1/src/foo.c\n')
+        self.assertEqual(result[2],
+                         '--- /branches/b1/src/foo.c\t(revision 12)\n')
+        self.assertEqual(result[3],
+                         '+++ /branches/b1/src/foo.c\t(working copy)\n')
+        self.assertEqual(result[4:], diff[4:])
+
+        # Every file is looked up at once, and only files svn didn't
+        # report on are looked up again.
+        self.assertEqual(lookups, [['src/foo.c', 'src/foo.c', 'src/foo.c',
+                                    'unknown.c'],
+                                   'unknown.c'])
+
+    def test_handle_renames(self):
+        """Testing SVNClient.handle_renames with a copied directory"""
+        client = SVNClient(options=self.options)
+        root = 'http://svn.example.com/svn'
+        infos = {
+            'b1/src': {
+                'Repository Root': root,
+                'Copied From URL': root + '/trunk/src',
+            },
+            'b1': {
+                'Repository Root': root,
+            },
+        }
+        lookups = []
+
+        for i in range(3):
+            infos['b1/src/file%d.c' % i] = {
+                'Repository Root': root,
+            }
+
+        def svn_info_paths(paths):
+            lookups.append(sorted(set(paths)))
+            return dict([(path, infos[path]) for path in paths])
+
+        def svn_info(path, ignore_errors=False):
+            lookups.append(path)
+            return infos[path]
+
+        client.svn_info_paths = svn_info_paths
+        client.svn_info = svn_info
+
+        diff = []
+
+        for i in range(3):
+            diff += [
+                'Index: b1/src/file%d.c\n' % i,
+                '--- b1/src/file%d.c\t(revision 12)\n' % i,
+                '+++ b1/src/file%d.c\t(working copy)\n' % i,
+            ]
+
+        result = client.handle_renames(diff)
+
+        for i in range(3):
+            self.assertEqual(result[i * 3 + 1],
+                             '--- /trunk/src/file%d.c\t(revision 12)\n' % i)
+
+        # All the files and their directories were looked up at once.
+        self.assertEqual(lookups, [sorted(infos.keys())])
+
+        # Without that, each directory is still only looked up once.
+        lookups = []
+        shared = {}
+        self.assertEqual(client.find_copyfrom('b1/src/file0.c', shared),
+                         '/trunk/src/file0.c')
+        self.assertEqual(client.find_copyfrom('b1/src/file1.c', shared),
+                         '/trunk/src/file1.c')
+        self.assertEqual(lookups, ['b1/src/file0.c', 'b1/src',
+                                   'b1/src/file1.c'])
+
+    def test_do_diff(self):
+        """Testing SVNClient.do_diff processing the diff in chunks"""
+        client = SVNClient(options=self.options)
+        client.SVN_INFO_BATCH_SIZE = 2
+        root = 'http://svn.example.com/svn'
+        infos = {
+            'src': {
+                'URL': root + '/branches/b1/src',
+                'Repository Root': root,
+                'Copied From URL': root + '/trunk/src',
+            },
+            'src/foo.c': {
+                'URL': root + '/branches/b1/src/foo.c',
+                'Repository Root': root,
+            },
+        }
+        lookups = []
+
+        def svn_info_paths(paths):
+            lookups.append(sorted(set(paths)))
+            return infos
+
+        client.svn_info_paths = svn_info_paths
+
+        diff = [
+            'Index: src/foo.c\n',
+            '=' * 67 + '\n',
+            '--- src/foo.c\t(revision 12)\n',
+            '+++ src/foo.c\t(working copy)\n',
+            '@@ -1 +1 @@\n',
+            '-a\n',
+            '+b\n',
+        ] * 20
+        diff_file = os.path.join(self.chdir_tmp(), 'diff')
+        fp = open(diff_file, 'w')
+        fp.write(''.join(diff))
+        fp.close()
+
+        # Small enough that the result moves to disk.
+        client.DIFF_SPOOL_SIZE = 100
+        result = client.do_diff(['cat', diff_file]).readlines()
+        self.assertEqual(len(result), len(diff))
+        self.assertEqual(result[0], 'Index: /branches/b1/src/foo.c\n')
+        self.assertEqual(result[2], '--- /trunk/src/foo.c\t(revision 12)\n')
+        self.assertEqual(result[3],
+                         '+++ /branches/b1/src/foo.c\t(working copy)\n')
+        self.assertEqual(result[4:7], diff[4:7])
+        self.assertEqual(result[-7:], result[:7])
+
+        # Each file's paths are only looked up once, in the first chunk.
+        self.assertEqual(lookups, [['src', 'src/foo.c']])
+
+    def test_process_diff_chunks(self):
+        """Testing SVNClient.process_diff looking up paths a chunk at a time
+        """
+        client = SVNClient(options=self.options)
+        client.SVN_INFO_BATCH_SIZE = 3
+        root = 'http://svn.example.com/svn'
+        lookups = []
+
+        def svn_info_paths(paths):
+            lookups.append(sorted(paths))
+            return dict([(path, {'URL': root + '/trunk/' + path,
+                                 'Repository Root': root})
+                         for path in paths])
+
+        client.svn_info_paths = svn_info_paths
+
+        diff = []
+
+        for i in range(3):
+            diff += [
+                'Index: src/f%d.c\n' % i,
+                '=' * 67 + '\n',
+                '--- src/f%d.c\t(revision 12)\n' % i,
+                '+++ src/f%d.c\t(working copy)\n' % i,
+                '@@ -1 +1 @@\n',
+                '-a\n',
+                '+b\n',
+            ]
+
+        result = client.process_diff(iter(diff)).readlines()
+        self.assertEqual(len(result), len(diff))
+        self.assertEqual(result[14], 'Index: /trunk/src/f2.c\n')
+        self.assertEqual(lookups, [
+            ['src', 'src/f0.c', 'src/f1.c'],
+            ['src/f2.c'],
+        ])
+
+    def test_working_copy_parents(self):
+        """Testing SVNClient._get_working_copy_parents"""
+        client = SVNClient(options=self.options)
+        top = os.path.realpath(self.chdir_tmp())
+        subdir = os.path.join(top, 'wc', 'a', 'b')
+        os.makedirs(subdir)
+        os.chdir(subdir)
+
+        self.assertEqual(client._get_working_copy_parents(), [])
+
+        # Subversion 1.7 and newer.
+        os.mkdir(os.path.join(top, 'wc', '.svn'))
+        parents = [subdir, os.path.dirname(subdir),
+                   os.path.join(top, 'wc')]
+        self.assertEqual(client._get_working_copy_parents(), parents)
+
+        # Older versions.
+        os.mkdir(os.path.join(subdir, '.svn'))
+        os.mkdir(os.path.join(os.path.dirname(subdir), '.svn'))
+        self.assertEqual(client._get_working_copy_parents(), parents)
+
+    def test_find_nearest_url_prop(self):
+        """Testing SVNClient._find_nearest_url_prop"""
+        client = SVNClient(options=self.options)
+        xml = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<properties>\n'
+               '<target path="/wc">\n'
+               '<property name="reviewboard:url">http://reviews.example.com/'
+               '</property>\n'
+               '</target>\n'
+               '<target path="/wc/a">\n'
+               '<property name="reviewboard:url">http://a.example.com/\n'
+               '</property>\n'
+               '</target>\n'
+               '</properties>\n')
+
+        self.assertEqual(
+            client._find_nearest_url_prop(xml, ['/wc/a/b', '/wc/a', '/wc']),
+            'http://a.example.com/')
+        self.assertEqual(client._find_nearest_url_prop(xml, ['/wc']),
+                         'http://reviews.example.com/')
+        self.assertEqual(client._find_nearest_url_prop('', ['/wc']), None)
+
+    def test_parse_svn_status_xml(self):
+        """Testing SVNClient.parse_svn_status_xml"""
+        client = SVNClient(options=self.options)
+        self.assertEqual(client.parse_svn_status_xml(SVN_STATUS_XML),
+                         ['src/foo.c', 'src/new', 'src/old.c', 'src'])
+
+    def test_diff_sharded(self):
+        """Testing SVNClient.diff_sharded merging the shards in order"""
+        client = SVNClient(options=self.options)
+        client.MAX_PATHS_LENGTH = 25
+        client.svn_info_paths = lambda paths: {}
+        client.svn_info = lambda path, ignore_errors=False: None
+        commands = []
+
+        def execute(command, **kwargs):
+            commands.append(command)
+            return SVN_STATUS_XML
+
+        def execute_stream(command, **kwargs):
+            commands.append(command)
+            return iter(['Index: %s\n+change\n' % path
+                         for path in command[5:]])
+
+        old_execute = svn.execute
+        old_execute_stream = svn.execute_stream
+        svn.execute = execute
+        svn.execute_stream = execute_stream
+
+        try:
+            result = client.diff_sharded([], 2)
+        finally:
+            svn.execute = old_execute
+            svn.execute_stream = old_execute_stream
+
+        self.assertEqual(result.read(),
+                         'Index: src\n+change\n'
+                         'Index: src/foo.c\n+change\n'
+                         'Index: src/new\n+change\n'
+                         'Index: src/old.c\n+change\n')
+
+        self.assertEqual(commands[0],
+                         ['svn', 'status', '--xml', '--ignore-externals'])
+
+        # The shards may be diffed in either order.
+        self.assertEqual(sorted([command[5:] for command in commands[1:]]),
+                         [['src', 'src/foo.c'], ['src/new', 'src/old.c']])
+
+    @raises(SystemExit)
+    def test_diff_sharded_error(self):
+        """Testing SVNClient.diff_sharded closing the spools on an error"""
+        client = SVNClient(options=self.options)
+        client.MAX_PATHS_LENGTH = 25
+        spools = []
+        diff_shard = client._diff_shard
+        spooled = threading.Event()
+
+        def execute_stream(command, **kwargs):
+            if 'src' in command:
+                # Fail once the other shard has been spooled.
+                spooled.wait(5)
+                die()
+
+            return iter(['Index: %s\n+change\n' % path
+                         for path in command[5:]])
+
+        def record_spool(paths):
+            spools.append(diff_shard(paths))
+            spooled.set()
+
+            return spools[-1]
+
+        client._diff_shard = record_spool
+        old_execute = svn.execute
+        old_execute_stream = svn.execute_stream
+        svn.execute = lambda command, **kwargs: SVN_STATUS_XML
+        svn.execute_stream = execute_stream
+
+        try:
+            client.diff_sharded([], 2)
+        finally:
+            svn.execute = old_execute
+            svn.execute_stream = old_execute_stream
+            self.assertEqual(len(spools), 1)
+            self.assertTrue(spools[0].closed)
+
+    def test_split_paths(self):
+        """Testing SVNClient._split_paths"""
+        client = SVNClient(options=self.options)
+        client.MAX_PATHS_LENGTH = 20
+        paths = ['a' * 7, 'b' * 7, 'c' * 15, 'd', 'e', 'f']
+        self.assertEqual(client._split_paths(paths),
+                         [paths[:2], paths[2:3], paths[3:]])
+        self.assertEqual(client._split_paths(paths, 2),
+                         [paths[:2], paths[2:3], paths[3:5], paths[5:]])
+
+        # A path that's too long on its own still gets a batch.
+        self.assertEqual(client._split_paths(['x' * 30]), [['x' * 30]])
+
+    def test_find_server_repository_info(self):
+        """Testing SVNRepositoryInfo.find_server_repository_info"""
+        server = FakeSVNServer([
+            ('uuid-1', 'http://svn.example.com/a', 'http://svn.example.com/a'),
+            ('uuid-2', 'file:///svn/b', 'file:///svn/b'),
+            ('uuid-2', 'file:///svn/b/trunk', 'file:///svn/b'),
+        ])
+
+        info = SVNRepositoryInfo('http://svn.example.com/b', '/trunk/src',
+                                 'uuid-2')
+        result = info.find_server_repository_info(server)
+        self.assertEqual(result.path, 'file:///svn/b')
+        self.assertEqual(result.base_path, '/trunk/src')
+        self.assertEqual(len(server.info_requests), 3)
+        save_caches()
+
+        # The next run should find the repository in the cache.
+        server.info_requests = []
+        result = info.find_server_repository_info(server)
+        self.assertEqual(result.path, 'file:///svn/b')
+        self.assertEqual(server.info_requests, [])
+
+    def test_forget_server_repository_info(self):
+        """Testing SVNRepositoryInfo.forget_server_repository_info"""
+        server = FakeSVNServer([
+            ('uuid-1', 'file:///svn/a', 'file:///svn/a'),
+            ('uuid-2', 'file:///svn/b', 'file:///svn/b'),
+        ])
+
+        info = SVNRepositoryInfo('http://svn.example.com/b', '/trunk',
+                                 'uuid-2')
+        info.find_server_repository_info(server)
+        self.assertFalse(info.forget_server_repository_info(server))
+        save_caches()
+
+        # The repository moved on the server since it was cached.
+        server.infos[2]['uuid'] = 'uuid-3'
+        server.infos[1]['uuid'] = 'uuid-2'
+        server.info_requests = []
+        result = info.find_server_repository_info(server)
+        self.assertEqual(result.path, 'file:///svn/b')
+        self.assertEqual(server.info_requests, [])
+
+        self.assertTrue(info.forget_server_repository_info(server))
+        result = info.find_server_repository_info(server)
+        self.assertEqual(result.path, 'file:///svn/a')
+        self.assertEqual(server.info_requests, [1, 2])
+        self.assertFalse(info.forget_server_repository_info(server))
+
+    def test_find_server_repository_info_no_match(self):
+        """Testing SVNRepositoryInfo.find_server_repository_info without a
+        matching repository"""
+        server = FakeSVNServer([
+            ('uuid-1', 'http://svn.example.com/a', 'http://svn.example.com/a'),
+        ])
+
+        info = SVNRepositoryInfo('http://svn.example.com/b', '/', 'uuid-2')
+        self.assertTrue(info.find_server_repository_info(server) is info)
+
+
+class FakeSVNServer(object):
+    """A stand-in for ReviewBoardServer with Subversion repositories."""
+    MAX_PARALLEL_REQUESTS = 2
+
+    def __init__(self, repositories):
+        self.url = 'http://reviews.example.com/'
+        self.use_cache = True
+        self.info_requests = []
+        self.repositories = []
+        self.infos = {}
+
+        for i, (uuid, url, root_url) in enumerate(repositories):
+            self.repositories.append({
+                'id': i + 1,
+                'tool': 'Subversion',
+            })
+            self.infos[i + 1] = {
+                'uuid': uuid,
+                'url': url,
+                'root_url': root_url,
+            }
+
+    def get_repositories(self, tool=None):
+        return self.repositories
+
+    def get_repository_info(self, rid):
+        self.info_requests.append(rid)
+        return self.infos[rid]
+
+
 class PerforceClientTests(SCMClientTests):
     def setUp(self):
         super(PerforceClientTests, self).setUp()
@@ -710,6 +1239,196 @@ class PerforceClientTests(SCMClientTests):
         client = PerforceClient(options=self.options)
         client.check_options()
 
+    def test_run_p4(self):
+        """Testing PerforceClient._run_p4 reading marshalled records"""
+        records = [{'code': 'stat', 'change': '1'},
+                   {'code': 'stat', 'change': '2'}]
+        bin_dir = self.chdir_tmp()
+        fp = open('p4', 'w')
+        fp.write('#!%s\n'
+                 'import marshal, sys\n'
+                 'for record in %r:\n'
+                 '    sys.stdout.write(marshal.dumps(record))\n'
+                 % (sys.executable, records))
+        fp.close()
+        os.chmod('p4', 0755)
+
+        old_path = os.environ['PATH']
+        os.environ['PATH'] = bin_dir + os.pathsep + old_path
+        timings.timings.groups.pop('p4 changes', None)
+
+        try:
+            client = PerforceClient(options=self.options)
+            self.assertEqual(client._run_p4(['changes']), records)
+        finally:
+            os.environ['PATH'] = old_path
+
+        size = 0
+
+        for record in records:
+            size += len(marshal.dumps(record))
+
+        self.assertEqual(timings.timings.groups['p4 changes']['bytes'], size)
+
+
+class FakeClient(SCMClient):
+    """A client that takes a while to decide if it's in use."""
+    PARALLEL_PROBE = True
+
+    def __init__(self, name, delay, path=None, **kwargs):
+        super(FakeClient, self).__init__(**kwargs)
+        self.name = name
+        self.delay = delay
+        self.path = path
+        self.probes = 0
+        self.finishes = 0
+
+    def finish_detection(self):
+        self.finishes += 1
+
+    def get_repository_info(self):
+        self.probes += 1
+        time.sleep(self.delay)
+        setattr(self.options, 'probed_' + self.name, True)
+
+        if self.path:
+            return RepositoryInfo(path=self.path)
+
+        return None
+
+
+class ScanUsableClientTests(SCMClientTests):
+    def setUp(self):
+        super(ScanUsableClientTests, self).setUp()
+        self.set_user_home_tmp()
+        self.orig_dir = os.getcwd()
+
+        # The detection cache lives in the home directory, which is
+        # different for each test.
+        clients._detection_cache = None
+        self.options.change_only = False
+        self.options.parent_branch = None
+        self.options.p4_client = None
+        self.options.p4_port = None
+        self.saved_clients = clients.SCMCLIENTS
+
+    def tearDown(self):
+        clients.SCMCLIENTS = self.saved_clients
+        os.chdir(self.orig_dir)
+
+    def test_priority(self):
+        """Testing scan_usable_client keeping the order of priority"""
+        clients.SCMCLIENTS = [
+            FakeClient('a', 0.1, options=self.options),
+            FakeClient('b', 0.2, 'first', options=self.options),
+            FakeClient('c', 0, 'second', options=self.options),
+        ]
+
+        repository_info, tool = clients.scan_usable_client(self.options)
+        self.assertEqual(repository_info.path, 'first')
+        self.assertTrue(tool is clients.SCMCLIENTS[1])
+        self.assertTrue(tool.options is self.options)
+
+        # Only the changes made by the clients that would have been probed
+        # one at a time are kept.
+        self.assertTrue(self.options.probed_a)
+        self.assertTrue(self.options.probed_b)
+        self.assertFalse(hasattr(self.options, 'probed_c'))
+
+        # Only the chosen client is finished.
+        self.assertEqual([client.finishes for client in clients.SCMCLIENTS],
+                         [0, 1, 0])
+
+    def test_sequential_probes(self):
+        """Testing scan_usable_client probing some clients one at a time"""
+        clients.SCMCLIENTS = [
+            FakeClient('a', 0.1, options=self.options),
+            FakeClient('b', 0, options=self.options),
+            FakeClient('c', 0.2, 'first', options=self.options),
+            FakeClient('d', 0, 'second', options=self.options),
+        ]
+        clients.SCMCLIENTS[1].PARALLEL_PROBE = False
+        clients.SCMCLIENTS[3].PARALLEL_PROBE = False
+
+        repository_info, tool = clients.scan_usable_client(self.options)
+        self.assertEqual(repository_info.path, 'first')
+        self.assertTrue(tool is clients.SCMCLIENTS[2])
+
+        # d isn't probed at all, even though c takes the longest.
+        self.assertEqual([client.probes for client in clients.SCMCLIENTS],
+                         [1, 1, 1, 0])
+
+    def test_detection_cache(self):
+        """Testing scan_usable_client caching the detected client"""
+        self.chdir_tmp()
+        os.mkdir('.fake')
+        open(os.path.join('.fake', 'marker'), 'w').close()
+
+        clients.SCMCLIENTS = [
+            FakeClient('a', 0, options=self.options),
+            FakeClient('b', 0, 'first', options=self.options),
+        ]
+
+        for client in clients.SCMCLIENTS:
+            client.DETECTION_MARKERS = ['.fake/marker']
+
+        repository_info, tool = clients.scan_usable_client(self.options)
+        self.assertEqual(repository_info.path, 'first')
+
+        # The second scan shouldn't probe anything, but should restore the
+        # state of the client and the options it set.
+        del self.options.probed_b
+        tool.path = None
+
+        repository_info, tool = clients.scan_usable_client(self.options)
+        self.assertEqual(repository_info.path, 'first')
+        self.assertTrue(tool is clients.SCMCLIENTS[1])
+        self.assertEqual(tool.path, 'first')
+        self.assertTrue(self.options.probed_b)
+        self.assertEqual([client.probes for client in clients.SCMCLIENTS],
+                         [1, 1])
+        # The state is cached before the client is finished, so this is
+        # the finish for the second scan.
+        self.assertEqual(tool.finishes, 1)
+
+        # Changing a marker invalidates the cache.
+        os.utime(os.path.join('.fake', 'marker'), (0, 0))
+        clients.SCMCLIENTS[1].path = 'changed'
+
+        repository_info, tool = clients.scan_usable_client(self.options)
+        self.assertEqual(repository_info.path, 'changed')
+        self.assertEqual([client.probes for client in clients.SCMCLIENTS],
+                         [2, 2])
+
+    def test_detection_signature(self):
+        """Testing get_detection_signature"""
+        path = self.chdir_tmp()
+        os.mkdir('.fake')
+        open(os.path.join('.fake', 'marker'), 'w').close()
+        os.mkdir('sub')
+
+        client = FakeClient('a', 0, options=self.options)
+        self.assertEqual(
+            clients.get_detection_signature([client],
+                                            os.path.join(path, 'sub')),
+            None)
+
+        client.DETECTION_MARKERS = ['.fake/marker', '.fake/missing']
+        signature = clients.get_detection_signature(
+            [client], os.path.join(path, 'sub'))
+        self.assertEqual(signature[0][0], path)
+        self.assertEqual([marker[0] for marker in signature[0][1]],
+                         ['.fake/marker'])
+
+    @raises(SystemExit)
+    def test_no_client(self):
+        """Testing scan_usable_client without a usable client"""
+        clients.SCMCLIENTS = [
+            FakeClient('a', 0, options=self.options),
+            FakeClient('b', 0, options=self.options),
+        ]
+        clients.scan_usable_client(self.options)
+
 
 FOO = """\
 ARMA virumque cano, Troiae qui primus ab oris
@@ -909,3 +1628,56 @@ Index: foo.txt
 +moenia Romae. Albanique patres, atque altae
 +moenia Romae. Musa, mihi causas memora, quo numine laeso,
  \n"""
+
+SVN_INFO_XML = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<info>
+<entry
+   kind="file"
+   path="src/foo.c"
+   revision="12">
+<url>http://svn.example.com/svn/branches/b1/src/foo.c</url>
+<repository>
+<root>http://svn.example.com/svn</root>
+<uuid>0a4b4c8e-8bd2-4ec0-9b2a-3f1c6d2f9a71</uuid>
+</repository>
+<wc-info>
+<schedule>add</schedule>
+<copy-from-url>http://svn.example.com/svn/trunk/src/foo.c</copy-from-url>
+<copy-from-rev>11</copy-from-rev>
+</wc-info>
+</entry>
+</info>
+"""
+
+SVN_STATUS_XML = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<status>
+<target path=".">
+<entry path="src/foo.c">
+<wc-status item="modified" props="none" revision="12">
+</wc-status>
+</entry>
+<entry path="src/new">
+<wc-status item="added" props="none" revision="-1">
+</wc-status>
+</entry>
+<entry path="src/unversioned.c">
+<wc-status item="unversioned" props="none">
+</wc-status>
+</entry>
+<entry path="src/old.c">
+<wc-status item="deleted" props="none" revision="12">
+</wc-status>
+</entry>
+<entry path="src">
+<wc-status item="normal" props="modified" revision="12">
+</wc-status>
+</entry>
+<entry path="src/ext">
+<wc-status item="external" props="modified">
+</wc-status>
+</entry>
+</target>
+</status>
+"""
@@ -1,24 +1,23 @@
 #!/usr/bin/env python
-import base64
-import cookielib
+import atexit
 import getpass
 import logging
-import mimetools
 import os
 import re
 import sys
-import urllib2
+import time
 from optparse import OptionParser
-from pkg_resources import parse_version
 from urlparse import urljoin, urlparse
 
 from rbtools import get_package_version, get_version_string
 from rbtools.api.errors import APIError
+from rbtools.api.repositories import RepositoryIndex
 from rbtools.clients import scan_usable_client
-from rbtools.clients.perforce import PerforceClient
-from rbtools.clients.plastic import PlasticClient
-from rbtools.utils.filesystem import get_config_value, load_config_files
-from rbtools.utils.process import die
+from rbtools.utils.cache import Cache, save_caches, set_caches_persistent
+from rbtools.utils.filesystem import config_loader, get_config_value, \
+                                     get_home_path, load_config_files
+from rbtools.utils.process import die, set_default_timeout
+from rbtools.utils.timings import timings
 
 try:
     # Specifically import json_loads, to work around some issues with
@@ -35,152 +34,46 @@ ADD_REPOSITORY_DOCS_URL = \
     'http://www.reviewboard.org/docs/manual/dev/admin/configuration/repositories/'
 
 
-class HTTPRequest(urllib2.Request):
-    def __init__(self, url, body='', headers={}, method="PUT"):
-        urllib2.Request.__init__(self, url, body, headers)
-        self.method = method
-
-    def get_method(self):
-        return self.method
-
-
-class PresetHTTPAuthHandler(urllib2.BaseHandler):
-    """urllib2 handler that conditionally presets the use of HTTP Basic Auth.
-
-    This is used when specifying --username= on the command line. It will
-    force an HTTP_AUTHORIZATION header with the user info, asking the user
-    for any missing info beforehand. It will then try this header for that
-    first request.
-
-    It will only do this once.
-    """
-    handler_order = 480 # After Basic auth
-
-    def __init__(self, url, password_mgr):
-        self.url = url
-        self.password_mgr = password_mgr
-        self.used = False
-
-    def reset(self):
-        self.password_mgr.rb_user = options.http_username
-        self.password_mgr.rb_pass = options.http_password
-        self.used = False
-
-    def http_request(self, request):
-        if options.username and not self.used:
-            # Note that we call password_mgr.find_user_password to get the
-            # username and password we're working with. This allows us to
-            # prompt if, say, --username was specified but --password was not.
-            username, password = \
-                self.password_mgr.find_user_password('Web API', self.url)
-            raw = '%s:%s' % (username, password)
-            request.add_header(
-                urllib2.HTTPBasicAuthHandler.auth_header,
-                'Basic %s' % base64.b64encode(raw).strip())
-            self.used = True
-
-        return request
-
-    https_request = http_request
-
-
-class ReviewBoardHTTPErrorProcessor(urllib2.HTTPErrorProcessor):
-    """Processes HTTP error codes.
-
-    Python 2.6 gets HTTP error code processing right, but 2.4 and 2.5 only
-    accepts HTTP 200 and 206 as success codes. This handler ensures that
-    anything in the 200 range is a success.
-    """
-    def http_response(self, request, response):
-        if not (200 <= response.code < 300):
-            response = self.parent.error('http', request, response,
-                                         response.code, response.msg,
-                                         response.info())
-
-        return response
-
-    https_response = http_response
-
-
-class ReviewBoardHTTPBasicAuthHandler(urllib2.HTTPBasicAuthHandler):
-    """Custom Basic Auth handler that doesn't retry excessively.
-
-    urllib2's HTTPBasicAuthHandler retries over and over, which is useless.
-    This subclass only retries once to make sure we've attempted with a
-    valid username and password. It will then fail so we can use
-    tempt_fate's retry handler.
-    """
-    def __init__(self, *args, **kwargs):
-        urllib2.HTTPBasicAuthHandler.__init__(self, *args, **kwargs)
-        self._retried = False
-        self._lasturl = ""
-
-    def retry_http_basic_auth(self, *args, **kwargs):
-        if self._lasturl != args[0]:
-            self._retried = False
-
-        self._lasturl = args[0]
-
-        if not self._retried:
-            self._retried = True
-            self.retried = 0
-            response = urllib2.HTTPBasicAuthHandler.retry_http_basic_auth(
-                self, *args, **kwargs)
-
-            if response.code != 401:
-                self._retried = False
-
-            return response
-        else:
-            return None
-
-
-class ReviewBoardHTTPPasswordMgr(urllib2.HTTPPasswordMgr):
+class ReviewBoardServer(object):
     """
-    Adds HTTP authentication support for URLs.
+    An instance of a Review Board server.
 
-    Python 2.4's password manager has a bug in http authentication when the
-    target server uses a non-standard port.  This works around that bug on
-    Python 2.4 installs. This also allows post-review to prompt for passwords
-    in a consistent way.
+    If use_cache is True, information that rarely changes (such as the
+    API root resource) is cached between runs in the user's cache
+    directory.
 
-    See: http://bugs.python.org/issue974757
+    Requests that fail because the server is temporarily unavailable are
+    retried, as decided by the RetryPolicy.
     """
-    def __init__(self, reviewboard_url, rb_user=None, rb_pass=None):
-        self.passwd  = {}
-        self.rb_url  = reviewboard_url
-        self.rb_user = rb_user
-        self.rb_pass = rb_pass
-
-    def find_user_password(self, realm, uri):
-        if realm == 'Web API':
-            if self.rb_user is None or self.rb_pass is None:
-                if options.diff_filename == '-':
-                    die('HTTP authentication is required, but cannot be '
-                        'used with --diff-filename=-')
-
-                print "==> HTTP Authentication Required"
-                print 'Enter authorization information for "%s" at %s' % \
-                    (realm, urlparse(uri)[1])
-
-                if not self.rb_user:
-                    self.rb_user = raw_input('Username: ')
-
-                if not self.rb_pass:
-                    self.rb_pass = getpass.getpass('Password: ')
-
-            return self.rb_user, self.rb_pass
-        else:
-            # If this is an auth request for some other domain (since HTTP
-            # handlers are global), fall back to standard password management.
-            return urllib2.HTTPPasswordMgr.find_user_password(self, realm, uri)
+    # How long the cached API root resource and server version are trusted
+    # before being fetched again, in seconds.
+    API_CACHE_TTL = 24 * 60 * 60
+
+    # How long the cached list of repositories is used before being
+    # fetched again, in seconds. It's also refetched if a path lookup
+    # fails.
+    REPOSITORY_CACHE_TTL = 60 * 60
+
+    # The number of repositories to fetch per page, and the number of pages
+    # to fetch at once.
+    REPOSITORY_PAGE_SIZE = 200
+    MAX_PARALLEL_REQUESTS = 4
+
+    def __init__(self, url, info, cookie_file, use_cache=False):
+        # The HTTP stack is only imported once it's needed, so that
+        # commands like --help don't pay for it.
+        import urllib2
+        from rbtools.api.connection import ConnectionPool, \
+                                           KeepAliveHTTPHandler, \
+                                           KeepAliveHTTPSHandler
+        from rbtools.api.cookies import PersistentCookieJar
+        from rbtools.api.handlers import PresetHTTPAuthHandler, \
+                                         ReviewBoardHTTPBasicAuthHandler, \
+                                         ReviewBoardHTTPErrorProcessor, \
+                                         ReviewBoardHTTPPasswordMgr
+        from rbtools.api.httpcache import HTTPCache
+        from rbtools.api.retry import RetryPolicy
 
-
-class ReviewBoardServer(object):
-    """
-    An instance of a Review Board server.
-    """
-    def __init__(self, url, info, cookie_file):
         self.url = url
         if self.url[-1] != '/':
             self.url += '/'
@@ -188,8 +81,26 @@ class ReviewBoardServer(object):
         self._server_info = None
         self.root_resource = None
         self.deprecated_api = False
+        self.use_cache = use_cache
+        self.using_cached_api = False
+        self._repository_index = None
+
+        # Whether diffs are gzipped before they're uploaded. A stock server
+        # doesn't accept them, so this is only set for servers that are
+        # known to.
+        self.compress_diffs = False
+
+        if use_cache:
+            self.api_cache = Cache('api', ttl=self.API_CACHE_TTL)
+            self.http_cache = HTTPCache()
+            self.repository_cache = Cache('repositories',
+                                          ttl=self.REPOSITORY_CACHE_TTL)
+        else:
+            self.api_cache = None
+            self.http_cache = None
+            self.repository_cache = None
         self.cookie_file = cookie_file
-        self.cookie_jar  = cookielib.MozillaCookieJar(self.cookie_file)
+        self.cookie_jar  = PersistentCookieJar(self.cookie_file)
 
         if self.cookie_file:
             try:
@@ -198,12 +109,25 @@ class ReviewBoardServer(object):
                 pass
 
         # Set up the HTTP libraries to support all of the features we need.
-        password_mgr = ReviewBoardHTTPPasswordMgr(self.url,
+        password_mgr = ReviewBoardHTTPPasswordMgr(self.url, options,
                                                   options.username,
                                                   options.password)
-        self.preset_auth_handler = PresetHTTPAuthHandler(self.url, password_mgr)
+        self.preset_auth_handler = PresetHTTPAuthHandler(self.url,
+                                                         password_mgr,
+                                                         options)
+
+        self.retry_policy = RetryPolicy(max_retries=options.http_retries)
+
+        # Reuse connections to the server across API calls, rather than
+        # opening a new one (and doing a new TLS handshake) for each.
+        self.connection_pool = ConnectionPool()
+
+        handlers = [
+            KeepAliveHTTPHandler(self.connection_pool),
+        ]
 
-        handlers = []
+        if KeepAliveHTTPSHandler:
+            handlers.append(KeepAliveHTTPSHandler(self.connection_pool))
 
         if options.disable_proxy:
             debug('Disabling HTTP(s) proxy support')
@@ -221,8 +145,32 @@ class ReviewBoardServer(object):
         opener.addheaders = [('User-agent', 'RBTools/' + get_package_version())]
         urllib2.install_opener(opener)
 
+    def close(self):
+        """
+        Saves any changed cookies and closes open connections to the server.
+        """
+        self.flush_cookies()
+
+        if self.http_cache:
+            debug('HTTP cache: %s' % self.http_cache)
+
+        debug('HTTP connection pool: %s' % self.connection_pool)
+        debug('HTTP retries: %s' % self.retry_policy)
+        self.connection_pool.close()
+
+    def flush_cookies(self):
+        """Writes the cookie file, if any cookies have changed."""
+        try:
+            if self.cookie_jar.flush():
+                debug('Saved cookies to %s' % self.cookie_file)
+        except (IOError, OSError), e:
+            debug('Failed to write cookie file: %s' % e)
+
     def check_api_version(self):
         """Checks the API version on the server to determine which to use."""
+        if self._load_cached_api():
+            return True
+
         try:
             root_resource = self.api_get('api/')
             rsp = self.api_get(root_resource['links']['info']['href'])
@@ -233,6 +181,13 @@ class ReviewBoardServer(object):
                 self.deprecated_api = False
                 self.root_resource = root_resource
                 debug('Using the new web API')
+
+                if self.api_cache:
+                    self.api_cache.set(self.url, {
+                        'root_resource': root_resource,
+                        'package_version': self.rb_version,
+                    })
+
                 return True
         except APIError, e:
             if e.http_status not in (401, 404):
@@ -252,6 +207,48 @@ class ReviewBoardServer(object):
         debug('Using the deprecated Review Board 1.0 web API')
         return True
 
+    def _load_cached_api(self):
+        """
+        Loads the root resource and server version from the cache, if
+        they're there. Returns True if the cached information can be used.
+
+        The server's version is checked against the cached one first, with
+        a conditional GET of the info resource, which the HTTP cache
+        usually answers with a 304. If the server has been upgraded (or
+        downgraded), the cached information is thrown away.
+        """
+        if not self.api_cache:
+            return False
+
+        cached = self.api_cache.get(self.url)
+
+        if not cached:
+            return False
+
+        try:
+            rsp = self.api_get(
+                cached['root_resource']['links']['info']['href'])
+            rb_version = rsp['info']['product']['package_version']
+        except (APIError, KeyError), e:
+            debug('Unable to check the cached server version: %s' % e)
+            self.api_cache.remove(self.url)
+            return False
+
+        if rb_version != cached['package_version']:
+            debug('Review Board was %s when cached, and is now %s' %
+                  (cached['package_version'], rb_version))
+            self.api_cache.remove(self.url)
+            return False
+
+        self.rb_version = cached['package_version']
+        self.root_resource = cached['root_resource']
+        self.deprecated_api = False
+        self.using_cached_api = True
+        debug('Using the new web API (cached for Review Board %s)' %
+              self.rb_version)
+
+        return True
+
     def login(self, force=False):
         """
         Logs in to a Review Board server, prompting the user for login
@@ -289,7 +286,7 @@ class ReviewBoardServer(object):
                 self.api_post('api/json/accounts/login/', {
                     'username': username,
                     'password': password,
-                })
+                }, idempotent=True)
             except APIError, e:
                 die("Unable to log in: %s" % e)
 
@@ -347,17 +344,15 @@ class ReviewBoardServer(object):
         # If repository_path is a list, find a name in the list that's
         # registered on the server.
         if isinstance(self.info.path, list):
-            repositories = self.get_repositories()
-
-            debug("Repositories on Server: %s" % repositories)
             debug("Server Aliases: %s" % self.info.path)
 
-            for repository in repositories:
-                if repository['path'] in self.info.path:
-                    self.info.path = repository['path']
-                    break
+            repository = self.find_repository(self.info.path)
+
+            if repository:
+                self.info.path = repository['path']
+            else:
+                repositories = self.get_repositories()
 
-            if isinstance(self.info.path, list):
                 sys.stderr.write('\n')
                 sys.stderr.write('There was an error creating this review '
                                  'request.\n')
@@ -417,6 +412,10 @@ class ReviewBoardServer(object):
                     debug("Review request already exists. Updating it...")
                     self.update_review_request_from_changenum(
                         changenum, rsp['review_request'])
+            elif e.error_code == 206 and self._forget_server_info():
+                # The repository came from a cache and may be stale.
+                debug("Repository was rejected. Looking it up again...")
+                return self.new_review_request(changenum, submit_as)
             elif e.error_code == 206: # Invalid repository
                 sys.stderr.write('\n')
                 sys.stderr.write('There was an error creating this review '
@@ -453,19 +452,28 @@ class ReviewBoardServer(object):
         """
         Sets a field in a review request to the specified value.
         """
+        self.set_review_request_fields(review_request, {field: value})
+
+    def set_review_request_fields(self, review_request, fields):
+        """
+        Sets several fields in a review request to the specified values.
+
+        With the new API, this is done with a single update to the draft.
+        The deprecated 1.0 API only gets one field set per request.
+        """
         rid = review_request['id']
 
-        debug("Attempting to set field '%s' to '%s' for review request '%s'" %
-              (field, value, rid))
+        for field, value in fields.iteritems():
+            debug("Attempting to set field '%s' to '%s' for review request "
+                  "'%s'" % (field, value, rid))
 
         if self.deprecated_api:
-            self.api_post('api/json/reviewrequests/%s/draft/set/' % rid, {
-                field: value,
-            })
-        else:
-            self.api_put(review_request['links']['draft']['href'], {
-                field: value,
-            })
+            for field, value in fields.iteritems():
+                self.api_post('api/json/reviewrequests/%s/draft/set/' % rid, {
+                    field: value,
+                }, idempotent=True)
+        elif fields:
+            self.api_put(review_request['links']['draft']['href'], fields)
 
     def get_review_request(self, rid):
         """
@@ -481,22 +489,105 @@ class ReviewBoardServer(object):
 
         return rsp['review_request']
 
-    def get_repositories(self):
+    def get_repositories(self, tool=None):
+        """
+        Returns the list of repositories on this server. If tool is given,
+        only repositories using that tool are returned.
+        """
+        index = self.get_repository_index()
+
+        if tool:
+            return index.get_by_tool(tool)
+
+        return index.repositories
+
+    def find_repository(self, paths):
+        """
+        Returns the repository on the server whose path or mirror path is
+        one of the given paths (a single path or a list), or None.
+
+        If there's no match in a cached index, it's refreshed from the
+        server in case the repository was added since.
         """
-        Returns the list of repositories on this server.
+        index = self.get_repository_index()
+        repository = index.find_by_path(paths)
+
+        if repository is None and index.from_cache:
+            debug("No repository matching %s in the cached index. "
+                  "Refreshing it." % (paths,))
+            repository = self.get_repository_index(True).find_by_path(paths)
+
+        return repository
+
+    def get_repository_index(self, refresh=False):
+        """
+        Returns a RepositoryIndex of the repositories on this server.
+
+        The index is kept for the rest of the run, and in the repository
+        cache for later runs. Passing refresh=True fetches it again.
+        """
+        if self._repository_index and not refresh:
+            return self._repository_index
+
+        if self.repository_cache and not refresh:
+            repositories = self.repository_cache.get(self.url)
+
+            if repositories is not None:
+                debug("Using %d cached repositories" % len(repositories))
+                self._repository_index = \
+                    RepositoryIndex(repositories, from_cache=True)
+
+                return self._repository_index
+
+        repositories = self._fetch_repositories()
+        self._repository_index = RepositoryIndex(repositories)
+
+        if self.repository_cache:
+            self.repository_cache.set(self.url, repositories)
+
+        return self._repository_index
+
+    def _fetch_repositories(self):
+        """
+        Fetches the full list of repositories from the server.
+
+        With the new API, the first page says how many repositories there
+        are, and the remaining pages are then fetched in parallel.
         """
         if self.deprecated_api:
             rsp = self.api_get('api/json/repositories/')
-            repositories = rsp['repositories']
-        else:
-            rsp = self.api_get(
-                self.root_resource['links']['repositories']['href'])
-            repositories = rsp['repositories']
+            return rsp['repositories']
+
+        href = self.root_resource['links']['repositories']['href']
+        page_size = self.REPOSITORY_PAGE_SIZE
+
+        def get_page(start):
+            return self.api_get('%s?start=%d&max-results=%d' %
+                                (href, start, page_size))
+
+        # The first page is fetched on its own, so that any login prompt
+        # happens before we start making requests in parallel.
+        rsp = get_page(0)
+        repositories = rsp['repositories']
+
+        # The server may cap the page size below what we asked for.
+        step = len(repositories)
 
+        if 'total_results' in rsp and step:
+            from rbtools.utils.parallel import parallel_map
+
+            starts = range(step, rsp['total_results'], step)
+
+            for page in parallel_map(get_page, starts,
+                                     self.MAX_PARALLEL_REQUESTS):
+                repositories.extend(page['repositories'])
+        else:
             while 'next' in rsp['links']:
                 rsp = self.api_get(rsp['links']['next']['href'])
                 repositories.extend(rsp['repositories'])
 
+        debug("Fetched %d repositories" % len(repositories))
+
         return repositories
 
     def get_repository_info(self, rid):
@@ -533,10 +624,11 @@ class ReviewBoardServer(object):
         """
         Uploads a diff to a Review Board server.
         """
-        debug("Uploading diff, size: %d" % len(diff_content))
+        debug("Uploading diff, size: %d" % get_diff_size(diff_content))
 
         if parent_diff_content:
-            debug("Uploading parent diff, size: %d" % len(parent_diff_content))
+            debug("Uploading parent diff, size: %d" %
+                  get_diff_size(parent_diff_content))
 
         fields = {}
         files = {}
@@ -544,23 +636,59 @@ class ReviewBoardServer(object):
         if self.info.base_path:
             fields['basedir'] = self.info.base_path
 
-        files['path'] = {
-            'filename': 'diff',
-            'content': diff_content
-        }
+        files['path'] = self._make_diff_file('diff', diff_content)
 
         if parent_diff_content:
-            files['parent_diff_path'] = {
-                'filename': 'parent_diff',
-                'content': parent_diff_content
+            files['parent_diff_path'] = \
+                self._make_diff_file('parent_diff', parent_diff_content)
+
+        try:
+            if self.deprecated_api:
+                self.api_post('api/json/reviewrequests/%s/diff/new/' %
+                              review_request['id'], fields, files)
+            else:
+                self.api_post(review_request['links']['diffs']['href'],
+                              fields, files)
+        except APIError, e:
+            if e.error_code == 207 and self._forget_server_info():
+                # The base path came from a cached repository lookup, and
+                # may be stale.
+                debug("File not found in the repository. Looking up the "
+                      "repository again...")
+                self.upload_diff(review_request, diff_content,
+                                 parent_diff_content)
+            else:
+                raise
+
+    def _make_diff_file(self, filename, content):
+        """
+        Returns the multipart file entry for a diff, compressing it with
+        gzip if the server accepts compressed diffs.
+
+        The diff may be a string or a file object, which is read from the
+        start, so that the same diff can be uploaded again.
+        """
+        if not isinstance(content, basestring):
+            content.seek(0)
+
+        if self.compress_diffs:
+            from rbtools.api.multipart import gzip_content
+
+            size = get_diff_size(content)
+            content = gzip_content(content)
+            debug("Compressed %s from %d to %d bytes" %
+                  (filename, size, len(content)))
+
+            return {
+                'filename': filename + '.gz',
+                'content': content,
+                'content_type': 'application/x-gzip',
             }
 
-        if self.deprecated_api:
-            self.api_post('api/json/reviewrequests/%s/diff/new/' %
-                          review_request['id'], fields, files)
-        else:
-            self.api_post(review_request['links']['diffs']['href'],
-                          fields, files)
+        return {
+            'filename': filename,
+            'content': content,
+        }
 
     def reopen(self, review_request):
         """
@@ -646,6 +774,18 @@ class ReviewBoardServer(object):
 
     info = property(_get_server_info)
 
+    def _forget_server_info(self):
+        """
+        Forgets the server's repository info if it came from a cache, so
+        that it's looked up again. Returns True if it was forgotten.
+        """
+        if (self._server_info and
+            self._info.forget_server_repository_info(self)):
+            self._server_info = None
+            return True
+
+        return False
+
     def process_json(self, data):
         """
         Loads in a JSON file and returns the data if successful. On failure,
@@ -679,19 +819,91 @@ class ReviewBoardServer(object):
 
     def http_get(self, path):
         """
-        Performs an HTTP GET on the specified path, storing any cookies that
-        were set.
+        Performs an HTTP GET on the specified path. Any cookies that were
+        set are saved when the server is closed.
         """
+        import urllib2
+
         debug('HTTP GETting %s' % path)
 
         url = self._make_url(path)
-        rsp = urllib2.urlopen(url).read()
+
+        if not self.http_cache:
+            return self._open_url(urllib2.Request(url)).read()
+
+        # Ask the server to only send the resource if it's changed since we
+        # last fetched it.
+        credentials = self._get_credentials_key()
+        cached = self.http_cache.get(url, credentials)
+        request = urllib2.Request(url)
+
+        if cached:
+            self.http_cache.add_conditional_headers(request, cached)
 
         try:
-            self.cookie_jar.save(self.cookie_file)
-        except IOError, e:
-            debug('Failed to write cookie file: %s' % e)
-        return rsp
+            rsp = self._open_url(request)
+        except urllib2.HTTPError, e:
+            if e.code == 304 and cached:
+                debug('%s is not modified. Using the cached copy.' % url)
+                return self.http_cache.hit(url, credentials, cached)
+
+            raise
+
+        data = rsp.read()
+        self.http_cache.store(url, credentials, rsp.info(), data)
+
+        return data
+
+    def _open_url(self, request, idempotent=True):
+        """
+        Opens a request, retrying it if it fails in a way the retry policy
+        considers temporary. idempotent says whether the request can safely
+        be sent more than once.
+        """
+        import urllib2
+
+        # Tells the connection handler whether it can send the request
+        # again on a new connection.
+        request.idempotent = idempotent
+        attempt = 0
+
+        while True:
+            try:
+                rsp = urllib2.urlopen(request)
+                self.retry_policy.succeeded(attempt)
+
+                return rsp
+            except urllib2.URLError, e:
+                delay = self.retry_policy.get_retry_delay(e, attempt,
+                                                          idempotent)
+
+                if delay is None:
+                    raise
+
+                debug('%s %s failed (%s). Retrying in %.1f seconds.' %
+                      (request.get_method(), request.get_full_url(), e,
+                       delay))
+                time.sleep(delay)
+                attempt += 1
+
+    def _get_credentials_key(self):
+        """
+        Returns a key identifying who requests are being made as, for use
+        with the HTTP cache. The credentials themselves are hashed.
+        """
+        try:
+            from hashlib import md5
+        except ImportError:
+            from md5 import md5
+
+        session = ''
+
+        for cookie in self.cookie_jar:
+            if cookie.name == 'rbsessionid':
+                session = cookie.value
+
+        return md5('%s\0%s\0%s' % (options.username, options.http_username,
+                                    session)).hexdigest()
 
     def _make_url(self, path):
         """Given a path on the server returns a full http:// style url"""
@@ -714,16 +926,18 @@ class ReviewBoardServer(object):
         """
         Performs an API call using HTTP GET at the specified path.
         """
-        try:
-            return self.process_json(self.http_get(path))
-        except urllib2.HTTPError, e:
-            self.process_error(e.code, e.read())
+        return self._call_api(self.http_get, path)
 
-    def http_post(self, path, fields, files=None):
+    def http_post(self, path, fields, files=None, idempotent=False):
         """
-        Performs an HTTP POST on the specified path, storing any cookies that
-        were set.
+        Performs an HTTP POST on the specified path. Any cookies that were
+        set are saved when the server is closed.
+
+        If idempotent is True, the POST is retried on any temporary failure,
+        rather than only when it can't have reached the server.
         """
+        import urllib2
+
         if fields:
             debug_fields = fields.copy()
         else:
@@ -742,12 +956,7 @@ class ReviewBoardServer(object):
 
         try:
             r = urllib2.Request(str(url), body, headers)
-            data = urllib2.urlopen(r).read()
-            try:
-                self.cookie_jar.save(self.cookie_file)
-            except IOError, e:
-                debug('Failed to write cookie file: %s' % e)
-            return data
+            return self._open_url(r, idempotent).read()
         except urllib2.HTTPError, e:
             # Re-raise so callers can interpret it.
             raise e
@@ -762,9 +971,12 @@ class ReviewBoardServer(object):
 
     def http_put(self, path, fields):
         """
-        Performs an HTTP PUT on the specified path, storing any cookies that
-        were set.
+        Performs an HTTP PUT on the specified path. Any cookies that were
+        set are saved when the server is closed.
         """
+        import urllib2
+        from rbtools.api.handlers import HTTPRequest
+
         url = self._make_url(path)
         debug('HTTP PUTting to %s: %s' % (url, fields))
 
@@ -776,12 +988,7 @@ class ReviewBoardServer(object):
 
         try:
             r = HTTPRequest(str(url), body, headers, method='PUT')
-            data = urllib2.urlopen(r).read()
-            try:
-                self.cookie_jar.save(self.cookie_file)
-            except IOError, e:
-                debug('Failed to write cookie file: %s' % e)
-            return data
+            return self._open_url(r).read()
         except urllib2.HTTPError, e:
             # Re-raise so callers can interpret it.
             raise e
@@ -796,20 +1003,18 @@ class ReviewBoardServer(object):
 
     def http_delete(self, path):
         """
-        Performs an HTTP DELETE on the specified path, storing any cookies that
-        were set.
+        Performs an HTTP DELETE on the specified path. Any cookies that were
+        set are saved when the server is closed.
         """
+        import urllib2
+        from rbtools.api.handlers import HTTPRequest
+
         url = self._make_url(path)
         debug('HTTP DELETing %s' % url)
 
         try:
             r = HTTPRequest(url, method='DELETE')
-            data = urllib2.urlopen(r).read()
-            try:
-                self.cookie_jar.save(self.cookie_file)
-            except IOError, e:
-                debug('Failed to write cookie file: %s' % e)
-            return data
+            return self._open_url(r).read()
         except urllib2.HTTPError, e:
             # Re-raise so callers can interpret it.
             raise e
@@ -822,64 +1027,103 @@ class ReviewBoardServer(object):
             die("Unable to access %s. The host path may be invalid\n%s" % \
                 (url, e))
 
-    def api_post(self, path, fields=None, files=None):
+    def api_post(self, path, fields=None, files=None, idempotent=False):
         """
         Performs an API call using HTTP POST at the specified path.
         """
-        try:
-            return self.process_json(self.http_post(path, fields, files))
-        except urllib2.HTTPError, e:
-            self.process_error(e.code, e.read())
+        return self._call_api(self.http_post, path, fields, files,
+                              idempotent)
 
     def api_put(self, path, fields=None):
         """
         Performs an API call using HTTP PUT at the specified path.
         """
-        try:
-            return self.process_json(self.http_put(path, fields))
-        except urllib2.HTTPError, e:
-            self.process_error(e.code, e.read())
+        return self._call_api(self.http_put, path, fields)
 
     def api_delete(self, path):
         """
         Performs an API call using HTTP DELETE at the specified path.
         """
+        return self._call_api(self.http_delete, path)
+
+    def _call_api(self, http_method, path, *args):
+        """
+        Performs an API call with one of the http_* methods, processing
+        the response.
+
+        If the server returns a 404 while we're using a cached root
+        resource, the server may have been upgraded or moved since it was
+        cached, so its links may no longer be valid. The root resource is
+        then fetched again, and the request retried once against it.
+        """
+        import urllib2
+
         try:
-            return self.process_json(self.http_delete(path))
+            return self.process_json(http_method(path, *args))
         except urllib2.HTTPError, e:
-            self.process_error(e.code, e.read())
+            http_status = e.code
+            data = e.read()
 
-    def _encode_multipart_formdata(self, fields, files):
+        if http_status == 404 and self.using_cached_api:
+            path = self._refresh_api(path)
+
+            if path:
+                debug('Retrying the request with %s' % path)
+
+                try:
+                    return self.process_json(http_method(path, *args))
+                except urllib2.HTTPError, e:
+                    http_status = e.code
+                    data = e.read()
+
+        self.process_error(http_status, data)
+
+    def _refresh_api(self, path):
         """
-        Encodes data for use in an HTTP POST.
+        Drops the cached root resource and fetches it again.
+
+        Returns the path to retry a failed request with, moved to where the
+        new root resource's links point, or None if it can't be retried.
         """
-        BOUNDARY = mimetools.choose_boundary()
-        content = ""
+        debug('Got HTTP 404 using the cached API root resource. '
+              'Fetching it again.')
+        old_root_resource = self.root_resource
+        self.api_cache.remove(self.url)
+        self.using_cached_api = False
+        self.root_resource = None
+        self.check_api_version()
 
-        fields = fields or {}
-        files = files or {}
+        if self.deprecated_api or not self.root_resource:
+            return None
 
-        for key in fields:
-            content += "--" + BOUNDARY + "\r\n"
-            content += "Content-Disposition: form-data; name=\"%s\"\r\n" % key
-            content += "\r\n"
-            content += str(fields[key]) + "\r\n"
+        url = self._make_url(path)
+        new_links = self.root_resource['links']
+        best_href = ''
+        new_url = path
 
-        for key in files:
-            filename = files[key]['filename']
-            value = files[key]['content']
-            content += "--" + BOUNDARY + "\r\n"
-            content += "Content-Disposition: form-data; name=\"%s\"; " % key
-            content += "filename=\"%s\"\r\n" % filename
-            content += "\r\n"
-            content += value + "\r\n"
+        for name, link in old_root_resource['links'].iteritems():
+            href = self._make_url(link['href'])
 
-        content += "--" + BOUNDARY + "--\r\n"
-        content += "\r\n"
+            if (name in new_links and url.startswith(href) and
+                len(href) > len(best_href)):
+                best_href = href
+                new_url = (self._make_url(new_links[name]['href']) +
+                           url[len(href):])
 
-        content_type = "multipart/form-data; boundary=%s" % BOUNDARY
+        return new_url
 
-        return content_type, content
+    def _encode_multipart_formdata(self, fields, files):
+        """
+        Encodes data for use in an HTTP POST.
+
+        The body is returned as a MultipartBody, which streams the file
+        contents in chunks instead of copying them into one large string.
+        """
+        from rbtools.api.multipart import MultipartBody
+
+        body = MultipartBody(fields, files)
+
+        return body.content_type, body
 
 
 def debug(s):
@@ -889,6 +1133,49 @@ def debug(s):
     if options and options.debug:
         print ">>> %s" % s
 
+
+def parse_version(version):
+    """
+    Parses a version string into something that can be compared.
+
+    pkg_resources is slow to import, so it's only loaded the first time a
+    version needs to be compared, rather than on every run.
+    """
+    from pkg_resources import parse_version
+
+    return parse_version(version)
+
+
+def accepts_compressed_diffs(server_url):
+    """
+    Returns whether the server at server_url is listed in
+    COMPRESS_DIFFS_SERVERS as accepting gzipped diff uploads.
+    """
+    for url in get_config_value(configs, 'COMPRESS_DIFFS_SERVERS', []):
+        if not url.endswith('/'):
+            url += '/'
+
+        if url == server_url:
+            return True
+
+    return False
+
+
+def report_timings():
+    """
+    Prints the timings of the commands that were run, and writes them to
+    the file given with --timings-file.
+    """
+    if options.timings:
+        sys.stderr.write(timings.get_report() + '\n')
+
+    if options.timings_file:
+        try:
+            timings.write_json(options.timings_file)
+        except IOError, e:
+            sys.stderr.write('Unable to write timings to %s: %s\n' %
+                             (options.timings_file, e))
+
 def comment_or_close(server):
     """
     Add a comment and/or close as submitted
@@ -920,59 +1207,68 @@ def comment_or_close(server):
     return review_url
 
 
+def open_review_request(server, changenum, submit_as=None):
+    """
+    Returns the review request being updated, or creates a new one.
+    """
+    if options.rid:
+        review_request = server.get_review_request(options.rid)
+        status = review_request['status']
+
+        if status == 'submitted':
+            die("Review request %s is marked as %s. In order to "
+                "update it, please reopen the request using the web "
+                "interface and try again." % (options.rid, status))
+    else:
+        review_request = server.new_review_request(changenum, submit_as)
+
+    return review_request
+
+
 def tempt_fate(server, tool, changenum, diff_content=None,
-               parent_diff_content=None, submit_as=None, retries=3):
+               parent_diff_content=None, submit_as=None, retries=3,
+               review_request=None):
     """
     Attempts to create a review request on a Review Board server and upload
     a diff. On success, the review request path is displayed.
+
+    If review_request is provided, it's updated instead of opening one.
     """
     try:
-        if options.rid:
-            review_request = server.get_review_request(options.rid)
-            status = review_request['status']
+        if review_request is None:
+            review_request = open_review_request(server, changenum, submit_as)
 
-            if status == 'submitted':
-                die("Review request %s is marked as %s. In order to "
-                    "update it, please reopen the request using the web "
-                    "interface and try again." % (options.rid, status))
-        else:
-            review_request = server.new_review_request(changenum, submit_as)
+        fields = {}
 
         if options.target_groups:
-            server.set_review_request_field(review_request, 'target_groups',
-                                            options.target_groups)
+            fields['target_groups'] = options.target_groups
 
         if options.target_people:
-            server.set_review_request_field(review_request, 'target_people',
-                                            options.target_people)
+            fields['target_people'] = options.target_people
 
         if options.summary:
-            server.set_review_request_field(review_request, 'summary',
-                                            options.summary)
+            fields['summary'] = options.summary
 
         if options.branch:
-            server.set_review_request_field(review_request, 'branch',
-                                            options.branch)
+            fields['branch'] = options.branch
 
         if options.bugs_closed:     # append to existing list
             options.bugs_closed = options.bugs_closed.strip(", ")
             bug_set = set(re.split("[, ]+", options.bugs_closed)) | \
                       set(review_request['bugs_closed'])
             options.bugs_closed = ",".join(bug_set)
-            server.set_review_request_field(review_request, 'bugs_closed',
-                                            options.bugs_closed)
+            fields['bugs_closed'] = options.bugs_closed
 
         if options.description:
-            server.set_review_request_field(review_request, 'description',
-                                            options.description)
+            fields['description'] = options.description
 
         if options.testing_done:
-            server.set_review_request_field(review_request, 'testing_done',
-                                            options.testing_done)
+            fields['testing_done'] = options.testing_done
 
         if options.change_description:
-            server.set_review_request_field(review_request, 'changedescription',
-                                            options.change_description)
+            fields['changedescription'] = options.change_description
+
+        server.set_review_request_fields(review_request, fields)
     except APIError, e:
         if e.error_code == 103: # Not logged in
             retries = retries - 1
@@ -986,7 +1282,8 @@ def tempt_fate(server, tool, changenum, diff_content=None,
                 server.login(force=True)
                 return tempt_fate(server, tool, changenum, diff_content,
                                   parent_diff_content, submit_as,
-                                  retries=retries)
+                                  retries=retries,
+                                  review_request=review_request)
 
         if options.rid:
             die("Error getting review request %s: %s" % (options.rid, e))
@@ -1036,6 +1333,96 @@ def tempt_fate(server, tool, changenum, diff_content=None,
     return review_url
 
 
+def generate_diff(tool, args, repository_info, origcwd):
+    """
+    Generates the diff and parent diff to post, based on the options.
+
+    Both are None if the command doesn't post a diff.
+    """
+    if options.comment or options.close_submitted:
+        return None, None
+    elif options.revision_range:
+        diff, parent_diff = tool.diff_between_revisions(options.revision_range, args,
+                                                        repository_info)
+    elif options.svn_changelist:
+        diff, parent_diff = tool.diff_changelist(options.svn_changelist)
+    elif options.diff_filename:
+        parent_diff = None
+
+        if options.diff_filename == '-':
+            diff = sys.stdin.read()
+        else:
+            try:
+                fp = open(os.path.join(origcwd, options.diff_filename), 'r')
+                diff = fp.read()
+                fp.close()
+            except IOError, e:
+                die("Unable to open diff filename: %s" % e)
+    else:
+        diff, parent_diff = tool.diff(args)
+
+    if get_diff_size(diff) == 0:
+        die("There don't seem to be any diffs!")
+
+    return diff, parent_diff
+
+
+def get_diff_size(diff):
+    """
+    Returns the size of a diff in bytes. Diffs are usually strings, but may
+    be file objects for clients that spool large diffs, which are left at
+    the same position.
+    """
+    if isinstance(diff, basestring):
+        return len(diff)
+
+    pos = diff.tell()
+    diff.seek(0, 2)
+    size = diff.tell()
+    diff.seek(pos)
+
+    return size
+
+
+def start_diff(tool, args, repository_info, origcwd):
+    """
+    Starts generating the diff in the background, as generate_diff() does,
+    and returns the BackgroundCall to join for the result.
+    """
+    from rbtools.utils.parallel import BackgroundCall
+
+    debug('Generating the diff in the background')
+
+    return BackgroundCall(generate_diff, tool, args, repository_info,
+                          origcwd)
+
+
+def sanitize_changenum(server, tool, changenum):
+    """
+    Returns the changenum to send to the server, for the clients that need
+    it changed. This must be called after the server's API version has been
+    checked.
+    """
+    if changenum is None:
+        return None
+
+    from rbtools.clients.perforce import PerforceClient
+    from rbtools.clients.plastic import PlasticClient
+
+    if isinstance(tool, PerforceClient) or isinstance(tool, PlasticClient):
+        changenum = tool.sanitize_changenum(changenum)
+
+        # NOTE: In Review Board 1.5.2 through 1.5.3.1, the changenum support
+        #       is broken, so we have to force the deprecated API.
+        if (parse_version(server.rb_version) >= parse_version('1.5.2') and
+            parse_version(server.rb_version) <= parse_version('1.5.3.1')):
+            debug('Using changenums on Review Board %s, which is broken. '
+                  'Falling back to the deprecated 1.0 API' % server.rb_version)
+            server.deprecated_api = True
+
+    return changenum
+
+
 def parse_options(args):
     parser = OptionParser(usage="%prog [-pond] [-r review_id] [changenum]",
                           version="RBTools " + get_version_string())
@@ -1069,6 +1456,41 @@ def parse_options(args):
                                                    True),
                       help="prevents requests from going through a proxy "
                            "server")
+    parser.add_option("--compress-diffs",
+                      action='store_true',
+                      dest='compress_diffs',
+                      default=False,
+                      help="gzip diffs before uploading them (the server "
+                           "must support compressed diff uploads). To do "
+                           "this for every upload to a server, list its URL "
+                           "in COMPRESS_DIFFS_SERVERS in .reviewboardrc")
+    parser.add_option("--disable-cache",
+                      action='store_true',
+                      dest='disable_cache',
+                      default=get_config_value(configs, 'DISABLE_CACHE',
+                                               False),
+                      help="don't use or update the local cache of "
+                           "information from the Review Board server")
+    parser.add_option("--http-retries",
+                      type='int',
+                      dest='http_retries',
+                      default=get_config_value(configs, 'HTTP_RETRIES', 3),
+                      metavar="COUNT",
+                      help="number of times to retry a request when the "
+                           "server is temporarily unavailable")
+    parser.add_option("--command-timeout",
+                      type='int',
+                      dest='command_timeout',
+                      default=get_config_value(configs, 'COMMAND_TIMEOUT'),
+                      metavar="SECONDS",
+                      help="kill any source control command that runs for "
+                           "longer than this")
+    parser.add_option("--pipeline",
+                      action='store_true',
+                      dest='pipeline',
+                      default=get_config_value(configs, 'PIPELINE', False),
+                      help="generate the diff while logging in and creating "
+                           "the review request, rather than before")
     parser.add_option("--diff-only",
                       dest="diff_only", action="store_true", default=False,
                       help="uploads a new diff, but does not update "
@@ -1186,6 +1608,13 @@ def parse_options(args):
     parser.add_option('--svn-changelist', dest='svn_changelist', default=None,
                       help='generate the diff for review based on a local SVN '
                            'changelist')
+    parser.add_option("--svn-diff-workers",
+                      type='int',
+                      dest='svn_diff_workers',
+                      default=get_config_value(configs, 'SVN_DIFF_WORKERS', 1),
+                      metavar="COUNT",
+                      help="number of svn diff processes to split the diff "
+                           "of a large working copy between")
     parser.add_option("--repository-url",
                       dest="repository_url",
                       default=get_config_value(configs, 'REPOSITORY'),
@@ -1201,6 +1630,16 @@ def parse_options(args):
                       action="store_true", dest="debug",
                       default=get_config_value(configs, 'DEBUG', False),
                       help="display debug output")
+    parser.add_option("--timings",
+                      action="store_true", dest="timings",
+                      default=get_config_value(configs, 'TIMINGS', False),
+                      help="display how long the source control commands "
+                           "that were run took, on exit")
+    parser.add_option("--timings-file",
+                      dest="timings_file", default=None,
+                      metavar="FILENAME",
+                      help="write the command timings to a JSON file, "
+                           "on exit")
     parser.add_option("--diff-filename",
                       dest="diff_filename", default=None,
                       help='upload an existing diff file, instead of '
@@ -1283,12 +1722,7 @@ def parse_options(args):
 def main():
     origcwd = os.path.abspath(os.getcwd())
 
-    if 'APPDATA' in os.environ:
-        homepath = os.environ['APPDATA']
-    elif 'HOME' in os.environ:
-        homepath = os.environ["HOME"]
-    else:
-        homepath = ''
+    homepath = get_home_path()
 
     # If we end up creating a cookie file, make sure it's only readable by the
     # user.
@@ -1303,6 +1737,22 @@ def main():
     debug('RBTools %s' % get_version_string())
     debug('Home = %s' % homepath)
 
+    for filename, how in config_loader.loaded:
+        debug('Loaded config file %s (%s)' % (filename, how))
+
+    if options.command_timeout:
+        set_default_timeout(options.command_timeout)
+
+    if options.timings or options.timings_file:
+        atexit.register(report_timings)
+
+    if options.disable_cache:
+        set_caches_persistent(False)
+
+    # This is registered before the server's close(), so that it runs after
+    # it.
+    atexit.register(save_caches)
+
     repository_info, tool = scan_usable_client(options)
     tool.user_config = user_config
     tool.configs = configs
@@ -1320,11 +1770,12 @@ def main():
         print "Unable to find a Review Board server for this source code tree."
         sys.exit(1)
 
-    server = ReviewBoardServer(server_url, repository_info, cookie_file)
+    server = ReviewBoardServer(server_url, repository_info, cookie_file,
+                               use_cache=not options.disable_cache)
+    server.compress_diffs = (options.compress_diffs or
+                             accepts_compressed_diffs(server.url))
 
-    # Handle the case where /api/ requires authorization (RBCommons).
-    if not server.check_api_version():
-        die("Unable to log in with the supplied username and password.")
+    atexit.register(server.close)
 
     if options.close_submitted and (options.description or options.description_file\
          or options.publish or options.output_diff_only or options.diff_only \
@@ -1342,65 +1793,91 @@ def main():
                          "existing Review Requests.\n")
         sys.exit(1)
 
+    # In pipelined mode, the diff is generated in the background while we
+    # log in and open the review request, and is only waited on once it's
+    # needed for the upload. A diff read from stdin isn't pipelined, as we
+    # may need stdin to prompt for a login.
+    pipeline = (options.pipeline and
+                not (options.comment or options.close_submitted or
+                     options.output_diff_only) and
+                options.diff_filename != '-')
+
     if repository_info.supports_changesets:
         changenum = tool.get_changenum(args)
     else:
         changenum = None
 
-    if options.comment or options.close_submitted:
-        diff, parent_diff = None, None
-    elif options.revision_range:
-        diff, parent_diff = tool.diff_between_revisions(options.revision_range, args,
-                                                        repository_info)
-    elif options.svn_changelist:
-        diff, parent_diff = tool.diff_changelist(options.svn_changelist)
-    elif options.diff_filename:
-        parent_diff = None
+    diff_call = None
 
-        if options.diff_filename == '-':
-            diff = sys.stdin.read()
-        else:
-            try:
-                fp = open(os.path.join(origcwd, options.diff_filename), 'r')
-                diff = fp.read()
-                fp.close()
-            except IOError, e:
-                die("Unable to open diff filename: %s" % e)
-    else:
-        diff, parent_diff = tool.diff(args)
+    if pipeline and changenum is None:
+        # Without a changenum, nothing else uses the SCM client, so the
+        # diff can be started before we even check the server's version.
+        diff_call = start_diff(tool, args, repository_info, origcwd)
 
-    # If using flags that do not require diffs (e.g. post a comment, set closed:submitted/discarded)
-    # Diff may well be none
-    if not (options.comment or options.close_submitted):
-        if len(diff) == 0:
-            die("There don't seem to be any diffs!")
+    # Handle the case where /api/ requires authorization (RBCommons).
+    if not server.check_api_version():
+        die("Unable to log in with the supplied username and password.")
 
-    if (isinstance(tool, PerforceClient) or
-        isinstance(tool, PlasticClient)) and changenum is not None:
-        changenum = tool.sanitize_changenum(changenum)
+    if pipeline:
+        if diff_call is None:
+            # Everything else that uses the SCM client is done before the
+            # diff is started, so that the client is only used by one
+            # thread at a time, and its prompts can't collide with the
+            # login prompt. Sanitizing the changenum needs the server's
+            # version.
+            changenum = sanitize_changenum(server, tool, changenum)
+            diff_call = start_diff(tool, args, repository_info, origcwd)
 
-        # NOTE: In Review Board 1.5.2 through 1.5.3.1, the changenum support
-        #       is broken, so we have to force the deprecated API.
-        if (parse_version(server.rb_version) >= parse_version('1.5.2') and
-            parse_version(server.rb_version) <= parse_version('1.5.3.1')):
-            debug('Using changenums on Review Board %s, which is broken. '
-                  'Falling back to the deprecated 1.0 API' % server.rb_version)
-            server.deprecated_api = True
+        server.login()
+
+        try:
+            review_request = open_review_request(server, changenum,
+                                                 options.submit_as)
+        except APIError, e:
+            # tempt_fate() will try again, and report the error if it fails.
+            debug('Unable to open the review request yet: %s' % e)
+            review_request = None
+
+        try:
+            diff, parent_diff = diff_call.join()
+        except SystemExit:
+            if (review_request and not options.rid and changenum is None and
+                not server.deprecated_api):
+                # There's no diff to post, so don't leave behind the empty
+                # review request that was created for it.
+                debug('Discarding review request #%s' % review_request['id'])
+
+                try:
+                    server.discard(review_request)
+                except APIError, e:
+                    debug('Unable to discard the review request: %s' % e)
+
+            raise
+    else:
+        diff, parent_diff = generate_diff(tool, args, repository_info,
+                                          origcwd)
+        changenum = sanitize_changenum(server, tool, changenum)
+        review_request = None
+
+        if options.output_diff_only:
+            if not isinstance(diff, basestring):
+                diff = diff.read()
 
-    if options.output_diff_only:
-        # The comma here isn't a typo, but rather suppresses the extra newline
-        print diff,
-        sys.exit(0)
+            # The comma here isn't a typo, but rather suppresses the extra
+            # newline
+            print diff,
+            sys.exit(0)
 
-    # Let's begin.
-    server.login()
+        # Let's begin.
+        server.login()
 
     if options.comment or options.close_submitted:
         review_url = comment_or_close(server)
     else:
         review_url = tempt_fate(server, tool, changenum, diff_content=diff,
                                 parent_diff_content=parent_diff,
-                                submit_as=options.submit_as)
+                                submit_as=options.submit_as,
+                                review_request=review_request)
 
     # Load the review up in the browser if requested to:
     if options.open_browser:
@@ -1,5 +1,20 @@
+import atexit
+import cookielib
+import errno
+import gzip
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 import urllib2
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from httplib import HTTPMessage
 
 try:
     from cStringIO import StringIO
@@ -12,9 +27,17 @@ except ImportError:
     import simplejson as json
 
 from rbtools import postreview
+from rbtools.api.connection import ConnectionPool, KeepAliveHTTPHandler, \
+                                  decode_content
+from rbtools.api.cookies import PersistentCookieJar
 from rbtools.api.errors import APIError
-from rbtools.clients import RepositoryInfo
+from rbtools.api.httpcache import HTTPCache
+from rbtools.api.multipart import MultipartBody, gzip_content
+from rbtools.api.retry import RetryPolicy
+from rbtools.clients import RepositoryInfo, SCMClient
 from rbtools.postreview import ReviewBoardServer
+from rbtools.utils.cache import Cache, save_caches
+from rbtools.utils.testbase import RBTestBase
 
 
 class MockHttpUnitTest(unittest.TestCase):
@@ -26,20 +49,26 @@ class MockHttpUnitTest(unittest.TestCase):
 
         self.saved_http_get = ReviewBoardServer.http_get
         self.saved_http_post = ReviewBoardServer.http_post
+        self.saved_http_put = ReviewBoardServer.http_put
 
         self.server = ReviewBoardServer('http://localhost:8080/',
                                         RepositoryInfo(), None)
         ReviewBoardServer.http_get = self._http_method
         ReviewBoardServer.http_post = self._http_method
+        ReviewBoardServer.http_put = self._http_method
 
         self.server.deprecated_api = self.deprecated_api
         self.http_response = {}
+        self.http_requests = []
 
     def tearDown(self):
         ReviewBoardServer.http_get = self.saved_http_get
         ReviewBoardServer.http_post = self.saved_http_post
+        ReviewBoardServer.http_put = self.saved_http_put
 
     def _http_method(self, path, *args, **kwargs):
+        self.http_requests.append((path, args))
+
         if isinstance(self.http_response, dict):
             http_response = self.http_response[path]
         else:
@@ -50,6 +79,9 @@ class MockHttpUnitTest(unittest.TestCase):
         else:
             return http_response
 
+    def _make_http_error(self, url, code, body):
+        return urllib2.HTTPError(url, code, body, {}, StringIO(body))
+
 
 class OptionsStub(object):
     def __init__(self):
@@ -59,8 +91,13 @@ class OptionsStub(object):
         self.tracking = None
         self.username = None
         self.password = None
+        self.http_username = None
+        self.http_password = None
         self.repository_url = None
         self.disable_proxy = False
+        self.compress_diffs = False
+        self.http_retries = 3
+        self.svn_diff_workers = 1
 
 
 class ApiTests(MockHttpUnitTest):
@@ -104,6 +141,223 @@ class ApiTests(MockHttpUnitTest):
         self.server.check_api_version()
         self.assertTrue(self.server.deprecated_api)
 
+    def test_check_api_version_cached(self):
+        """Testing checking the API version using the cache"""
+        old_home = os.environ.get('HOME')
+        os.environ['HOME'] = tempfile.mkdtemp()
+
+        try:
+            self.server.api_cache = Cache('api')
+            self.http_response.update(self._build_info_resource('1.6'))
+            self.server.check_api_version()
+            self.assertEqual(len(self.http_requests), 2)
+            save_caches()
+
+            server = ReviewBoardServer('http://localhost:8080/',
+                                       RepositoryInfo(), None,
+                                       use_cache=True)
+            self.assertTrue(server.check_api_version())
+            self.assertEqual(self.http_requests[2:], [('api/info/', ())])
+            self.assertFalse(server.deprecated_api)
+            self.assertEqual(server.rb_version, '1.6')
+            self.assertEqual(server.root_resource['links']['info']['href'],
+                             'api/info/')
+
+            # An upgraded server should invalidate the cached root resource.
+            self.http_response.update(self._build_info_resource('1.7'))
+            server = ReviewBoardServer('http://localhost:8080/',
+                                       RepositoryInfo(), None,
+                                       use_cache=True)
+            self.assertTrue(server.check_api_version())
+            self.assertEqual(len(self.http_requests), 6)
+            self.assertEqual(server.rb_version, '1.7')
+            self.assertEqual(server.api_cache.get(server.url)
+                             ['package_version'], '1.7')
+        finally:
+            shutil.rmtree(os.environ['HOME'])
+            os.environ['HOME'] = old_home
+
+    def test_cached_api_404_retry(self):
+        """Testing retrying a request after a 404 using the cached API"""
+        old_home = os.environ.get('HOME')
+        os.environ['HOME'] = tempfile.mkdtemp()
+
+        try:
+            self.server.api_cache = Cache('api')
+            self.server.api_cache.set(self.server.url, {
+                'package_version': '1.6',
+                'root_resource': {
+                    'links': {
+                        'info': {
+                            'href': 'api/info/',
+                        },
+                        'review_requests': {
+                            'href': 'api/review-requests/',
+                        },
+                    },
+                },
+            })
+            self.http_response.update(self._build_info_resource('1.6'))
+            self.http_response['api/'] = json.dumps({
+                'stat': 'ok',
+                'links': {
+                    'info': {
+                        'href': 'api/info/',
+                    },
+                    'review_requests': {
+                        'href': 'http://localhost:8080/api/rr/',
+                    },
+                },
+            })
+            self.assertTrue(self.server.check_api_version())
+            self.assertTrue(self.server.using_cached_api)
+
+            # A 404 should refetch the root resource and retry the request
+            # where the new root resource's links point.
+            error = json.dumps({
+                'stat': 'fail',
+                'err': {
+                    'code': 100,
+                    'msg': 'Object does not exist',
+                },
+            })
+            self.http_response['api/review-requests/1/'] = \
+                self._make_http_error('api/review-requests/1/', 404, error)
+            self.http_response['http://localhost:8080/api/rr/1/'] = \
+                json.dumps({'stat': 'ok'})
+            self.assertEqual(self.server.api_get('api/review-requests/1/'),
+                             {'stat': 'ok'})
+            self.assertEqual(
+                [path for path, args in self.http_requests], [
+                    'api/info/',
+                    'api/review-requests/1/',
+                    'api/',
+                    'api/info/',
+                    'http://localhost:8080/api/rr/1/',
+                ])
+            self.assertFalse(self.server.using_cached_api)
+
+            # Without the cached root resource, a 404 is just an error.
+            del self.http_requests[:]
+            self.assertRaises(APIError, self.server.api_get,
+                              'api/review-requests/1/')
+            self.assertEqual(len(self.http_requests), 1)
+        finally:
+            shutil.rmtree(os.environ['HOME'])
+            os.environ['HOME'] = old_home
+
+    def test_compress_diffs(self):
+        """Testing compressing diffs only for servers that accept them"""
+        self.assertEqual(self.server._make_diff_file('diff', 'data'), {
+            'filename': 'diff',
+            'content': 'data',
+        })
+
+        self.server.compress_diffs = True
+        diff_file = self.server._make_diff_file('diff', 'data')
+        self.assertEqual(diff_file['filename'], 'diff.gz')
+        self.assertEqual(diff_file['content_type'], 'application/x-gzip')
+
+        old_configs = postreview.configs
+        postreview.configs = [{
+            'COMPRESS_DIFFS_SERVERS': ['http://localhost:8080'],
+        }]
+
+        try:
+            self.assertTrue(postreview.accepts_compressed_diffs(
+                'http://localhost:8080/'))
+            self.assertFalse(postreview.accepts_compressed_diffs(
+                'http://reviews.example.com/'))
+        finally:
+            postreview.configs = old_configs
+
+    def test_diff_file_object(self):
+        """Testing uploading a diff from a file object"""
+        fp = tempfile.TemporaryFile()
+        fp.write('diff data')
+        self.assertEqual(postreview.get_diff_size(fp), 9)
+
+        # It's read from the start, even after an earlier upload.
+        diff_file = self.server._make_diff_file('diff', fp)
+        self.assertTrue(diff_file['content'] is fp)
+        self.assertEqual(fp.tell(), 0)
+
+        self.server.compress_diffs = True
+        fp.read()
+        diff_file = self.server._make_diff_file('diff', fp)
+        self.assertEqual(
+            gzip.GzipFile(fileobj=StringIO(diff_file['content'])).read(),
+            'diff data')
+        fp.close()
+
+    def test_get_repositories(self):
+        """Testing fetching pages of repositories in parallel"""
+        self.server.root_resource = {
+            'links': {
+                'repositories': {
+                    'href': 'api/repositories/',
+                },
+            },
+        }
+        self.server.REPOSITORY_PAGE_SIZE = 2
+        repositories = [
+            {'id': 1, 'path': '/svn/1', 'tool': 'Subversion'},
+            {'id': 2, 'path': '/git/2', 'mirror_path': 'git@host:2',
+             'tool': 'Git'},
+            {'id': 3, 'path': '/svn/3', 'tool': 'Subversion'},
+            {'id': 4, 'path': 'p4:1666', 'tool': 'Perforce'},
+            {'id': 5, 'path': '/svn/5', 'tool': 'Subversion'},
+        ]
+
+        for start in range(0, 5, 2):
+            self.http_response[
+                'api/repositories/?start=%d&max-results=2' % start] = \
+                json.dumps({
+                    'stat': 'ok',
+                    'total_results': 5,
+                    'repositories': repositories[start:start + 2],
+                    'links': {},
+                })
+
+        self.assertEqual(self.server.get_repositories(), repositories)
+        self.assertEqual(len(self.http_requests), 3)
+        self.assertEqual(
+            [r['id'] for r in self.server.get_repositories('Subversion')],
+            [1, 3, 5])
+        self.assertEqual(
+            self.server.find_repository(['unknown', 'git@host:2'])['id'], 2)
+        self.assertEqual(self.server.find_repository('p4:1666')['id'], 4)
+        self.assertEqual(self.server.find_repository('unknown'), None)
+
+        # The index is only built once.
+        self.assertEqual(len(self.http_requests), 3)
+
+    def test_set_review_request_fields(self):
+        """Testing setting review request fields in a single draft update"""
+        self.http_response = json.dumps({'stat': 'ok'})
+        review_request = {
+            'id': 1,
+            'links': {
+                'draft': {
+                    'href': 'api/review-requests/1/draft/',
+                },
+            },
+        }
+
+        self.server.set_review_request_fields(review_request, {
+            'summary': 'My summary',
+            'branch': 'trunk',
+            'testing_done': 'Ran the tests',
+        })
+
+        self.assertEqual(self.http_requests, [
+            ('api/review-requests/1/draft/', ({
+                'summary': 'My summary',
+                'branch': 'trunk',
+                'testing_done': 'Ran the tests',
+            },)),
+        ])
+
     def _build_info_resource(self, package_version):
         return {
             'api/info/': json.dumps({
@@ -190,5 +444,722 @@ class DeprecatedApiTests(MockHttpUnitTest):
             self.assertEqual(str(e),
                              'This is a test failure (HTTP 400, API Error 100)')
 
-    def _make_http_error(self, url, code, body):
-        return urllib2.HTTPError(url, code, body, {}, StringIO(body))
+    def test_set_review_request_fields(self):
+        """Testing setting review request fields with the 1.0 API"""
+        self.http_response = json.dumps({'stat': 'ok'})
+        self.server.set_review_request_fields({'id': 1}, {
+            'summary': 'My summary',
+            'branch': 'trunk',
+        })
+
+        self.assertEqual(len(self.http_requests), 2)
+
+        for path, args in self.http_requests:
+            self.assertEqual(path, 'api/json/reviewrequests/1/draft/set/')
+            self.assertEqual(len(args[0]), 1)
+
+
+class KeepAliveRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    dropped = 0
+
+    def do_GET(self):
+        etag = '"%s"' % self.path
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = json.dumps({
+            'stat': 'ok',
+            'path': self.path,
+        })
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers['Content-Length']))
+
+        if self.path == '/drop/':
+            # Handle the request, but close the connection without
+            # responding.
+            KeepAliveRequestHandler.dropped += 1
+            self.close_connection = 1
+            return
+
+        body = json.dumps({
+            'stat': 'ok',
+            'length': len(data),
+            'has_diff': 'diff content' in data,
+        })
+
+        self.send_response(201)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ConnectionPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.httpd = HTTPServer(('127.0.0.1', 0), KeepAliveRequestHandler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        self.pool = ConnectionPool()
+        self.opener = urllib2.build_opener(KeepAliveHTTPHandler(self.pool))
+
+    def tearDown(self):
+        self.pool.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def test_connection_reuse(self):
+        """Testing reuse of pooled keep-alive connections"""
+        for i in range(3):
+            rsp = json.loads(self.opener.open('%s/api/%d/' %
+                                              (self.url, i)).read())
+            self.assertEqual(rsp['path'], '/api/%d/' % i)
+
+        self.assertEqual(self.pool.requests, 3)
+        self.assertEqual(self.pool.connections_opened, 1)
+        self.assertEqual(self.pool.connections_reused, 2)
+
+    def test_reconnect_after_close(self):
+        """Testing reconnecting when a pooled connection was dropped"""
+        self.opener.open(self.url + '/api/').read()
+
+        # Simulate the server timing out the idle connection.
+        for connections in self.pool._idle.values():
+            for connection in connections:
+                connection.sock.close()
+
+        rsp = json.loads(self.opener.open(self.url + '/api/info/').read())
+        self.assertEqual(rsp['path'], '/api/info/')
+        self.assertEqual(self.pool.connections_opened, 2)
+
+    def test_no_resend_after_sent(self):
+        """Testing not resending a sent POST on a reused connection"""
+        KeepAliveRequestHandler.dropped = 0
+        self.opener.open(self.url + '/api/').read()
+
+        request = urllib2.Request(self.url + '/drop/', 'data')
+        self.assertRaises(urllib2.URLError, self.opener.open, request)
+        self.assertEqual(KeepAliveRequestHandler.dropped, 1)
+
+    def test_timeout(self):
+        """Testing passing the request timeout to new connections"""
+        self.opener.open(self.url + '/api/', timeout=7).read()
+
+        for connections in self.pool._idle.values():
+            for connection in connections:
+                self.assertEqual(connection.timeout, 7)
+
+    def test_streamed_post(self):
+        """Testing streaming a MultipartBody over a pooled connection"""
+        body = MultipartBody({'basedir': '/'}, {
+            'path': {
+                'filename': 'diff',
+                'content': 'diff content\n' * 10000,
+            },
+        })
+        body.CHUNK_SIZE = 1000
+
+        request = urllib2.Request(self.url + '/api/diffs/', body, {
+            'Content-Type': body.content_type,
+            'Content-Length': str(len(body)),
+        })
+        rsp = json.loads(self.opener.open(request).read())
+        self.assertEqual(rsp['length'], len(body))
+        self.assertTrue(rsp['has_diff'])
+
+        self.opener.open(self.url + '/api/').read()
+        self.assertEqual(self.pool.connections_reused, 1)
+
+
+class MultipartBodyTests(unittest.TestCase):
+    def test_encode(self):
+        """Testing MultipartBody encoding of fields and files"""
+        body = MultipartBody({'basedir': '/trunk'}, {
+            'path': {
+                'filename': 'diff',
+                'content': 'diff content',
+            },
+        }, boundary='BOUNDARY')
+
+        self.assertEqual(body.content_type,
+                         'multipart/form-data; boundary=BOUNDARY')
+        self.assertEqual(str(body),
+                         '--BOUNDARY\r\n'
+                         'Content-Disposition: form-data; name="basedir"\r\n'
+                         '\r\n'
+                         '/trunk\r\n'
+                         '--BOUNDARY\r\n'
+                         'Content-Disposition: form-data; name="path"; '
+                         'filename="diff"\r\n'
+                         '\r\n'
+                         'diff content\r\n'
+                         '--BOUNDARY--\r\n'
+                         '\r\n')
+        self.assertEqual(len(body), len(str(body)))
+
+    def test_file_content(self):
+        """Testing MultipartBody streaming file contents in chunks"""
+        content = 'x' * 1000
+        body = MultipartBody(files={
+            'path': {
+                'filename': 'diff',
+                'content': StringIO(content),
+            },
+        })
+        body.CHUNK_SIZE = 100
+
+        chunks = list(body)
+        self.assertTrue(max([len(chunk) for chunk in chunks]) <= 100)
+        self.assertTrue(content in ''.join(chunks))
+        self.assertEqual(len(body), len(''.join(chunks)))
+
+        # The body can be sent more than once.
+        self.assertEqual(''.join(body), ''.join(chunks))
+
+    def test_compressed_file(self):
+        """Testing MultipartBody with a gzip-compressed file"""
+        content = 'diff content\n' * 1000
+        body = MultipartBody(files={
+            'path': {
+                'filename': 'diff.gz',
+                'content': gzip_content(content),
+                'content_type': 'application/x-gzip',
+            },
+        }, boundary='BOUNDARY')
+
+        data = str(body)
+        self.assertTrue('filename="diff.gz"\r\n'
+                        'Content-Type: application/x-gzip\r\n'
+                        '\r\n' in data)
+        self.assertTrue(len(data) < len(content))
+
+
+class ContentEncodingTests(unittest.TestCase):
+    def test_decode_gzip(self):
+        """Testing decoding gzip-encoded responses"""
+        self.assertEqual(decode_content(gzip_content('{"stat": "ok"}'),
+                                        'gzip'),
+                         '{"stat": "ok"}')
+
+    def test_decode_deflate(self):
+        """Testing decoding deflate-encoded responses"""
+        data = '{"stat": "ok"}'
+        self.assertEqual(decode_content(zlib.compress(data), 'deflate'), data)
+
+        # Raw deflate streams, without the zlib header.
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        raw = compressor.compress(data) + compressor.flush()
+        self.assertEqual(decode_content(raw, 'deflate'), data)
+
+    def test_decode_identity(self):
+        """Testing decoding responses without a Content-Encoding"""
+        self.assertEqual(decode_content('{}', None), '{}')
+
+
+class PersistentCookieJarTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cookie_file = os.path.join(self.tmpdir, 'cookies.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_flush_only_when_changed(self):
+        """Testing PersistentCookieJar only writes changed cookies"""
+        jar = PersistentCookieJar(self.cookie_file)
+        self.assertFalse(jar.flush())
+        self.assertFalse(os.path.exists(self.cookie_file))
+
+        jar.set_cookie(self._make_cookie('abc123'))
+        self.assertTrue(jar.flush())
+        self.assertTrue(os.path.exists(self.cookie_file))
+
+        # Setting the same cookie again shouldn't mark the jar as changed.
+        jar.set_cookie(self._make_cookie('abc123'))
+        self.assertFalse(jar.flush())
+
+        jar.set_cookie(self._make_cookie('def456'))
+        self.assertTrue(jar.flush())
+        self.assertEqual(os.listdir(self.tmpdir), ['cookies.txt'])
+
+    def test_load(self):
+        """Testing PersistentCookieJar loading an existing cookie file"""
+        jar = PersistentCookieJar(self.cookie_file)
+        jar.set_cookie(self._make_cookie('abc123'))
+        jar.flush()
+
+        jar = PersistentCookieJar(self.cookie_file)
+        jar.load(ignore_expires=True)
+        self.assertFalse(jar.changed)
+        self.assertEqual(
+            jar._cookies['example.com']['/']['rbsessionid'].value, 'abc123')
+
+    def _make_cookie(self, value):
+        return cookielib.Cookie(0, 'rbsessionid', value, None, False,
+                                'example.com', False, False, '/', True,
+                                False, 2000000000, False, None, None, {})
+
+
+class HTTPCacheTests(RBTestBase):
+    def setUp(self):
+        super(HTTPCacheTests, self).setUp()
+        postreview.options = OptionsStub()
+
+        self.httpd = HTTPServer(('127.0.0.1', 0), KeepAliveRequestHandler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+        self.url = 'http://127.0.0.1:%d/' % self.httpd.server_address[1]
+        self.server = ReviewBoardServer(self.url, RepositoryInfo(), None,
+                                        use_cache=True)
+
+    def tearDown(self):
+        # The test HTTP server only handles one connection at a time, so
+        # the pooled connection has to be closed before shutting it down.
+        self.server.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def test_conditional_get(self):
+        """Testing conditional GETs using the HTTP cache"""
+        for i in range(3):
+            rsp = json.loads(self.server.http_get('api/repositories/'))
+            self.assertEqual(rsp['path'], '/api/repositories/')
+
+        self.assertEqual(self.server.http_cache.requests, 2)
+        self.assertEqual(self.server.http_cache.hits, 2)
+
+    def test_hit_not_rewritten(self):
+        """Testing HTTP cache hits not rewriting the entry"""
+        headers = HTTPMessage(StringIO('ETag: "1"\r\n\r\n'))
+        cache = HTTPCache()
+        cache.store('/a/', 'user', headers, 'a' * 10)
+        filename = cache.cache._get_filename('user /a/')
+        os.utime(filename, (0, 0))
+        st = os.stat(filename)
+
+        entry = cache.get('/a/', 'user')
+        self.assertEqual(cache.hit('/a/', 'user', entry), 'a' * 10)
+        self.assertEqual(os.stat(filename).st_ino, st.st_ino)
+        self.assertTrue(os.stat(filename).st_mtime > st.st_mtime)
+
+    def test_lru_eviction(self):
+        """Testing HTTP cache LRU eviction"""
+        headers = HTTPMessage(StringIO('ETag: "1"\r\n\r\n'))
+        cache = HTTPCache(max_entry_size=25)
+
+        cache.store('/a/', 'user', headers, 'a' * 10)
+        cache.store('/b/', 'user', headers, 'b' * 10)
+
+        # Leave room for two of the entries, with /a/ the least recently
+        # used.
+        filename = cache.cache._get_filename('user /a/')
+        cache.cache.max_size = os.path.getsize(filename) * 2.5
+        os.utime(filename, (time.time() - 10, time.time() - 10))
+        cache.store('/c/', 'user', headers, 'c' * 10)
+
+        self.assertEqual(cache.get('/a/', 'user'), None)
+        self.assertNotEqual(cache.get('/b/', 'user'), None)
+        self.assertNotEqual(cache.get('/c/', 'user'), None)
+
+        # Responses are never shared between credentials.
+        self.assertEqual(cache.get('/b/', 'other-user'), None)
+
+        # Responses too large to store are skipped.
+        cache.store('/d/', 'user', headers, 'd' * 30)
+        self.assertEqual(cache.get('/d/', 'user'), None)
+
+
+class FlakyRequestHandler(KeepAliveRequestHandler):
+    """Fails the first requests with 503 Service Unavailable."""
+    def do_GET(self):
+        if self._fail():
+            KeepAliveRequestHandler.do_GET(self)
+
+    def do_POST(self):
+        if self._fail():
+            KeepAliveRequestHandler.do_POST(self)
+
+    def _fail(self):
+        if self.server.failures <= 0:
+            return True
+
+        self.server.failures -= 1
+
+        if 'Content-Length' in self.headers:
+            self.rfile.read(int(self.headers['Content-Length']))
+
+        self.send_response(503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+        return False
+
+
+class RetryTests(unittest.TestCase):
+    def setUp(self):
+        postreview.options = OptionsStub()
+
+        self.httpd = HTTPServer(('127.0.0.1', 0), FlakyRequestHandler)
+        self.httpd.failures = 0
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+        self.url = 'http://127.0.0.1:%d/' % self.httpd.server_address[1]
+        self.server = ReviewBoardServer(self.url, RepositoryInfo(), None)
+        self.server.retry_policy = RetryPolicy(max_retries=2, backoff=0)
+
+    def tearDown(self):
+        self.server.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def test_retry_get(self):
+        """Testing retrying a GET when the server is unavailable"""
+        self.httpd.failures = 2
+
+        rsp = json.loads(self.server.http_get('api/'))
+        self.assertEqual(rsp['path'], '/api/')
+        self.assertEqual(self.server.retry_policy.retries, 2)
+        self.assertEqual(self.server.retry_policy.recovered, 1)
+
+    def test_retry_limit(self):
+        """Testing giving up after the maximum number of retries"""
+        self.httpd.failures = 3
+
+        try:
+            self.server.http_get('api/')
+            self.fail('Expected an HTTPError')
+        except urllib2.HTTPError, e:
+            self.assertEqual(e.code, 503)
+
+        self.assertEqual(self.server.retry_policy.retries, 2)
+        self.assertEqual(self.server.retry_policy.failures, 1)
+
+    def test_retry_post(self):
+        """Testing retrying a POST the server didn't accept"""
+        self.httpd.failures = 1
+
+        rsp = json.loads(self.server.http_post('api/review-requests/',
+                                               {'repository': 1}))
+        self.assertEqual(rsp['stat'], 'ok')
+        self.assertEqual(self.server.retry_policy.retries, 1)
+
+    def test_policy(self):
+        """Testing RetryPolicy decisions"""
+        policy = RetryPolicy(max_retries=3, backoff=1, max_backoff=3,
+                             budget=5)
+        bad_gateway = self._make_http_error(502)
+        unavailable = self._make_http_error(503)
+        not_found = self._make_http_error(404)
+        refused = urllib2.URLError(
+            socket.error(errno.ECONNREFUSED, 'Connection refused'))
+        timed_out = urllib2.URLError(socket.timeout('timed out'))
+        reset = urllib2.URLError(
+            socket.error(errno.ECONNRESET, 'Connection reset by peer'))
+        unknown_host = urllib2.URLError(
+            socket.gaierror(socket.EAI_NONAME, 'Name or service not known'))
+        unreachable = urllib2.URLError(
+            socket.error(errno.ENETUNREACH, 'Network is unreachable'))
+
+        # Only idempotent requests are retried if the server may have
+        # handled them.
+        self.assertNotEqual(policy.get_retry_delay(bad_gateway, 0, True),
+                            None)
+        self.assertEqual(policy.get_retry_delay(bad_gateway, 0, False), None)
+        self.assertNotEqual(policy.get_retry_delay(unavailable, 0, False),
+                            None)
+        self.assertEqual(policy.get_retry_delay(not_found, 0, True), None)
+        self.assertNotEqual(policy.get_retry_delay(refused, 0, False), None)
+        self.assertEqual(policy.get_retry_delay(timed_out, 0, False), None)
+        self.assertEqual(policy.get_retry_delay(reset, 0, False), None)
+
+        # Only some connection errors are worth retrying.
+        self.assertEqual(policy.get_retry_delay(unknown_host, 0, True), None)
+        self.assertEqual(policy.get_retry_delay(unreachable, 0, True), None)
+        self.assertEqual(policy.get_retry_delay(urllib2.URLError('?'), 0,
+                                                True),
+                         None)
+        self.assertNotEqual(policy.get_retry_delay(reset, 0, True), None)
+
+        # The backoff is capped.
+        delay = policy.get_retry_delay(timed_out, 2, True)
+        self.assertNotEqual(delay, None)
+        self.assertTrue(delay <= 3)
+        self.assertEqual(policy.get_retry_delay(timed_out, 3, True), None)
+
+        # The retry budget has been used up.
+        self.assertEqual(policy.retries, 5)
+        self.assertEqual(policy.get_retry_delay(timed_out, 0, True), None)
+
+    def test_retry_after(self):
+        """Testing RetryPolicy honoring Retry-After"""
+        policy = RetryPolicy(max_backoff=10)
+        error = self._make_http_error(503, 'Retry-After: 5\r\n\r\n')
+        self.assertEqual(policy.get_retry_delay(error, 0, True), 5)
+
+        error = self._make_http_error(503, 'Retry-After: 60\r\n\r\n')
+        self.assertEqual(policy.get_retry_delay(error, 0, True), 10)
+
+    def _make_http_error(self, code, headers='\r\n'):
+        return urllib2.HTTPError(self.url, code, 'Error',
+                                 HTTPMessage(StringIO(headers)),
+                                 StringIO(''))
+
+
+class PipelineClient(SCMClient):
+    """A client that signals when its diff has been started."""
+    def __init__(self, diff, **kwargs):
+        super(PipelineClient, self).__init__(**kwargs)
+        self._diff = diff
+        self.started = threading.Event()
+
+    def diff(self, args):
+        self.started.set()
+        return self._diff, None
+
+
+class PipelineServer(object):
+    """Records what main() asks of the server, in order."""
+    def __init__(self, tool):
+        self.url = 'http://localhost:8080/'
+        self.info = RepositoryInfo(path='/stub')
+        self.deprecated_api = False
+        self.compress_diffs = False
+        self.tool = tool
+        self.calls = []
+        self.diff_started_first = None
+        self.uploaded = None
+
+    def check_api_version(self):
+        # The diff runs in another thread, so give it a chance to start.
+        self.tool.started.wait(5)
+        self.diff_started_first = self.tool.started.isSet()
+        self.calls.append('check_api_version')
+
+        return True
+
+    def login(self, force=False):
+        self.calls.append('login')
+
+    def new_review_request(self, changenum, submit_as=None):
+        self.calls.append('new_review_request')
+
+        return {'id': 1, 'bugs_closed': []}
+
+    def set_review_request_fields(self, review_request, fields):
+        self.calls.append('set_review_request_fields')
+
+    def upload_diff(self, review_request, diff, parent_diff):
+        self.calls.append('upload_diff')
+        self.uploaded = diff
+
+    def discard(self, review_request):
+        self.calls.append('discard')
+
+    def close(self):
+        pass
+
+
+class PipelineTests(RBTestBase):
+    """Tests for main() generating the diff in the background."""
+    def setUp(self):
+        super(PipelineTests, self).setUp()
+        self.orig_dir = os.getcwd()
+        self.chdir_tmp()
+        self.saved = (postreview.scan_usable_client,
+                      postreview.ReviewBoardServer, postreview.configs,
+                      postreview.options, atexit.register, sys.argv)
+
+        # main() registers things to run at exit, which mustn't run at the
+        # end of the test run.
+        atexit.register = lambda *args, **kwargs: None
+        sys.argv = ['post-review', '--pipeline', '--server',
+                    'http://localhost:8080/']
+
+    def tearDown(self):
+        (postreview.scan_usable_client, postreview.ReviewBoardServer,
+         postreview.configs, postreview.options, atexit.register,
+         sys.argv) = self.saved
+        os.chdir(self.orig_dir)
+
+    def _run_main(self, diff):
+        tool = PipelineClient(diff)
+        server = self.server = PipelineServer(tool)
+        postreview.scan_usable_client = \
+            lambda options: (server.info, tool)
+        postreview.ReviewBoardServer = lambda *args, **kwargs: server
+
+        try:
+            postreview.main()
+        finally:
+            # Let the diff thread finish, whatever main() did.
+            tool.started.wait(5)
+
+    def test_pipeline(self):
+        """Testing main() joining the diff generated in the background"""
+        self._run_main('Index: foo\n')
+        server = self.server
+
+        # Without a changenum, the diff starts before the server is asked
+        # for anything.
+        self.assertTrue(server.diff_started_first)
+        self.assertEqual(server.calls, [
+            'check_api_version',
+            'login',
+            'new_review_request',
+            'set_review_request_fields',
+            'upload_diff',
+        ])
+        self.assertEqual(server.uploaded, 'Index: foo\n')
+
+    def test_pipeline_empty_diff(self):
+        """Testing main() discarding the review request if the diff dies"""
+        self.assertRaises(SystemExit, self._run_main, '')
+        self.assertEqual(self.server.calls, [
+            'check_api_version',
+            'login',
+            'new_review_request',
+            'discard',
+        ])
+        self.assertEqual(self.server.uploaded, None)
+
+
+class StubServerRequestHandler(BaseHTTPRequestHandler):
+    """Serves just enough of the API for post-review --output-diff."""
+    RESOURCES = {
+        '/api/': {
+            'stat': 'ok',
+            'links': {
+                'info': {
+                    'href': '/api/info/',
+                    'method': 'GET',
+                },
+            },
+        },
+        '/api/info/': {
+            'stat': 'ok',
+            'info': {
+                'product': {
+                    'package_version': '1.6',
+                },
+            },
+        },
+    }
+
+    def do_GET(self):
+        body = json.dumps(self.RESOURCES[self.path])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StartupTests(RBTestBase):
+    """Tests for what post-review imports on startup.
+
+    Every run of post-review pays for importing it, so modules that are
+    only needed on some code paths (pkg_resources, the HTTP stack, and
+    the less common SCM clients) are imported lazily. These run
+    post-review in a fresh interpreter and fail if any of them are
+    imported anyway. The first run against a server needs pkg_resources
+    to check its version, but later runs use the cached version. Only
+    uploads need gzip. How long startup takes is measured by
+    contrib/internal/benchmark_startup.py.
+    """
+    LAZY_MODULES = ['cookielib', 'gzip', 'httplib', 'mimetools',
+                    'pkg_resources', 'rbtools.clients.perforce',
+                    'rbtools.clients.plastic', 'urllib2']
+
+    # The modules that are still lazy once we talk to a server.
+    SERVER_LAZY_MODULES = ['gzip', 'pkg_resources',
+                           'rbtools.clients.perforce',
+                           'rbtools.clients.plastic']
+
+    # Runs post-review with a client that always finds a repository, and
+    # writes the modules that were imported to stderr on exit.
+    SCRIPT = (
+        'import atexit, sys\n'
+        'atexit.register(lambda: sys.stderr.write(\n'
+        '    " ".join(sys.modules.keys())))\n'
+        'from rbtools import clients\n'
+        'from rbtools.clients import RepositoryInfo, SCMClient\n'
+        'class StubClient(SCMClient):\n'
+        '    def get_repository_info(self):\n'
+        '        return RepositoryInfo(path="/stub", base_path="/")\n'
+        '    def diff(self, args):\n'
+        '        return "Index: stub\\n", None\n'
+        'clients.SCMCLIENTS = [StubClient()]\n'
+        'from rbtools.postreview import main\n'
+        'sys.argv = ["post-review"] + sys.argv[1:]\n'
+        'main()\n')
+
+    def test_help_imports(self):
+        """Testing modules imported by post-review --help"""
+        output = self._run_post_review(['--help'])
+        self.assertTrue(output.startswith('Usage:'))
+
+    def test_output_diff_imports(self):
+        """Testing modules imported by post-review --output-diff"""
+        httpd = HTTPServer(('127.0.0.1', 0), StubServerRequestHandler)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+        try:
+            args = ['--output-diff', '--server',
+                    'http://127.0.0.1:%d/' % httpd.server_address[1]]
+            lazy_modules = [name for name in self.SERVER_LAZY_MODULES
+                            if name != 'pkg_resources']
+            output = self._run_post_review(args, lazy_modules)
+            self.assertEqual(output, 'Index: stub\n')
+
+            output = self._run_post_review(args, self.SERVER_LAZY_MODULES)
+            self.assertEqual(output, 'Index: stub\n')
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+    def _run_post_review(self, args, lazy_modules=LAZY_MODULES):
+        # Tests may have changed directories, so make sure this copy of
+        # rbtools is the one imported.
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.path.dirname(
+            os.path.dirname(os.path.abspath(postreview.__file__)))
+        p = subprocess.Popen([sys.executable, '-c', self.SCRIPT] + args,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE,
+                             env=env)
+        output, errors = p.communicate()
+        self.assertEqual(p.returncode, 0, errors)
+        modules = errors.split()
+
+        for name in lazy_modules:
+            self.assertFalse(name in modules,
+                             '%s was imported on startup' % name)
+
+        return output
@@ -0,0 +1,352 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+from rbtools import get_package_version
+from rbtools.utils.filesystem import get_home_path, replace_file
+
+
+CACHE_DIR = '.post-review-cache'
+
+# Bump this when the layout of cached data changes, so that old cache
+# files are thrown away rather than misread.
+CACHE_FORMAT = 1
+
+caches = []
+
+# Whether caches are read from and written to disk. When disabled (with
+# --disable-cache), caches still work, but only for the current run.
+persistent = True
+
+
+def get_cache_dir():
+    """Returns the directory cache files are stored in."""
+    return os.path.join(get_home_path(), CACHE_DIR)
+
+
+def set_caches_persistent(value):
+    """Sets whether caches are read from and written to disk."""
+    global persistent
+    persistent = value
+
+
+def save_caches():
+    """Saves every cache that has changed since it was loaded."""
+    for cache in caches:
+        cache.save()
+
+
+class Cache(object):
+    """
+    A dictionary of values persisted between runs of post-review.
+
+    Each cache is stored as a pickle in its own file in the cache directory,
+    and is loaded the first time it's used. Entries older than the cache's
+    ttl (in seconds) are treated as missing. The file is only written by
+    save() (see save_caches()), and only if something changed, so a run
+    that only reads from the cache never touches the disk.
+
+    A cache file written by a different version of RBTools, or one that
+    can't be read, is simply discarded.
+    """
+    def __init__(self, name, ttl=None):
+        self.name = name
+        self.filename = os.path.join(get_cache_dir(), name)
+        self.ttl = ttl
+        self.changed = False
+        self._entries = None
+        caches.append(self)
+
+    def _load(self):
+        if self._entries is not None:
+            return
+
+        self._entries = {}
+
+        if not persistent:
+            return
+
+        try:
+            fp = open(self.filename, 'rb')
+
+            try:
+                data = pickle.load(fp)
+            finally:
+                fp.close()
+        except IOError:
+            return
+        except Exception, e:
+            logging.debug('Discarding unreadable cache %s: %s' %
+                          (self.filename, e))
+            return
+
+        if (not isinstance(data, dict) or
+            data.get('version') != (get_package_version(), CACHE_FORMAT)):
+            logging.debug('Discarding cache %s from another version' %
+                          self.filename)
+            return
+
+        self._entries = data['entries']
+
+    def get(self, key, default=None):
+        """Returns the value for the key, or default if it's missing."""
+        self._load()
+
+        try:
+            timestamp, value = self._entries[key]
+        except KeyError:
+            return default
+
+        if self.ttl is not None and time.time() - timestamp > self.ttl:
+            return default
+
+        return value
+
+    def set(self, key, value):
+        """Stores a value for the key."""
+        self._load()
+        self._entries[key] = (time.time(), value)
+        self.changed = True
+
+    def remove(self, key):
+        """Removes the key from the cache, if it's there."""
+        self._load()
+
+        if key in self._entries:
+            del self._entries[key]
+            self.changed = True
+
+    def clear(self):
+        """Removes everything from the cache."""
+        self._entries = {}
+        self.changed = True
+
+    def keys(self):
+        self._load()
+
+        return self._entries.keys()
+
+    def items(self):
+        """Returns a list of (key, timestamp, value) for every entry.
+
+        The timestamp is when the entry was last set. Entries past the ttl
+        are included.
+        """
+        self._load()
+
+        return [(key, timestamp, value)
+                for key, (timestamp, value) in self._entries.iteritems()]
+
+    def save(self):
+        """Writes the cache to disk if it has changed."""
+        if not self.changed or not persistent:
+            return
+
+        cache_dir = os.path.dirname(self.filename)
+
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+
+            fd, tmpfile = tempfile.mkstemp(prefix='.' + self.name,
+                                           dir=cache_dir)
+        except (IOError, OSError), e:
+            logging.debug('Unable to save cache %s: %s' % (self.filename, e))
+            return
+
+        try:
+            fp = os.fdopen(fd, 'wb')
+
+            try:
+                pickle.dump({
+                    'version': (get_package_version(), CACHE_FORMAT),
+                    'entries': self._entries,
+                }, fp, pickle.HIGHEST_PROTOCOL)
+            finally:
+                fp.close()
+
+            replace_file(tmpfile, self.filename)
+            self.changed = False
+        except (IOError, OSError), e:
+            logging.debug('Unable to save cache %s: %s' % (self.filename, e))
+
+            try:
+                os.unlink(tmpfile)
+            except OSError:
+                pass
+
+
+class FileCache(object):
+    """
+    A cache of large values, each stored in its own file.
+
+    Unlike Cache, which reads and writes all of its entries at once, each
+    entry here is a file in its own directory in the cache directory, named
+    by a hash of its key. Getting an entry only reads its file, and setting
+    one writes its file right away, rather than in save().
+
+    The modification time of an entry's file is when it was last used,
+    which touch() updates without rewriting it. Once the files add up to
+    more than max_size bytes, the least recently used are removed.
+
+    When caches aren't persistent, the entries are only kept in memory.
+    """
+    def __init__(self, name, max_size):
+        self.name = name
+        self.dirname = os.path.join(get_cache_dir(), name)
+        self.max_size = max_size
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value for the key, or None if it's missing."""
+        if not persistent:
+            return self._entries.get(key)
+
+        filename = self._get_filename(key)
+
+        try:
+            fp = open(filename, 'rb')
+
+            try:
+                data = pickle.load(fp)
+            finally:
+                fp.close()
+        except IOError:
+            return None
+        except Exception, e:
+            logging.debug('Discarding unreadable cache entry %s: %s' %
+                          (filename, e))
+            self.remove(key)
+            return None
+
+        if (not isinstance(data, dict) or
+            data.get('version') != (get_package_version(), CACHE_FORMAT) or
+            data.get('key') != key):
+            return None
+
+        return data['value']
+
+    def touch(self, key):
+        """Marks the entry for the key as the most recently used."""
+        if persistent:
+            try:
+                os.utime(self._get_filename(key), None)
+            except OSError:
+                pass
+
+    def set(self, key, value):
+        """Stores a value for the key, evicting old entries if needed."""
+        if not persistent:
+            self._entries[key] = value
+            return
+
+        try:
+            if not os.path.isdir(self.dirname):
+                os.makedirs(self.dirname)
+
+            fd, tmpfile = tempfile.mkstemp(prefix='.', dir=self.dirname)
+        except (IOError, OSError), e:
+            logging.debug('Unable to write to cache %s: %s' %
+                          (self.dirname, e))
+            return
+
+        try:
+            fp = os.fdopen(fd, 'wb')
+
+            try:
+                pickle.dump({
+                    'version': (get_package_version(), CACHE_FORMAT),
+                    'key': key,
+                    'value': value,
+                }, fp, pickle.HIGHEST_PROTOCOL)
+            finally:
+                fp.close()
+
+            replace_file(tmpfile, self._get_filename(key))
+        except (IOError, OSError), e:
+            logging.debug('Unable to write to cache %s: %s' %
+                          (self.dirname, e))
+
+            try:
+                os.unlink(tmpfile)
+            except OSError:
+                pass
+
+            return
+
+        self._evict()
+
+    def remove(self, key):
+        """Removes the entry for the key, if there is one."""
+        if not persistent:
+            self._entries.pop(key, None)
+            return
+
+        try:
+            os.unlink(self._get_filename(key))
+        except OSError:
+            pass
+
+    def _get_filename(self, key):
+        return os.path.join(self.dirname, sha1(key).hexdigest())
+
+    def _evict(self):
+        self._lock.acquire()
+
+        try:
+            try:
+                names = os.listdir(self.dirname)
+            except OSError, e:
+                logging.debug('Unable to list cache %s: %s' %
+                              (self.dirname, e))
+                return
+
+            files = []
+            total_size = 0
+
+            for name in names:
+                if name.startswith('.'):
+                    # A file still being written.
+                    continue
+
+                try:
+                    st = os.stat(os.path.join(self.dirname, name))
+                except OSError:
+                    continue
+
+                files.append((st.st_mtime, name, st.st_size))
+                total_size += st.st_size
+
+            if total_size <= self.max_size:
+                return
+
+            files.sort()
+
+            for mtime, name, size in files:
+                if total_size <= self.max_size:
+                    break
+
+                logging.debug('Evicting %s from the %s cache' %
+                              (name, self.name))
+
+                try:
+                    os.unlink(os.path.join(self.dirname, name))
+                except OSError:
+                    pass
+
+                total_size -= size
+        finally:
+            self._lock.release()
@@ -1,12 +1,31 @@
+import atexit
+import logging
 import os
 import subprocess
 import sys
+import threading
+import time
 
+from rbtools.utils.cache import Cache
 from rbtools.utils.process import die, execute
+from rbtools.utils.timings import timings
 
 
 GNU_DIFF_WIN32_URL = 'http://gnuwin32.sourceforge.net/packages/diffutils.htm'
 
+# The results of probing for tools. Each is stored along with the path,
+# size and modification time of the executable that was probed, so that
+# installing, upgrading or removing the tool invalidates it.
+_probe_cache = None
+
+# Probe processes that may still be running, and need to be reaped. The
+# ones still running when post-review exits are waited for then.
+_probes = []
+_probes_reaped_at_exit = False
+
+# Clients can be probed from several threads at once.
+_lock = threading.Lock()
+
 
 def check_install(command):
     """
@@ -14,26 +33,55 @@ def check_install(command):
     that command is installed or not.  The 'command' argument should be
     something that executes quickly, without hitting the network (for
     instance, 'svn help' or 'git --version').
+
+    The executable is looked for in the PATH first, which settles it
+    without the cost of a process. Only on Windows, where a command can run
+    without being found in the PATH (such as through a registered App
+    Path), is the command then run to find out.
     """
-    try:
-        subprocess.Popen(command.split(' '),
-                         stdin=subprocess.PIPE,
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
+    args = command.split(' ')
+
+    if find_executable(args[0]):
         return True
-    except OSError:
+
+    if not sys.platform.startswith('win'):
         return False
 
+    _reap_probes()
+    start_time = time.time()
+
+    try:
+        try:
+            # We only care whether the command can be run, so we don't
+            # wait for it here. It's reaped on a later check, or on exit.
+            _add_probe(subprocess.Popen(args,
+                                        stdin=_get_devnull(),
+                                        stdout=_get_devnull(),
+                                        stderr=_get_devnull()))
+            return True
+        except OSError:
+            return False
+    finally:
+        timings.record(command, time.time() - start_time)
+
 
 def check_gnu_diff():
     """Checks if GNU diff is installed, and informs the user if it's not."""
-    has_gnu_diff = False
+    command = 'diff --version'
+    signature = _get_signature('diff')
+    has_gnu_diff = _get_cached_probe(command, signature)
 
-    try:
-        result = execute(['diff', '--version'], ignore_errors=True)
-        has_gnu_diff = 'GNU diffutils' in result
-    except OSError:
-        pass
+    if has_gnu_diff is None:
+        has_gnu_diff = False
+
+        if signature is not None or sys.platform.startswith('win'):
+            try:
+                result = execute(command.split(' '), ignore_errors=True)
+                has_gnu_diff = 'GNU diffutils' in result
+            except OSError:
+                pass
+
+        _set_cached_probe(command, signature, has_gnu_diff)
 
     if not has_gnu_diff:
         sys.stderr.write('\n')
@@ -48,3 +96,130 @@ def check_gnu_diff():
             sys.stderr.write('\n')
 
         die()
+
+
+def find_executable(name):
+    """
+    Returns the full path of the executable that running name would run,
+    searching the PATH, or None if it can't be found.
+    """
+    if os.path.dirname(name):
+        dirs = ['']
+    else:
+        dirs = os.environ.get('PATH', os.defpath).split(os.pathsep)
+
+    if sys.platform.startswith('win') and not os.path.splitext(name)[1]:
+        exts = os.environ.get('PATHEXT', '.COM;.EXE;.BAT;.CMD').split(';')
+    else:
+        exts = ['']
+
+    for dir in dirs:
+        for ext in exts:
+            path = os.path.join(dir, name + ext)
+
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return os.path.abspath(path)
+
+    return None
+
+
+def _get_signature(name):
+    path = find_executable(name)
+
+    if path is None:
+        return None
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    return (path, st.st_size, st.st_mtime)
+
+
+def _get_probe_cache():
+    global _probe_cache
+
+    _lock.acquire()
+
+    try:
+        if _probe_cache is None:
+            _probe_cache = Cache('probes')
+
+        return _probe_cache
+    finally:
+        _lock.release()
+
+
+def _get_cached_probe(command, signature):
+    """
+    Returns the cached result of a probe, or None if there isn't one for
+    the executable's current signature.
+    """
+    if signature is None:
+        return None
+
+    cached = _get_probe_cache().get(command)
+
+    if cached and cached[0] == signature:
+        logging.debug('Using cached result for "%s"' % command)
+        return cached[1]
+
+    return None
+
+
+def _set_cached_probe(command, signature, result):
+    if signature is not None:
+        _get_probe_cache().set(command, (signature, result))
+
+
+def _add_probe(p):
+    global _probes_reaped_at_exit
+
+    _lock.acquire()
+
+    try:
+        _probes.append(p)
+
+        if not _probes_reaped_at_exit:
+            atexit.register(_wait_for_probes)
+            _probes_reaped_at_exit = True
+    finally:
+        _lock.release()
+
+
+def _wait_for_probes():
+    """Waits for any probe processes that are still running."""
+    _lock.acquire()
+
+    try:
+        for p in _probes:
+            p.wait()
+
+        del _probes[:]
+    finally:
+        _lock.release()
+
+
+def _reap_probes():
+    """Reaps any probe processes that have exited."""
+    _lock.acquire()
+
+    try:
+        for p in _probes[:]:
+            if p.poll() is not None:
+                _probes.remove(p)
+    finally:
+        _lock.release()
+
+
+_devnull = None
+
+
+def _get_devnull():
+    global _devnull
+
+    if _devnull is None:
+        _devnull = open(os.devnull, 'r+')
+
+    return _devnull
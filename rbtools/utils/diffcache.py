@@ -0,0 +1,74 @@
+import zlib
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+from rbtools.utils.cache import FileCache
+
+
+class DiffCache(object):
+    """A store of generated diffs, keyed by what they were generated from.
+
+    This is only for diffs that are fully determined by immutable ids,
+    such as a range of commit hashes or a submitted changelist, along with
+    the client type and any options that change the diff's output. The key
+    is a hash of all of these, so an entry never needs to be invalidated;
+    it's simply never asked for again once anything it depends on changes.
+
+    The diff and parent diff are stored compressed, each entry in its own
+    file (see FileCache), so a hit only reads that entry and doesn't write
+    anything. The total size is limited to max_size bytes, and when it's
+    exceeded, the least recently used entries are evicted first.
+    """
+    MAX_SIZE = 50 * 1024 * 1024
+
+    def __init__(self, max_size=MAX_SIZE):
+        self.cache = FileCache('diffs', max_size)
+
+    def get(self, key):
+        """Returns the stored (diff, parent diff) for the key, or None."""
+        entry = self.cache.get(key)
+
+        if entry is None:
+            return None
+
+        self.cache.touch(key)
+
+        return tuple([self._decompress(data) for data in entry])
+
+    def store(self, key, diff, parent_diff):
+        """Stores a diff and parent diff (which may be None) for the key."""
+        self.cache.set(key, (self._compress(diff),
+                             self._compress(parent_diff)))
+
+    def _compress(self, data):
+        if data is None:
+            return None
+
+        return zlib.compress(data)
+
+    def _decompress(self, data):
+        if data is None:
+            return None
+
+        return zlib.decompress(data)
+
+
+_diff_cache = None
+
+
+def get_diff_cache():
+    """Returns the diff cache shared by the clients."""
+    global _diff_cache
+
+    if _diff_cache is None:
+        _diff_cache = DiffCache()
+
+    return _diff_cache
+
+
+def make_diff_key(*parts):
+    """Returns the cache key for a diff generated from the given parts."""
+    return sha1(repr(parts)).hexdigest()
@@ -1,4 +1,10 @@
+import copy
+import imp
+import logging
+import marshal
+import opcode
 import os
+import sys
 import tempfile
 
 from rbtools.utils.process import die
@@ -17,6 +23,16 @@ def cleanup_tempfiles():
             pass
 
 
+def get_home_path():
+    """Returns the directory the user's configuration and cookies live in."""
+    if 'APPDATA' in os.environ:
+        return os.environ['APPDATA']
+    elif 'HOME' in os.environ:
+        return os.environ['HOME']
+    else:
+        return ''
+
+
 def get_config_value(configs, name, default=None):
     for c in configs:
         if name in c:
@@ -26,34 +42,196 @@ def get_config_value(configs, name, default=None):
 
 
 def load_config_files(homepath):
-    """Loads data from .reviewboardrc files."""
-    def _load_config(path):
-        config = {
-            'TREES': {},
-        }
+    """Loads data from .reviewboardrc files.
+
+    The one in homepath is loaded first. Its CONFIG_SEARCH_BOUNDARIES (a
+    list of file or directory names, such as ['.git', '.hg']) and
+    CONFIG_SEARCH_STOP_AT_MOUNTS settings limit how far up from the current
+    directory the others are looked for: the search stops after the first
+    directory containing one of the boundaries, or at a mount point.
+
+    If it sets DISABLE_CACHE, the others aren't read from or written to the
+    config cache. The --disable-cache option can't do this, since options
+    are only parsed once their defaults have been loaded from the configs.
+    """
+    user_config = config_loader.load(homepath)
+    boundaries = []
+    stop_at_mounts = False
+
+    if user_config:
+        boundaries = user_config.get('CONFIG_SEARCH_BOUNDARIES', [])
+        stop_at_mounts = user_config.get('CONFIG_SEARCH_STOP_AT_MOUNTS', False)
+
+        if user_config.get('DISABLE_CACHE'):
+            config_loader.disable_cache()
+
+    configs = []
+
+    for path in walk_parents(os.getcwd()):
+        config = config_loader.load(path)
+
+        if config:
+            configs.append(config)
 
+        if stop_at_mounts and os.path.ismount(path):
+            break
+
+        for boundary in boundaries:
+            if os.path.exists(os.path.join(path, boundary)):
+                return user_config, configs
+
+    return user_config, configs
+
+
+class ConfigLoader(object):
+    """Loads .reviewboardrc files, caching them between runs.
+
+    The compiled code of each file is cached until the file changes (or a
+    different version of Python is used), so it doesn't need to be parsed
+    and compiled again. Cached code that can't be loaded is compiled
+    again. If the file only assigns literal values (as most do), the
+    resulting config is cached as well, since running it again can't give
+    a different result.
+
+    The configs are loaded before the command line is parsed, so
+    --disable-cache only stops the cache from being updated, not from
+    being read. See load_config_files() for DISABLE_CACHE.
+
+    What was loaded, and how, is kept in loaded as a list of
+    (filename, how) tuples, for debugging.
+    """
+    # The opcodes a config file that only assigns literals can contain.
+    LITERAL_OPCODES = set([
+        'BUILD_LIST', 'BUILD_MAP', 'BUILD_SET', 'BUILD_TUPLE', 'DUP_TOP',
+        'LOAD_CONST', 'POP_TOP', 'RETURN_VALUE', 'ROT_TWO', 'ROT_THREE',
+        'STORE_MAP', 'STORE_NAME', 'UNARY_NEGATIVE',
+    ])
+
+    def __init__(self):
+        self.loaded = []
+        self._cache = None
+
+    def load(self, path):
+        """
+        Returns the config from the .reviewboardrc file in path, or None if
+        there isn't one.
+        """
         filename = os.path.join(path, CONFIG_FILE)
 
-        if os.path.exists(filename):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+
+        # The marshal format of code objects changes between versions of
+        # Python, so the magic number of the bytecode is part of it.
+        signature = (st.st_mtime, st.st_size, st.st_ino, imp.get_magic())
+        cache = self._get_cache()
+        entry = cache.get(filename)
+        code = None
+
+        if entry and entry['signature'] == signature:
+            if entry['config'] is not None:
+                self.loaded.append((filename, 'cached config'))
+                return copy.deepcopy(entry['config'])
+
+            try:
+                code = marshal.loads(entry['code'])
+                how = 'cached code'
+            except (EOFError, TypeError, ValueError), e:
+                logging.debug('Discarding unreadable cached code for %s: %s'
+                              % (filename, e))
+
+        if code is None:
+            fp = open(filename, 'rU')
+
+            try:
+                source = fp.read()
+            finally:
+                fp.close()
+
             try:
-                execfile(filename, config)
+                code = compile(source + '\n', filename, 'exec')
             except SyntaxError, e:
                 die('Syntax error in config file: %s\n'
                     'Line %i offset %i\n' % (filename, e.lineno, e.offset))
 
-            return config
+            entry = {
+                'signature': signature,
+                'code': marshal.dumps(code),
+                'config': None,
+            }
+            how = 'compiled'
 
-        return None
+        config = {
+            'TREES': {},
+        }
+        exec code in config
 
-    configs = []
+        if how == 'compiled':
+            if self._is_literal(code):
+                literal_config = config.copy()
+                del literal_config['__builtins__']
+                entry['config'] = copy.deepcopy(literal_config)
 
-    for path in walk_parents(os.getcwd()):
-        config = _load_config(path)
+            cache.set(filename, entry)
 
-        if config:
-            configs.append(config)
+        self.loaded.append((filename, how))
+
+        return config
+
+    def disable_cache(self):
+        """
+        Stops all caches, including this one, from being read from or
+        written to disk for the rest of the run.
+        """
+        from rbtools.utils.cache import set_caches_persistent
+
+        set_caches_persistent(False)
+
+        # The cache may already have been read, so start a new, empty one.
+        self._cache = None
+
+    def _get_cache(self):
+        if self._cache is None:
+            from rbtools.utils.cache import Cache
+
+            self._cache = Cache('configs')
+
+        return self._cache
 
-    return _load_config(homepath), configs
+    def _is_literal(self, code):
+        """
+        Returns whether the code only assigns literal values (or names
+        assigned earlier in the file, or True and False) to names.
+        """
+        names = set(['True', 'False'])
+        co_code = code.co_code
+        i = 0
+
+        while i < len(co_code):
+            op = ord(co_code[i])
+            name = opcode.opname[op]
+
+            if op >= opcode.HAVE_ARGUMENT:
+                arg = ord(co_code[i + 1]) + ord(co_code[i + 2]) * 256
+                i += 3
+            else:
+                arg = None
+                i += 1
+
+            if name == 'STORE_NAME':
+                names.add(code.co_names[arg])
+            elif name == 'LOAD_NAME':
+                if code.co_names[arg] not in names:
+                    return False
+            elif name not in self.LITERAL_OPCODES:
+                return False
+
+        return True
+
+
+config_loader = ConfigLoader()
 
 
 def make_tempfile(content=None):
@@ -71,6 +249,30 @@ def make_tempfile(content=None):
     return tmpfile
 
 
+def make_spooled_tempfile(max_size):
+    """
+    Creates an anonymous temporary file that's kept in memory until it
+    grows past max_size bytes, and then moves to disk. Python 2.5 and older
+    don't have SpooledTemporaryFile, so it's always on disk there.
+    """
+    if hasattr(tempfile, 'SpooledTemporaryFile'):
+        return tempfile.SpooledTemporaryFile(max_size)
+
+    return tempfile.TemporaryFile()
+
+
+def replace_file(src, dest):
+    """
+    Moves src over dest. On POSIX systems this is atomic, so other processes
+    will only ever see either the old or the new dest. Windows can't rename
+    over an existing file, so dest is removed first there.
+    """
+    if sys.platform.startswith('win') and os.path.exists(dest):
+        os.unlink(dest)
+
+    os.rename(src, dest)
+
+
 def walk_parents(path):
     """
     Walks up the tree to the root directory.
@@ -0,0 +1,176 @@
+import sys
+import threading
+
+
+def parallel_map(func, items, max_workers=4):
+    """
+    Calls func on each item using up to max_workers threads, and returns
+    the results in the same order as the items.
+
+    If any call raises an exception (including SystemExit from die()), the
+    remaining items are skipped and the first exception is re-raised in
+    the calling thread.
+    """
+    items = list(items)
+    results = [None] * len(items)
+
+    if len(items) <= 1 or max_workers <= 1:
+        return [func(item) for item in items]
+
+    lock = threading.Lock()
+    state = {
+        'next': 0,
+        'error': None,
+    }
+
+    def worker():
+        while True:
+            lock.acquire()
+
+            try:
+                i = state['next']
+
+                if i >= len(items) or state['error']:
+                    return
+
+                state['next'] = i + 1
+            finally:
+                lock.release()
+
+            try:
+                results[i] = func(items[i])
+            except:
+                lock.acquire()
+
+                try:
+                    if not state['error']:
+                        state['error'] = sys.exc_info()
+                finally:
+                    lock.release()
+
+    threads = []
+
+    for i in range(min(max_workers, len(items))):
+        thread = threading.Thread(target=worker)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    if state['error']:
+        exc_type, exc_value, exc_traceback = state['error']
+        raise exc_type, exc_value, exc_traceback
+
+    return results
+
+
+def parallel_first(func, items, max_workers=4):
+    """
+    Calls func on each item using up to max_workers threads, and returns
+    the index of the first item (in list order) for which func returned a
+    true value, along with that value, or (None, None) if there is none.
+
+    The items are in priority order, so the result is the same as trying
+    them one at a time. Once an item has succeeded, the items after it that
+    haven't been started are skipped, and the ones still running aren't
+    waited on. An exception (including SystemExit from die()) is re-raised
+    only if no item before it succeeded.
+    """
+    items = list(items)
+    condition = threading.Condition()
+    state = {
+        'next': 0,
+        'cancel_after': len(items),
+        'results': {},
+    }
+
+    def worker():
+        while True:
+            condition.acquire()
+
+            try:
+                i = state['next']
+
+                if i >= len(items) or i > state['cancel_after']:
+                    return
+
+                state['next'] = i + 1
+            finally:
+                condition.release()
+
+            try:
+                result = (func(items[i]), None)
+            except:
+                result = (None, sys.exc_info())
+
+            condition.acquire()
+
+            try:
+                state['results'][i] = result
+
+                if result[0]:
+                    state['cancel_after'] = min(state['cancel_after'], i)
+
+                condition.notifyAll()
+            finally:
+                condition.release()
+
+    for i in range(min(max_workers, len(items))):
+        thread = threading.Thread(target=worker)
+        thread.setDaemon(True)
+        thread.start()
+
+    for i in range(len(items)):
+        condition.acquire()
+
+        try:
+            while i not in state['results']:
+                condition.wait()
+
+            value, error = state['results'][i]
+        finally:
+            condition.release()
+
+        if error:
+            exc_type, exc_value, exc_traceback = error
+            raise exc_type, exc_value, exc_traceback
+        elif value:
+            return i, value
+
+    return None, None
+
+
+class BackgroundCall(object):
+    """A function call running in a separate thread.
+
+    The call starts as soon as this is constructed. join() waits for it to
+    finish and returns its result, or re-raises its exception (including
+    SystemExit from die()) in the calling thread.
+    """
+    def __init__(self, func, *args, **kwargs):
+        self.result = None
+        self.error = None
+        self._thread = threading.Thread(target=self._run,
+                                        args=(func, args, kwargs))
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def join(self):
+        """Waits for the call to finish and returns its result."""
+        # A join without a timeout can't be interrupted by Control-C.
+        while self._thread.isAlive():
+            self._thread.join(0.1)
+
+        if self.error:
+            exc_type, exc_value, exc_traceback = self.error
+            raise exc_type, exc_value, exc_traceback
+
+        return self.result
+
+    def _run(self, func, args, kwargs):
+        try:
+            self.result = func(*args, **kwargs)
+        except:
+            self.error = sys.exc_info()
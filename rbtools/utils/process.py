@@ -1,7 +1,12 @@
 import logging
 import os
+import signal
 import subprocess
 import sys
+import threading
+import time
+
+from rbtools.utils.timings import timings
 
 
 def die(msg=None):
@@ -19,6 +24,20 @@ def die(msg=None):
     sys.exit(1)
 
 
+# The timeout, in seconds, for commands run without an explicit timeout.
+# None means they can run for as long as they like.
+default_timeout = None
+
+
+def set_default_timeout(timeout):
+    """
+    Sets the timeout, in seconds, for commands run without an explicit
+    timeout. None disables it.
+    """
+    global default_timeout
+    default_timeout = timeout
+
+
 def execute(command,
             env=None,
             split_lines=False,
@@ -26,59 +45,293 @@ def execute(command,
             extra_ignore_errors=(),
             translate_newlines=True,
             with_errors=True,
-            none_on_ignored_error=False):
+            none_on_ignored_error=False,
+            timeout=None,
+            cwd=None):
     """
     Utility function to execute a command and return the output.
+
+    If with_errors is False, the command's standard error is kept out of
+    the output, and only shown if the command fails.
+
+    If the command runs for longer than timeout seconds (or the default
+    timeout set with set_default_timeout()), it's killed and post-review
+    exits.
+
+    The command is run in cwd, if given, rather than the current directory.
     """
-    if isinstance(command, list):
-        logging.debug('Running: ' + subprocess.list2cmdline(command))
-    else:
-        logging.debug('Running: ' + command)
-
-    if env:
-        env.update(os.environ)
-    else:
-        env = os.environ.copy()
-
-    env['LC_ALL'] = 'en_US.UTF-8'
-    env['LANGUAGE'] = 'en_US.UTF-8'
-
-    if with_errors:
-        errors_output = subprocess.STDOUT
-    else:
-        errors_output = subprocess.PIPE
-
-    if sys.platform.startswith('win'):
-        p = subprocess.Popen(command,
-                             stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE,
-                             stderr=errors_output,
-                             shell=False,
-                             universal_newlines=translate_newlines,
-                             env=env)
-    else:
-        p = subprocess.Popen(command,
-                             stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE,
-                             stderr=errors_output,
-                             shell=False,
-                             close_fds=True,
-                             universal_newlines=translate_newlines,
-                             env=env)
-    if split_lines:
-        data = p.stdout.readlines()
-    else:
-        data = p.stdout.read()
-
-    rc = p.wait()
+    child = ChildProcess(command, env, translate_newlines, with_errors,
+                         timeout, cwd)
+
+    try:
+        if split_lines:
+            data = child.stdout.readlines()
+            child.bytes_read = sum([len(line) for line in data])
+        else:
+            data = child.stdout.read()
+            child.bytes_read = len(data)
+
+        rc = child.wait()
+    except KeyboardInterrupt:
+        child.kill()
+        raise
 
     if rc and not ignore_errors and rc not in extra_ignore_errors:
-        die('Failed to execute command: %s\n%s' % (command, data))
+        die('Failed to execute command: %s\n%s%s' %
+            (command, _join_output(data), child.errors))
     elif rc:
-        logging.debug('Command exited with rc %s: %s\n%s---'
-                      % (rc, command, data))
+        logging.debug('Command exited with rc %s: %s\n%s%s---'
+                      % (rc, command, _join_output(data), child.errors))
 
     if rc and none_on_ignored_error:
         return None
 
     return data
+
+
+def execute_stream(command,
+                   env=None,
+                   ignore_errors=False,
+                   extra_ignore_errors=(),
+                   translate_newlines=True,
+                   with_errors=True,
+                   chunk_size=None,
+                   timeout=None,
+                   cwd=None):
+    """
+    Executes a command and returns an iterator over its output, yielding
+    each line (or, if chunk_size is given, each chunk of up to chunk_size
+    bytes) as soon as the command produces it.
+
+    This is for commands whose output may be too large to comfortably hold
+    in memory, such as diffs. The exit code is checked once all the output
+    has been read, the same way execute() does.
+    """
+    return OutputStream(ChildProcess(command, env, translate_newlines,
+                                     with_errors, timeout, cwd),
+                        ignore_errors, extra_ignore_errors, chunk_size)
+
+
+class OutputStream(object):
+    """An iterator over the output of a running command.
+
+    Once the output has been read to the end, the command's exit code is
+    available as rc. As with execute(), a failing exit code exits
+    post-review, unless it's ignored. Only the last ERROR_CONTEXT lines or
+    chunks of output are kept around to show in the error message.
+
+    If the output isn't read to the end, close() should be called to stop
+    the command and clean up after it.
+    """
+    ERROR_CONTEXT = 20
+
+    def __init__(self, child, ignore_errors=False, extra_ignore_errors=(),
+                 chunk_size=None):
+        self.command = child.command
+        self.rc = None
+        self._child = child
+        self._ignore_errors = ignore_errors
+        self._extra_ignore_errors = extra_ignore_errors
+        self._chunk_size = chunk_size
+        self._tail = []
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.rc is not None:
+            raise StopIteration
+
+        try:
+            if self._chunk_size:
+                data = self._child.stdout.read(self._chunk_size)
+            else:
+                data = self._child.stdout.readline()
+        except KeyboardInterrupt:
+            self.close()
+            raise
+
+        if not data:
+            self._finish()
+            raise StopIteration
+
+        self._child.bytes_read += len(data)
+        self._tail.append(data)
+
+        if len(self._tail) > self.ERROR_CONTEXT:
+            del self._tail[0]
+
+        return data
+
+    def close(self):
+        """Stops the command, if it's still running.
+
+        Its exit code is not checked.
+        """
+        if self.rc is None:
+            self._child.kill()
+            self._child.stdout.close()
+            self.rc = self._child.wait(check_timeout=False)
+
+    def _finish(self):
+        rc = self.rc = self._child.wait()
+
+        if (rc and not self._ignore_errors and
+            rc not in self._extra_ignore_errors):
+            die('Failed to execute command: %s\n%s%s' %
+                (self.command, ''.join(self._tail), self._child.errors))
+        elif rc:
+            logging.debug('Command exited with rc %s: %s\n%s%s---'
+                          % (rc, self.command, ''.join(self._tail),
+                             self._child.errors))
+
+
+class ChildProcess(object):
+    """A command started with its output going to a pipe.
+
+    The command's standard input is closed, so it can't sit waiting for
+    input that will never come. If with_errors is False, its standard error
+    is read into errors by a separate thread, so that a command writing a
+    lot to both can't fill up one pipe while we're blocked reading the
+    other.
+
+    If the command runs for longer than timeout seconds (or the default
+    timeout), it's killed, along with any processes it started, and wait()
+    exits post-review. Commands with a timeout are run in their own process
+    group for this, on platforms that have them.
+
+    Once it has exited, the command's run time, exit code and bytes_read
+    (which the reader of stdout keeps up to date) are recorded in the
+    command timings.
+    """
+    def __init__(self, command, env=None, translate_newlines=True,
+                 with_errors=True, timeout=None, cwd=None):
+        if isinstance(command, list):
+            logging.debug('Running: ' + subprocess.list2cmdline(command))
+        else:
+            logging.debug('Running: ' + command)
+
+        if env:
+            env.update(os.environ)
+        else:
+            env = os.environ.copy()
+
+        env['LC_ALL'] = 'en_US.UTF-8'
+        env['LANGUAGE'] = 'en_US.UTF-8'
+
+        if timeout is None:
+            timeout = default_timeout
+
+        if with_errors:
+            errors_output = subprocess.STDOUT
+        else:
+            errors_output = subprocess.PIPE
+
+        self.command = command
+        self.timeout = timeout
+        self.timed_out = False
+        self.start_time = time.time()
+        self.elapsed = None
+        self.bytes_read = 0
+        self._errors = []
+        self._errors_thread = None
+        self._timer = None
+        self._new_group = bool(timeout) and hasattr(os, 'killpg')
+
+        if sys.platform.startswith('win'):
+            self.p = subprocess.Popen(command,
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=errors_output,
+                                      shell=False,
+                                      universal_newlines=translate_newlines,
+                                      env=env,
+                                      cwd=cwd)
+        else:
+            if self._new_group:
+                preexec_fn = os.setpgrp
+            else:
+                preexec_fn = None
+
+            self.p = subprocess.Popen(command,
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=errors_output,
+                                      shell=False,
+                                      close_fds=True,
+                                      preexec_fn=preexec_fn,
+                                      universal_newlines=translate_newlines,
+                                      env=env,
+                                      cwd=cwd)
+
+        self.p.stdin.close()
+        self.stdout = self.p.stdout
+
+        if not with_errors:
+            self._errors_thread = threading.Thread(target=self._read_errors)
+            self._errors_thread.setDaemon(True)
+            self._errors_thread.start()
+
+        if timeout:
+            self._timer = threading.Timer(timeout, self._on_timeout)
+            self._timer.setDaemon(True)
+            self._timer.start()
+
+    def _get_errors(self):
+        return ''.join(self._errors)
+
+    errors = property(_get_errors)
+
+    def wait(self, check_timeout=True):
+        """
+        Waits for the command to exit and returns its exit code.
+
+        If the command was killed for running too long, this exits
+        post-review, unless check_timeout is False.
+        """
+        rc = self.p.wait()
+        self.elapsed = time.time() - self.start_time
+
+        if self._timer:
+            self._timer.cancel()
+
+        if self._errors_thread:
+            self._errors_thread.join()
+
+        timings.record(self.command, self.elapsed, self.bytes_read, rc)
+
+        if self.timed_out and check_timeout:
+            die('Command timed out after %.1f seconds: %s' %
+                (self.elapsed, self.command))
+
+        return rc
+
+    def kill(self):
+        """Kills the command, and any processes it started, if possible."""
+        try:
+            if self._new_group:
+                os.killpg(self.p.pid, signal.SIGKILL)
+            elif sys.platform.startswith('win'):
+                subprocess.call(['taskkill', '/F', '/T', '/PID',
+                                 str(self.p.pid)],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+            else:
+                os.kill(self.p.pid, signal.SIGKILL)
+        except OSError:
+            # It already exited.
+            pass
+
+    def _on_timeout(self):
+        self.timed_out = True
+        self.kill()
+
+    def _read_errors(self):
+        self._errors.append(self.p.stderr.read())
+
+
+def _join_output(data):
+    if isinstance(data, list):
+        return ''.join(data)
+
+    return data
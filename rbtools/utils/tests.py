@@ -3,18 +3,64 @@
 Any new modules created under rbtools/api should be tested here."""
 import os
 import re
+import subprocess
 import sys
+import time
 
-from rbtools.utils import checks, filesystem, process
+from rbtools.utils import cache, checks, diffcache, filesystem, parallel, \
+                          process, timings
 from rbtools.utils.testbase import RBTestBase
 
 
 class UtilitiesTest(RBTestBase):
+    def setUp(self):
+        super(UtilitiesTest, self).setUp()
+
+        # The probe cache lives in the home directory, which is different
+        # for each test.
+        checks._probe_cache = None
+
     def test_check_install(self):
         """Test 'check_install' method."""
         self.assertTrue(checks.check_install(sys.executable + ' --version'))
         self.assertFalse(checks.check_install(self.gen_uuid()))
 
+    def test_check_install_found(self):
+        """Test 'check_install' method not running commands it can find."""
+        probes = len(checks._probes)
+        self.assertTrue(checks.check_install(sys.executable + ' --version'))
+        self.assertEqual(len(checks._probes), probes)
+
+    def test_wait_for_probes(self):
+        """Test waiting for probe processes on exit."""
+        p = subprocess.Popen([sys.executable, '-c', 'pass'])
+        checks._add_probe(p)
+        checks._wait_for_probes()
+        self.assertEqual(checks._probes, [])
+        self.assertEqual(p.returncode, 0)
+
+    def test_find_executable(self):
+        """Test 'find_executable' method."""
+        self.assertEqual(checks.find_executable(sys.executable),
+                         os.path.abspath(sys.executable))
+        self.assertEqual(checks.find_executable(self.gen_uuid()), None)
+
+        bin_dir = self.create_tmp_dir()
+        tool = os.path.join(bin_dir, 'rbtools-test-tool')
+        open(tool, 'w').close()
+        os.chmod(tool, 0755)
+
+        old_path = os.environ['PATH']
+        os.environ['PATH'] = bin_dir + os.pathsep + old_path
+
+        try:
+            self.assertEqual(checks.find_executable('rbtools-test-tool'),
+                             tool)
+        finally:
+            os.environ['PATH'] = old_path
+            os.unlink(tool)
+            os.rmdir(bin_dir)
+
     def test_make_tempfile(self):
         """Test 'make_tempfile' method."""
         fname = filesystem.make_tempfile()
@@ -28,6 +74,462 @@ class UtilitiesTest(RBTestBase):
         self.assertTrue(re.match('.*?%d.%d.%d' % sys.version_info[:3],
                         process.execute([sys.executable, '-V'])))
 
+    def test_execute_stream(self):
+        """Test 'execute_stream' method."""
+        script = ('import sys\n'
+                  'for i in range(3): sys.stdout.write("line %d\\n" % i)')
+        stream = process.execute_stream([sys.executable, '-c', script])
+
+        self.assertEqual(list(stream), ['line 0\n', 'line 1\n', 'line 2\n'])
+        self.assertEqual(stream.rc, 0)
+
+        stream = process.execute_stream([sys.executable, '-c', script],
+                                        chunk_size=4)
+        chunks = list(stream)
+        self.assertEqual(chunks[0], 'line')
+        self.assertEqual(''.join(chunks), 'line 0\nline 1\nline 2\n')
+
+    def test_execute_stream_errors(self):
+        """Test 'execute_stream' method with a failing command."""
+        script = 'import sys\nprint "output"\nsys.exit(2)'
+        stream = process.execute_stream([sys.executable, '-c', script])
+        self.assertRaises(SystemExit, list, stream)
+
+        stream = process.execute_stream([sys.executable, '-c', script],
+                                        extra_ignore_errors=(2,))
+        self.assertEqual(list(stream), ['output\n'])
+        self.assertEqual(stream.rc, 2)
+
+    def test_execute_stream_close(self):
+        """Test closing 'execute_stream' output before the end."""
+        script = 'while True: print "x" * 100'
+        stream = process.execute_stream([sys.executable, '-c', script])
+
+        self.assertEqual(stream.next(), 'x' * 100 + '\n')
+        stream.close()
+        self.assertNotEqual(stream.rc, None)
+        self.assertRaises(StopIteration, stream.next)
+
+    def test_execute_without_errors(self):
+        """Test 'execute' method keeping errors out of the output."""
+        script = ('import sys\n'
+                  'sys.stderr.write("e" * 100000)\n'
+                  'sys.stdout.write("output")')
+        self.assertEqual(process.execute([sys.executable, '-c', script],
+                                         with_errors=False),
+                         'output')
+
+    def test_execute_stdin_closed(self):
+        """Test 'execute' method closing the command's input."""
+        script = 'import sys\nprint repr(sys.stdin.read())'
+        self.assertEqual(process.execute([sys.executable, '-c', script]),
+                         "''\n")
+
+    def test_execute_timeout(self):
+        """Test 'execute' method killing a command that times out."""
+        script = 'import time\ntime.sleep(30)'
+        start = time.time()
+        self.assertRaises(SystemExit, process.execute,
+                          [sys.executable, '-c', script], timeout=0.5)
+        self.assertTrue(time.time() - start < 10)
+
+        process.set_default_timeout(0.5)
+
+        try:
+            self.assertRaises(SystemExit, process.execute,
+                              [sys.executable, '-c', script])
+        finally:
+            process.set_default_timeout(None)
+
     def test_die(self):
         """Test 'die' method."""
         self.assertRaises(SystemExit, process.die)
+
+
+class ConfigLoaderTest(RBTestBase):
+    def setUp(self):
+        super(ConfigLoaderTest, self).setUp()
+        self.orig_dir = os.getcwd()
+
+    def tearDown(self):
+        os.chdir(self.orig_dir)
+
+    def test_load_cached(self):
+        """Test 'ConfigLoader' caching configs between runs"""
+        path = self.chdir_tmp()
+        self._write_config(path, 'REVIEWBOARD_URL = "http://example.com/"\n'
+                                 'TREES = {"a": {"PUBLISH": True}}\n')
+
+        loader = filesystem.ConfigLoader()
+        config = loader.load(path)
+        self.assertEqual(config['REVIEWBOARD_URL'], 'http://example.com/')
+        self.assertEqual(config['TREES'], {'a': {'PUBLISH': True}})
+        cache.save_caches()
+
+        loader = filesystem.ConfigLoader()
+        config = loader.load(path)
+        self.assertEqual(config['TREES'], {'a': {'PUBLISH': True}})
+        self.assertEqual(loader.loaded,
+                         [(os.path.join(path, '.reviewboardrc'),
+                           'cached config')])
+
+    def test_load_code_cached(self):
+        """Test 'ConfigLoader' caching the code of non-literal configs"""
+        path = self.chdir_tmp()
+        self._write_config(path,
+                           'import os\nVALUE = os.environ["RBTOOLS_TEST"]\n')
+
+        os.environ['RBTOOLS_TEST'] = 'first'
+        loader = filesystem.ConfigLoader()
+        self.assertEqual(loader.load(path)['VALUE'], 'first')
+        cache.save_caches()
+
+        os.environ['RBTOOLS_TEST'] = 'second'
+        loader = filesystem.ConfigLoader()
+        self.assertEqual(loader.load(path)['VALUE'], 'second')
+        self.assertEqual(loader.loaded[0][1], 'cached code')
+        del os.environ['RBTOOLS_TEST']
+
+    def test_load_bad_cached_code(self):
+        """Test 'ConfigLoader' compiling again if the cached code is bad"""
+        path = self.chdir_tmp()
+        self._write_config(path, 'import os\nVALUE = os.name\n')
+
+        loader = filesystem.ConfigLoader()
+        loader.load(path)
+        entry = loader._cache.get(os.path.join(path, '.reviewboardrc'))
+        entry['code'] = entry['code'][:10]
+
+        self.assertEqual(loader.load(path)['VALUE'], os.name)
+        self.assertEqual(loader.loaded[1][1], 'compiled')
+
+    def test_load_changed(self):
+        """Test 'ConfigLoader' reloading changed configs"""
+        path = self.chdir_tmp()
+        self._write_config(path, 'PUBLISH = False\n')
+
+        loader = filesystem.ConfigLoader()
+        self.assertFalse(loader.load(path)['PUBLISH'])
+
+        self._write_config(path, 'PUBLISH = True\n')
+        os.utime(os.path.join(path, '.reviewboardrc'), (0, 0))
+        self.assertTrue(loader.load(path)['PUBLISH'])
+        self.assertEqual(loader.loaded[1][1], 'compiled')
+
+    def test_search_boundaries(self):
+        """Test 'load_config_files' stopping at boundaries"""
+        home = self.get_user_home()
+        top = self.chdir_tmp()
+        repo = os.path.join(top, 'repo')
+        os.makedirs(os.path.join(repo, '.git'))
+        self._write_config(top, 'TOP = True\n')
+        self._write_config(repo, 'REPO = True\n')
+        os.chdir(repo)
+
+        user_config, configs = filesystem.load_config_files(home)
+        self.assertEqual(user_config, None)
+        self.assertEqual(len(configs), 2)
+
+        self._write_config(home, 'CONFIG_SEARCH_BOUNDARIES = [".git"]\n')
+        user_config, configs = filesystem.load_config_files(home)
+        self.assertEqual(len(configs), 1)
+        self.assertTrue(configs[0]['REPO'])
+
+    def test_disable_cache(self):
+        """Test 'load_config_files' honouring DISABLE_CACHE at home"""
+        home = self.get_user_home()
+        self._write_config(home, 'DISABLE_CACHE = True\n')
+        path = self.chdir_tmp()
+        self._write_config(path, 'PUBLISH = True\n')
+        old_loader = filesystem.config_loader
+
+        try:
+            # Nothing is cached by the first run, so the second run has to
+            # compile both configs again.
+            for i in range(2):
+                cache.set_caches_persistent(True)
+                filesystem.config_loader = filesystem.ConfigLoader()
+                user_config, configs = filesystem.load_config_files(home)
+                cache.save_caches()
+
+            self.assertTrue(configs[0]['PUBLISH'])
+            self.assertEqual(filesystem.config_loader.loaded, [
+                (os.path.join(home, '.reviewboardrc'), 'compiled'),
+                (os.path.join(path, '.reviewboardrc'), 'compiled'),
+            ])
+        finally:
+            cache.set_caches_persistent(True)
+            filesystem.config_loader = old_loader
+
+    def _write_config(self, path, content):
+        fp = open(os.path.join(path, '.reviewboardrc'), 'w')
+        fp.write(content)
+        fp.close()
+
+
+class CacheTest(RBTestBase):
+    def test_save_and_load(self):
+        """Test 'Cache' persisting values between runs"""
+        c = cache.Cache('test')
+        self.assertEqual(c.get('key'), None)
+        c.set('key', {'value': 1})
+        c.save()
+
+        self.assertTrue(os.path.exists(os.path.join(cache.get_cache_dir(),
+                                                    'test')))
+        self.assertEqual(cache.Cache('test').get('key'), {'value': 1})
+
+    def test_ttl(self):
+        """Test 'Cache' expiring old entries"""
+        c = cache.Cache('test', ttl=60)
+        c.set('key', 'value')
+        self.assertEqual(c.get('key'), 'value')
+
+        c._entries['key'] = (time.time() - 120, 'value')
+        self.assertEqual(c.get('key'), None)
+        self.assertEqual(c.get('key', 'default'), 'default')
+
+    def test_save_unchanged(self):
+        """Test 'Cache' not writing a file when nothing changed"""
+        c = cache.Cache('test')
+        c.get('key')
+        c.save()
+        self.assertFalse(os.path.exists(c.filename))
+
+    def test_other_version(self):
+        """Test 'Cache' discarding files from another version"""
+        c = cache.Cache('test')
+        c.set('key', 'value')
+        c.save()
+
+        old_format = cache.CACHE_FORMAT
+        cache.CACHE_FORMAT = old_format + 1
+
+        try:
+            self.assertEqual(cache.Cache('test').get('key'), None)
+        finally:
+            cache.CACHE_FORMAT = old_format
+
+
+    def test_not_persistent(self):
+        """Test 'Cache' when caches aren't persistent"""
+        c = cache.Cache('test')
+        c.set('key', 'value')
+        c.save()
+
+        cache.set_caches_persistent(False)
+
+        try:
+            c = cache.Cache('test')
+            self.assertEqual(c.get('key'), None)
+            c.set('key', 'other')
+            c.save()
+        finally:
+            cache.set_caches_persistent(True)
+
+        c = cache.Cache('test')
+        self.assertEqual(c.get('key'), 'value')
+
+
+class FileCacheTest(RBTestBase):
+    def test_entries(self):
+        """Test 'FileCache' storing each entry in its own file"""
+        c = cache.FileCache('test', 1024)
+        self.assertEqual(c.get('a'), None)
+        c.set('a', 'value a')
+        c.set('b', 'value b')
+        self.assertEqual(len(os.listdir(c.dirname)), 2)
+
+        c = cache.FileCache('test', 1024)
+        self.assertEqual(c.get('a'), 'value a')
+        c.remove('a')
+        self.assertEqual(c.get('a'), None)
+        self.assertEqual(c.get('b'), 'value b')
+
+    def test_not_persistent(self):
+        """Test 'FileCache' when caches aren't persistent"""
+        cache.set_caches_persistent(False)
+
+        try:
+            c = cache.FileCache('test', 1024)
+            c.set('a', 'value a')
+            self.assertEqual(c.get('a'), 'value a')
+        finally:
+            cache.set_caches_persistent(True)
+
+        self.assertFalse(os.path.exists(c.dirname))
+
+
+class DiffCacheTest(RBTestBase):
+    def test_store_and_get(self):
+        """Test 'DiffCache' storing diffs compressed"""
+        diff = 'diff --git a/foo b/foo\n' * 100
+        c = diffcache.DiffCache()
+        key = diffcache.make_diff_key('GitClient', ('abc', 'def'), ())
+
+        self.assertEqual(c.get(key), None)
+        c.store(key, diff, None)
+        self.assertEqual(c.get(key), (diff, None))
+
+        entry = c.cache.get(key)
+        self.assertTrue(len(entry[0]) < len(diff))
+        self.assertEqual(entry[1], None)
+
+    def test_eviction(self):
+        """Test 'DiffCache' evicting the least recently used diffs"""
+        diffs = [os.urandom(1000) for i in range(3)]
+        c = diffcache.DiffCache(max_size=2500)
+
+        c.store('a', diffs[0], None)
+        time.sleep(0.01)
+        c.store('b', diffs[1], None)
+        time.sleep(0.01)
+        c.get('a')
+        time.sleep(0.01)
+        c.store('c', diffs[2], None)
+
+        self.assertEqual(c.get('a'), (diffs[0], None))
+        self.assertEqual(c.get('b'), None)
+        self.assertEqual(c.get('c'), (diffs[2], None))
+
+
+class ParallelTest(RBTestBase):
+    def test_parallel_map(self):
+        """Test 'parallel_map' returning results in order"""
+        def slow_square(n):
+            time.sleep((10 - n) * 0.005)
+            return n * n
+
+        self.assertEqual(parallel.parallel_map(slow_square, range(10), 4),
+                         [n * n for n in range(10)])
+
+    def test_parallel_map_error(self):
+        """Test 'parallel_map' re-raising errors from workers"""
+        def fail(n):
+            if n == 3:
+                process.die()
+
+            return n
+
+        self.assertRaises(SystemExit, parallel.parallel_map, fail, range(6))
+
+
+    def test_parallel_first(self):
+        """Test 'parallel_first' returning the highest priority result"""
+        def probe(n):
+            # Later items finish first.
+            time.sleep(0.05 * (5 - n))
+
+            if n >= 2:
+                return n * 10
+
+            return None
+
+        self.assertEqual(parallel.parallel_first(probe, range(5)), (2, 20))
+        self.assertEqual(parallel.parallel_first(lambda n: None, range(5)),
+                         (None, None))
+
+    def test_parallel_first_skip(self):
+        """Test 'parallel_first' skipping items after a success"""
+        started = []
+
+        def probe(n):
+            started.append(n)
+            return n == 0
+
+        self.assertEqual(parallel.parallel_first(probe, range(10),
+                                                 max_workers=1),
+                         (0, True))
+        self.assertEqual(started, [0])
+
+    def test_parallel_first_error(self):
+        """Test 'parallel_first' exceptions"""
+        def fail_first(n):
+            if n == 0:
+                process.die()
+
+            return True
+
+        self.assertRaises(SystemExit, parallel.parallel_first, fail_first,
+                          range(3))
+
+        def fail_later(n):
+            if n == 2:
+                raise ValueError
+
+            return n == 1
+
+        self.assertEqual(parallel.parallel_first(fail_later, range(3)),
+                         (1, True))
+
+    def test_background_call(self):
+        """Test 'BackgroundCall' running alongside the caller"""
+        started = []
+
+        def work(a, b=0):
+            started.append(True)
+            time.sleep(0.2)
+            return a + b
+
+        call = parallel.BackgroundCall(work, 1, b=2)
+        time.sleep(0.2)
+        self.assertEqual(started, [True])
+        self.assertEqual(call.join(), 3)
+
+    def test_background_call_error(self):
+        """Test 'BackgroundCall' re-raising exceptions on join"""
+        call = parallel.BackgroundCall(process.die)
+        self.assertRaises(SystemExit, call.join)
+
+
+class TimingsTest(RBTestBase):
+    def test_command_name(self):
+        """Test grouping commands by name"""
+        self.assertEqual(timings.get_command_name(['svn', 'info', 'foo']),
+                         'svn info')
+        self.assertEqual(timings.get_command_name(['p4', '-G', 'print']),
+                         'p4 print')
+        self.assertEqual(timings.get_command_name('/usr/bin/git --help'),
+                         'git')
+
+        # Option values, such as passwords, are never taken as the
+        # subcommand.
+        self.assertEqual(timings.get_command_name(
+            ['p4', '-P', 'secret', '-u', 'user', 'describe', '-s', '1']),
+            'p4 describe')
+        self.assertEqual(timings.get_command_name(
+            ['svn', '--password', 'secret', 'info']),
+            'svn info')
+        self.assertEqual(timings.get_command_name(['p4', '-P', 'S3cr3t!']),
+                         'p4')
+        self.assertEqual(timings.get_command_name(['tool', 'secret', 'x']),
+                         'tool')
+
+    def test_record(self):
+        """Test recording command timings"""
+        t = timings.CommandTimings()
+        t.record(['svn', 'info', 'a'], 0.5, 100, 0)
+        t.record(['svn', 'info', 'b'], 1.5, 50, 1)
+        t.record(['svn', 'diff'], 3.0)
+
+        self.assertEqual(t.groups['svn info'], {
+            'count': 2,
+            'time': 2.0,
+            'max_time': 1.5,
+            'bytes': 150,
+            'failures': 1,
+        })
+
+        report = t.get_report().splitlines()
+        self.assertTrue(report[1].startswith('svn diff '))
+        self.assertTrue(report[2].startswith('svn info '))
+        self.assertTrue(report[3].startswith('Total '))
+
+    def test_execute_recorded(self):
+        """Test 'execute' recording command timings"""
+        command = [sys.executable, '-c', 'print "x" * 9']
+        process.execute(command)
+        group = timings.timings.groups[timings.get_command_name(command)]
+
+        self.assertTrue(group['count'] >= 1)
+        self.assertTrue(group['bytes'] >= 10)
@@ -0,0 +1,154 @@
+import os
+import re
+import threading
+import time
+
+try:
+    from json import dumps as json_dumps
+except ImportError:
+    from simplejson import dumps as json_dumps
+
+from rbtools import get_package_version
+
+
+# The options taking a separate value that can come before the subcommand,
+# for the programs post-review runs. Their values, which can include
+# passwords, must never be mistaken for the subcommand.
+OPTIONS_WITH_VALUES = {
+    'cleartool': (),
+    'cm': (),
+    'cvs': ('-d', '-e', '-s', '-T', '-z'),
+    'git': ('-c', '-C', '--exec-path', '--git-dir', '--namespace',
+            '--work-tree'),
+    'hg': ('-R', '--config', '--cwd', '--encoding', '--repository'),
+    'p': (),
+    'p4': ('-c', '-C', '-d', '-H', '-L', '-p', '-P', '-q', '-Q', '-u', '-x',
+           '-z'),
+    'svn': ('--config-dir', '--config-option', '--password', '--username'),
+}
+
+SUBCOMMAND_RE = re.compile(r'^[a-z][a-z0-9-]*$')
+
+
+class CommandTimings(object):
+    """Accounting of the external commands run by post-review.
+
+    Each command run is recorded along with how long it took, how much
+    output was read from it and its exit code. The records are grouped by
+    command name and subcommand (such as "svn info" or "p4 print"), which
+    is where the time generally goes when post-review is slow.
+    """
+    def __init__(self):
+        self.groups = {}
+        self._lock = threading.Lock()
+
+    def record(self, command, elapsed, bytes_read=None, rc=None):
+        """Records a run of a command.
+
+        bytes_read and rc may be None if they aren't known.
+        """
+        name = get_command_name(command)
+
+        self._lock.acquire()
+
+        try:
+            group = self.groups.setdefault(name, {
+                'count': 0,
+                'time': 0.0,
+                'max_time': 0.0,
+                'bytes': 0,
+                'failures': 0,
+            })
+            group['count'] += 1
+            group['time'] += elapsed
+            group['max_time'] = max(group['max_time'], elapsed)
+
+            if bytes_read:
+                group['bytes'] += bytes_read
+
+            if rc:
+                group['failures'] += 1
+        finally:
+            self._lock.release()
+
+    def get_report(self):
+        """Returns a table of the timings, slowest commands first."""
+        lines = ['%-24s %7s %10s %9s %12s %7s' %
+                 ('Command', 'Count', 'Total', 'Max', 'Bytes', 'Failed')]
+        total_count = 0
+        total_time = 0.0
+
+        for name, group in self._get_sorted_groups():
+            lines.append('%-24s %7d %9.2fs %8.2fs %12d %7d' %
+                         (name, group['count'], group['time'],
+                          group['max_time'], group['bytes'],
+                          group['failures']))
+            total_count += group['count']
+            total_time += group['time']
+
+        lines.append('%-24s %7d %9.2fs' % ('Total', total_count, total_time))
+
+        return '\n'.join(lines)
+
+    def write_json(self, filename):
+        """Writes the timings to a JSON file, for tracking them over time."""
+        fp = open(filename, 'w')
+
+        try:
+            fp.write(json_dumps({
+                'version': get_package_version(),
+                'time': time.time(),
+                'commands': dict(self._get_sorted_groups()),
+            }, indent=2))
+        finally:
+            fp.close()
+
+    def _get_sorted_groups(self):
+        groups = self.groups.items()
+        groups.sort(key=lambda item: item[1]['time'], reverse=True)
+
+        return groups
+
+
+def get_command_name(command):
+    """
+    Returns the name a command is grouped under: the program name and the
+    subcommand, if any.
+
+    The subcommand is the first argument that isn't an option or an
+    option's value. For programs that aren't in OPTIONS_WITH_VALUES, or
+    when the argument doesn't look like a subcommand, the program name is
+    used on its own, so that arguments such as passwords never end up in
+    the timings.
+    """
+    if isinstance(command, basestring):
+        command = command.split(' ')
+
+    if not command:
+        return ''
+
+    name = os.path.splitext(os.path.basename(command[0]))[0]
+    options_with_values = OPTIONS_WITH_VALUES.get(name)
+
+    if options_with_values is None:
+        return name
+
+    i = 1
+
+    while i < len(command):
+        arg = command[i]
+
+        if arg in options_with_values:
+            # Skip the option's value.
+            i += 2
+        elif arg.startswith('-'):
+            i += 1
+        elif SUBCOMMAND_RE.match(arg):
+            return '%s %s' % (name, arg)
+        else:
+            break
+
+    return name
+
+
+timings = CommandTimings()